@@ -27,8 +27,8 @@ def _load_settings(filename='settings.json'):
     """
     Returns a dict from the `filename` JSON contents.
 
-    Updates the relative paths under levels.*.folder to absolute paths, assuming
-    them to be relative to this module's directory.
+    Updates the relative paths under levels.*.folder and player.metadata_cache
+    to absolute paths, assuming them to be relative to this module's directory.
     """
 
     # Load from this file's directory.
@@ -46,6 +46,14 @@ def _load_settings(filename='settings.json'):
                 os.path.join(base_dir, level_info_folder)
             )
 
+    # Same for the optional player.metadata_cache file.
+    player_settings = settings.get('player', {})
+    metadata_cache = player_settings.get('metadata_cache')
+    if metadata_cache and not os.path.isabs(metadata_cache):
+        player_settings['metadata_cache'] = os.path.abspath(
+            os.path.join(base_dir, metadata_cache)
+        )
+
     return settings
 
 
@@ -107,15 +115,15 @@ def _stop_things(startables):
     """
     Asyncronous, Twisted based, cleanup.
 
-    Asks each startable to stop.
+    Asks each startable to stop, concurrently, such that their child
+    processes are reaped in parallel.
     """
 
-    for startable in startables:
-        try:
-            yield startable.stop()
-        except Exception:
-            # Nothing much we an do, move on.
-            pass
+    # Failures are consumed: nothing much we can do, anyway.
+    yield defer.DeferredList(
+        [defer.maybeDeferred(startable.stop) for startable in startables],
+        consumeErrors=True,
+    )
 
 
 
@@ -8,6 +8,7 @@
 Common package.
 """
 
+from . import framing
 from . import process
 
 
@@ -0,0 +1,70 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# common/framing.py
+# ----------------------------------------------------------------------------
+
+"""
+Incremental, chunk safe, byte stream framing.
+"""
+
+import collections
+import re
+
+
+
+class LineFramer(object):
+
+    """
+    Splits a byte stream, fed in arbitrary chunks, into lines, terminated by
+    any of the `terminators` bytes: lines split across chunks are carried
+    over and several lines in a chunk are all returned, in one pass.
+
+    Lines longer than `max_length` bytes are dropped, as are empty ones.
+    """
+
+    def __init__(self, terminators=b'\r\n', max_length=1024):
+
+        self._splitter = re.compile(b'[' + re.escape(terminators) + b']')
+        self._max_length = max_length
+
+        # Partial line, carried over.
+        self._carry = b''
+        self._dropping = False
+
+        # 'bytes', 'records', 'dropped'.
+        self.counters = collections.Counter()
+
+
+    def feed(self, data):
+        """
+        Tracks `data`, returning a list with the lines it completes.
+        """
+        self.counters['bytes'] += len(data)
+        lines = self._splitter.split(self._carry + data if self._carry else data)
+        carry = lines.pop()
+        if self._dropping and lines:
+            # Tail of an over long line.
+            self._dropping = False
+            lines[0] = b''
+
+        result = []
+        for line in lines:
+            if len(line) > self._max_length:
+                self.counters['dropped'] += 1
+            elif line:
+                result.append(line)
+        self.counters['records'] += len(result)
+
+        if len(carry) > self._max_length:
+            if not self._dropping:
+                self._dropping = True
+                self.counters['dropped'] += 1
+            carry = b''
+        self._carry = carry
+        return result
+
+
+# ----------------------------------------------------------------------------
+# common/framing.py
+# ----------------------------------------------------------------------------
@@ -8,11 +8,47 @@
 Asynchronous, Twisted Based, process management.
 """
 
+import os
+import signal
+
 from twisted.internet import defer, protocol, error
 from twisted import logger
 
 
 
+def _descendant_pids(pid):
+
+    # Returns a list of PIDs descending from `pid`, found via /proc, on Linux;
+    # an empty list if that can't be done.
+
+    children = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % (entry,), 'rb') as f:
+                stat = f.read()
+        except OSError:
+            # Process gone meanwhile.
+            continue
+        # The parent PID follows the state, after the parenthesized name.
+        parent_pid = int(stat[stat.rindex(b')')+2:].split()[1])
+        children.setdefault(parent_pid, []).append(int(entry))
+
+    result = []
+    pending = [pid]
+    while pending:
+        child_pids = children.get(pending.pop(), [])
+        result.extend(child_pids)
+        pending.extend(child_pids)
+    return result
+
+
+
 class _TrackProcessProtocol(protocol.ProcessProtocol):
 
     """
@@ -22,18 +58,27 @@ class _TrackProcessProtocol(protocol.ProcessProtocol):
     - `started`: deferred that fires with PID when the process is started.
     - `stopped`: deferred that fires with exit code when the process terminates.
 
+    Use `wait_stopped` to wait for process termination from more than one
+    place, or with a timeout.
+
     If set, calls `out_callable` with process stdout data.
     If set, calls `err_callable` with process stderr data.
     """
 
-    def __init__(self, name, out_callable=None, err_callable=None):
+    def __init__(self, reactor, name, out_callable=None, err_callable=None):
 
+        self._reactor = reactor
         self._log = logger.Logger(namespace=name)
         self.started = defer.Deferred()
         self.stopped = defer.Deferred()
         self._out_callable = out_callable
         self._err_callable = err_callable
         self._pid = None
+        self._ended = False
+        self._exit_code = None
+
+        # Deferreds returned by `wait_stopped`, fired on termination.
+        self._stopped_waiters = []
 
 
     def connectionMade(self):
@@ -77,12 +122,95 @@ class _TrackProcessProtocol(protocol.ProcessProtocol):
             self._log.debug('already exited')
 
 
+    def kill(self):
+        """
+        Sends a SIGKILL to the process and to its descendants, if any: those
+        would otherwise be left behind, like `omxplayer.bin` processes spawned
+        by the `omxplayer` wrapper script.
+
+        May raise an OSError.
+        """
+        descendant_pids = _descendant_pids(self._pid) if self._pid else []
+        try:
+            self._log.debug('sending SIGKILL')
+            self.transport.signalProcess('KILL')
+            self._log.debug('sent SIGKILL')
+        except error.ProcessExitedAlready:
+            self._log.debug('already exited')
+        for pid in descendant_pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            else:
+                self._log.debug('sent SIGKILL to descendant PID {p}', p=pid)
+
+
+    def wait_stopped(self, timeout=None):
+        """
+        Returns a deferred that fires with the exit code when the process
+        terminates or, if `timeout` is not None, fails with a TimeoutError
+        when the process is still running `timeout` seconds later.
+        """
+        if self._ended:
+            return defer.succeed(self._exit_code)
+
+        d = defer.Deferred()
+        self._stopped_waiters.append(d)
+        if timeout is not None:
+            timeout_dc = self._reactor.callLater(max(timeout, 0), self._stop_waiting, d)
+            d.addBoth(self._cancel_delayed_call, timeout_dc)
+        return d
+
+
+    def _stop_waiting(self, d):
+
+        # Called when a `wait_stopped` timeout expires.
+
+        if d in self._stopped_waiters:
+            self._stopped_waiters.remove(d)
+            d.errback(defer.TimeoutError('process still running'))
+
+
+    @staticmethod
+    def _cancel_delayed_call(result, delayed_call):
+
+        if delayed_call.active():
+            delayed_call.cancel()
+        return result
+
+
+    @defer.inlineCallbacks
+    def terminate_or_kill(self, kill_after=1):
+        """
+        Sends a SIGTERM to the process, escalating to a SIGKILL if it does
+        not terminate within `kill_after` seconds.
+
+        Returns a deferred that fires with the exit code when terminated.
+        May raise an OSError.
+        """
+        if not self._ended:
+            self.terminate()
+            try:
+                yield self.wait_stopped(timeout=kill_after)
+            except defer.TimeoutError:
+                self._log.warn('still running after SIGTERM: killing')
+                self.kill()
+        exit_code = yield self.wait_stopped()
+        defer.returnValue(exit_code)
+
+
     def processEnded(self, reason):
 
         # Called by Twisted when the process terminates.
 
         exit_code = reason.value.exitCode
         self._log.info('process ended, exit code {ec}', ec=exit_code)
+        self._ended = True
+        self._exit_code = exit_code
+        waiters, self._stopped_waiters = self._stopped_waiters, []
+        for waiter in waiters:
+            waiter.callback(exit_code)
         self.stopped.callback(exit_code)
 
 
@@ -101,6 +229,7 @@ def spawn(reactor, cmd_args, name, out_callable=None, err_callable=None):
     """
 
     process_proto = _TrackProcessProtocol(
+        reactor,
         name,
         out_callable=out_callable,
         err_callable=err_callable,
@@ -0,0 +1,146 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# inputs/agd/benchmark.py
+# ----------------------------------------------------------------------------
+
+"""
+Aggregated derivative micro-benchmark.
+
+Usage: python -m inputs.agd.benchmark [READINGS]
+
+Feeds the same pseudo-random integer, floating point and mixed readings to
+the reference and to the incremental implementations, at several buffer
+sizes, checking that results match and reporting readings per second.
+
+Random walk readings keep non-negative runs short; a monotonic floating
+point ramp, where each run spans the whole buffer, shows the cost of
+summing non integer deltas in order, to match the reference exactly.
+
+Also reports batch processing readings per second, in chunks of BATCH_SIZE
+readings, vectorised if NumPy is available, checking that results are the
+same as the incremental ones.
+"""
+
+from collections import deque
+import random
+import sys
+from time import perf_counter
+
+from .engine import aggregated_derivative, IncrementalAGD, numpy
+
+
+
+BUFFER_SIZES = (10, 25, 100, 1000)
+
+BATCH_SIZE = 1000
+
+# Mixed readings alternate between runs of this many integer and floating
+# point readings: not a multiple of BATCH_SIZE, such that both integer and
+# mixed batches follow windows with floating point readings.
+MIXED_RUN = 1700
+
+
+
+def _readings(count, kind, seed=2017):
+
+    # Returns a list of `count` random walk readings, like sensors produce,
+    # of `kind` 'int', 'float' or 'mixed', or a `kind` 'ramp' of floating
+    # point readings that never decrease.
+
+    rng = random.Random(seed)
+    value = 0
+    result = []
+    for index in range(count):
+        if kind == 'ramp':
+            value += rng.random()
+            result.append(value)
+            continue
+        value = max(0, value + rng.randint(-3, 4))
+        if kind == 'float' or kind == 'mixed' and index // MIXED_RUN % 2:
+            result.append(value + rng.random())
+        else:
+            result.append(value)
+    return result
+
+
+def _run_reference(readings, buffer_size):
+
+    window = deque(maxlen=buffer_size)
+    results = []
+    for reading in readings:
+        window.append(reading)
+        results.append(aggregated_derivative(window))
+    return results
+
+
+def _run_incremental(readings, buffer_size):
+
+    push = IncrementalAGD(buffer_size).push
+    return [push(reading) for reading in readings]
+
+
+def _run_batch(readings, buffer_size):
+
+    # Batches are ndarrays, if NumPy is available, like high rate sources
+    # produce: converting them is not accounted for.
+    push_batch = IncrementalAGD(buffer_size).push_batch
+    batches = [
+        readings[index:index+BATCH_SIZE] for index in range(0, len(readings), BATCH_SIZE)
+    ]
+    if numpy is not None:
+        batches = [numpy.array(batch) for batch in batches]
+    results, batch_time = _timed(lambda: [push_batch(batch) for batch in batches])
+    if numpy is not None:
+        results = [numpy.concatenate(results).tolist()]
+    return [result for batch_results in results for result in batch_results], batch_time
+
+
+def _timed(function, *args):
+
+    # Returns a (result, seconds taken) tuple for `function(*args)`.
+
+    start_time = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - start_time
+
+
+def main(argv):
+
+    count = int(argv[1]) if len(argv) > 1 else 10000
+
+    print('%-6s %6s %14s %14s %8s %14s %8s' % (
+        'kind', 'size', 'reference/s', 'incremental/s', 'speedup', 'batch/s', 'speedup',
+    ))
+    for kind in ('int', 'float', 'mixed', 'ramp'):
+        readings = _readings(count, kind)
+        for buffer_size in BUFFER_SIZES:
+            reference, reference_time = _timed(_run_reference, readings, buffer_size)
+            incremental, incremental_time = _timed(_run_incremental, readings, buffer_size)
+            if incremental != reference:
+                print('%-6s %6d results differ!' % (kind, buffer_size))
+                return 1
+            batch, batch_time = _run_batch(readings, buffer_size)
+            if batch != incremental:
+                print('%-6s %6d batch results differ!' % (kind, buffer_size))
+                return 1
+            print('%-6s %6d %14.0f %14.0f %7.1fx %14.0f %7.1fx' % (
+                kind,
+                buffer_size,
+                count / reference_time,
+                count / incremental_time,
+                reference_time / incremental_time,
+                count / batch_time,
+                reference_time / batch_time,
+            ))
+    return 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main(sys.argv))
+
+
+# ----------------------------------------------------------------------------
+# inputs/agd/benchmark.py
+# ----------------------------------------------------------------------------
@@ -0,0 +1,262 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# inputs/agd/engine.py
+# ----------------------------------------------------------------------------
+
+"""
+Aggregated derivative computation.
+"""
+
+try:
+    import numpy
+except ImportError:
+    # Batches are processed one reading at a time.
+    numpy = None
+
+
+
+def _pairs_from(iterable):
+
+    """
+    Generates (i0, i1), (i1, i2), (i2, i3), ... tuples from `iterable`.
+    """
+
+    i = iter(iterable)
+    try:
+        one = next(i)
+        while True:
+            other = next(i)
+            yield one, other
+            one = other
+    except StopIteration:
+        pass
+
+
+def aggregated_derivative(readings):
+
+    """
+    Calculates the aggregated derivative over `readings`:
+    - Aggregates consecutive reading deltas as long as they are >= 0.
+    - If any consecutive runing delta is negative, sets the aggregation to 0.
+
+    Walks all `readings`: this is the reference implementation.
+    """
+
+    result = 0
+    for one, next_one in _pairs_from(readings):
+        derivative = next_one - one
+        if derivative >= 0:
+            result += derivative
+        else:
+            result = 0
+    return result
+
+
+
+class IncrementalAGD(object):
+
+    """
+    Calculates the aggregated derivative over the last `buffer_size`
+    readings, as each one comes in, with results matching those of
+    `aggregated_derivative`.
+
+    The aggregation is the sum of the deltas following the last negative
+    one in the window: tracking where that non-negative run starts, and
+    its deltas' running sum, makes each reading O(1) while the run started
+    within the window.
+
+    Once the run started before the window, the sum telescopes to the
+    difference between the last reading and the first one in the window,
+    exact with integer readings; while there are non integer readings in
+    the window, the deltas in the window are summed in order, instead, such
+    that floating point results are identical, too, at O(buffer size).
+    """
+
+    def __init__(self, buffer_size):
+
+        if buffer_size < 1:
+            raise ValueError('Invalid buffer size %r.' % (buffer_size,))
+
+        self._size = buffer_size
+
+        # Preallocated ring buffer: reading number `n` is at `n % size`.
+        self._ring = [0] * buffer_size
+
+        # How many readings were pushed, ever.
+        self._count = 0
+
+        # Number of the reading starting the current non-negative run, and
+        # the sum of its deltas, in order.
+        self._run_start = 0
+        self._run_sum = 0
+
+        # How many non integer readings are in the window.
+        self._inexact = 0
+
+
+    def __len__(self):
+
+        return min(self._count, self._size)
+
+
+    def readings(self):
+        """
+        Returns a list with the readings in the window, oldest first.
+        """
+        first = max(0, self._count - self._size)
+        return [self._ring[n % self._size] for n in range(first, self._count)]
+
+
+    def push(self, reading):
+        """
+        Tracks `reading`, returning the updated aggregated derivative.
+        """
+        ring = self._ring
+        size = self._size
+        n = self._count
+
+        if n:
+            slot = n % size
+            if n >= size and not isinstance(ring[slot], int):
+                # Non integer reading leaving the window.
+                self._inexact -= 1
+            derivative = reading - ring[(n - 1) % size]
+            if derivative >= 0:
+                self._run_sum += derivative
+            else:
+                self._run_start = n
+                self._run_sum = 0
+        else:
+            slot = 0
+
+        ring[slot] = reading
+        if not isinstance(reading, int):
+            self._inexact += 1
+        self._count = n + 1
+
+        if self._run_start > n - size:
+            return self._run_sum
+
+        # The run started before the window.
+        start = n + 1 - size
+        if not self._inexact:
+            return reading - ring[start % size]
+
+        result = 0
+        one = ring[start % size]
+        for other_n in range(start + 1, n + 1):
+            other = ring[other_n % size]
+            result += other - one
+            one = other
+        return result
+
+
+    def push_batch(self, readings):
+        """
+        Tracks `readings`, a sequence or an ndarray, returning the aggregated
+        derivative after each one, in an ndarray or, if NumPy isn't
+        available, in a list.
+
+        With NumPy, integer readings following a window with integer ones
+        only are processed at once; others are pushed one at a time, such
+        that floating point results are identical to `push`'s, too.
+        """
+        if numpy is None:
+            return [self.push(reading) for reading in readings]
+
+        chunk = numpy.asarray(readings)
+        if not len(chunk):
+            return numpy.zeros(0, dtype=numpy.int64)
+        if chunk.dtype.kind not in 'biu' or self._inexact:
+            # Non integer readings in the chunk or in the window.
+            return numpy.array([self.push(reading) for reading in chunk.tolist()])
+        dtype = numpy.int64
+
+        # Process the window readings followed by the batch ones: `base` is
+        # the number of the first one.
+        size = self._size
+        window = self.readings()
+        base = self._count - len(window)
+        values = numpy.concatenate((numpy.asarray(window, dtype=dtype), chunk.astype(dtype)))
+        indexes = numpy.arange(len(values))
+
+        # Non-negative runs start where readings follow negative deltas,
+        # but no earlier than the current run, nor than each window.
+        starts = numpy.zeros(len(values), dtype=numpy.int64)
+        starts[1:] = numpy.where(numpy.diff(values) >= 0, 0, indexes[1:])
+        starts[0] = max(0, self._run_start - base)
+        starts = numpy.maximum.accumulate(starts)
+        run_start = base + int(starts[-1])
+        starts = numpy.maximum(starts, indexes - size + 1)
+        result = values - values[starts]
+
+        # Keep the ring buffer up to date, with the batch's Python numbers;
+        # with integers, the run's sum is its last reading's result.
+        self._count = base + len(values)
+        self._run_start = run_start
+        self._run_sum = int(result[-1])
+        first = max(base + len(window), self._count - size)
+        batch_first = first - base - len(window)
+        for n, reading in zip(range(first, self._count), chunk[batch_first:].tolist()):
+            self._ring[n % size] = reading
+
+        return result[len(window):]
+
+
+
+def level_changes(agds, thresholds, play_level):
+
+    """
+    Returns a list of (index, level) tuples, one for each of `agds`, a
+    sequence or an ndarray of aggregated derivatives, where the play level
+    changes, starting from `play_level`.
+
+    The play level is the highest one, counting from 1, whose threshold in
+    `thresholds` is reached, or 0.
+    """
+
+    if numpy is None or not isinstance(agds, numpy.ndarray):
+        result = []
+        for index, agd in enumerate(agds):
+            new_play_level = 0
+            for level, threshold in enumerate(thresholds, start=1):
+                if agd >= threshold:
+                    new_play_level = level
+            if new_play_level != play_level:
+                play_level = new_play_level
+                result.append((index, play_level))
+        return result
+
+    levels = numpy.zeros(len(agds), dtype=numpy.int64)
+    for level, threshold in enumerate(thresholds, start=1):
+        levels[agds >= threshold] = level
+    indexes = numpy.flatnonzero(numpy.diff(levels, prepend=play_level))
+    return list(zip(indexes.tolist(), levels[indexes].tolist()))
+
+
+def as_number(value):
+
+    """
+    Returns `value`, converted to a Python number if it is a NumPy one.
+    """
+
+    if numpy is not None and isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+
+def peak(values):
+
+    """
+    Returns the highest of `values`, a non empty sequence or ndarray.
+    """
+
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        return values.max().item()
+    return max(values)
+
+
+# ----------------------------------------------------------------------------
+# inputs/agd/engine.py
+# ----------------------------------------------------------------------------
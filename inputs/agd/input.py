@@ -8,14 +8,15 @@
 Aggregated derivative input processor.
 """
 
-
-from collections import deque
+import bisect
 
 from twisted.internet import defer
 from twisted import logger
 
 from inputs import input_base
 
+from . import engine
+
 
 
 _log = logger.Logger(namespace='inputs.agd')
@@ -31,20 +32,40 @@ class AggregatedDerivative(input_base.InputBase):
     Keeps track of the last `buffer_size` readings sourced from `source` and
     calculates an aggregated derivative which is compared to the given
     `thresholds` and, in turn, calls `change_play_level` on the `wiring`.
+
+    Readings can also be sourced in batches, from high rate sources, via
+    `<source>_batch` wiring calls: these are processed at once, vectorised
+    if NumPy is available and readings are integers, with `agd_output`
+    calls decimated to one every `output_interval` seconds, at most; such
+    sources also output each reading via `<source>` calls, for consumers
+    tracking readings one at a time, which are ignored after the first
+    batch.
     """
 
-    def __init__(self, reactor, wiring, buffer_size, thresholds, source):
+    def __init__(self, reactor, wiring, buffer_size, thresholds, source,
+                 output_interval=0.1):
 
         super(AggregatedDerivative, self).__init__(reactor, wiring)
 
         self._thresholds = thresholds
         self._source_type = source
+        self._output_interval = output_interval
 
-        self._readings = deque(maxlen=buffer_size)
+        self._agd = engine.IncrementalAGD(buffer_size)
         self._last_play_level = 0
 
+        # Timestamp of the next batched reading to output and the highest
+        # aggregated derivative since the previous one, if any.
+        self._next_output_ts = None
+        self._output_peak = None
+
+        # Whether `source` outputs batches: their readings are then also
+        # output one at a time, for other consumers, and not processed twice.
+        self._batched = False
+
         # Handle the output produced by the selected input `source`.
         wiring[source].wire(self._handle_new_reading)
+        wiring['%s_batch' % source].wire(self._handle_new_batch)
 
         # Handle requests to get/set AGD thresholds.
         wiring.request_agd_thresholds.wire(self._notify_agd_thresholds)
@@ -54,6 +75,8 @@ class AggregatedDerivative(input_base.InputBase):
     @defer.inlineCallbacks
     def start(self):
 
+        if engine.numpy is None:
+            _log.warn('NumPy not available: batches processed one reading at a time')
         _log.info('started')
         yield defer.succeed(None)
 
@@ -86,11 +109,9 @@ class AggregatedDerivative(input_base.InputBase):
     def _handle_new_reading(self, reading):
 
         # Track reading and calculate the aggregated derivative.
-        self._readings.append(reading)
-        agd = self._aggregated_derivative()
+        agd = self._agd.push(reading)
 
-        _log.info('reading={r!r}, agd={a!r}', r=reading, a=agd)
-        _log.debug('readings={r!r}', r=self._readings)
+        _log.debug('reading={r!r}, agd={a!r}', r=reading, a=agd)
 
         # Output both the raw reading as well as the aggregated derivative.
         self._wiring.agd_output(raw=reading, agd=agd)
@@ -107,40 +128,60 @@ class AggregatedDerivative(input_base.InputBase):
             self._wiring.change_play_level(play_level, comment)
 
 
-    @staticmethod
-    def _pairs_from(iterable):
+    def _handle_new_batch(self, timestamps, readings):
 
-        """
-        Generates (i0, i1), (i1, i2), (i2, i3), ... tuples from `iterable`.
-        """
+        # Track `readings`, a sequence or ndarray, sampled at the respective,
+        # increasing, `timestamps`, in seconds, and calculate the aggregated
+        # derivative after each one.
+        if not self._batched:
+            self._batched = True
+            self._wiring[self._source_type].unwire(self._handle_new_reading)
+        agds = self._agd.push_batch(readings)
+        if not len(agds):
+            return
 
-        i = iter(iterable)
-        try:
-            one = next(i)
-            while True:
-                other = next(i)
-                yield one, other
-                one = other
-        except StopIteration:
-            pass
-
-
-    def _aggregated_derivative(self):
-
-        """
-        Calculates the aggregated derivative over `buffer_size` readings:
-        - Aggregates consecutive reading deltas as long as they are >= 0.
-        - If any consecutive runing delta is negative, sets the aggregation to 0.
-        """
-
-        result = 0
-        for one, next_one in self._pairs_from(self._readings):
-            derivative = next_one - one
-            if derivative >= 0:
-                result += derivative
-            else:
-                result = 0
-        return result
+        _log.debug('batch of {n!r} readings, last agd={a!r}', n=len(agds),
+                   a=engine.as_number(agds[-1]))
+
+        self._output_batch(timestamps, readings, agds)
+
+        # Request a level change for each transition within the batch.
+        changes = engine.level_changes(agds, self._thresholds, self._last_play_level)
+        for index, play_level in changes:
+            self._last_play_level = play_level
+            agd = engine.as_number(agds[index])
+            comment = 'agd-%s == %r' % (self._source_type, agd)
+            self._wiring.change_play_level(play_level, comment)
+
+
+    def _output_batch(self, timestamps, readings, agds):
+
+        # Output one raw reading every `output_interval` seconds, along with
+        # the highest aggregated derivative since the previous output, such
+        # that peaks show.
+
+        next_ts = self._next_output_ts
+        if next_ts is None:
+            next_ts = timestamps[0]
+        peak = self._output_peak
+        first = 0
+        index = bisect.bisect_left(timestamps, next_ts)
+        while index < len(agds):
+            agd = engine.peak(agds[first:index+1])
+            if peak is not None and peak > agd:
+                agd = peak
+            raw = engine.as_number(readings[index])
+            self._wiring.agd_output(raw=raw, agd=agd)
+            next_ts = timestamps[index] + self._output_interval
+            peak = None
+            first = index + 1
+            index = bisect.bisect_left(timestamps, next_ts, first)
+        if first < len(agds):
+            agd = engine.peak(agds[first:])
+            if peak is None or agd > peak:
+                peak = agd
+        self._next_output_ts = next_ts
+        self._output_peak = peak
 
 
 # ----------------------------------------------------------------------------
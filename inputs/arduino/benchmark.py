@@ -0,0 +1,187 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# inputs/arduino/benchmark.py
+# ----------------------------------------------------------------------------
+
+"""
+Arduino frame decoding micro-benchmark.
+
+Usage: python -m inputs.arduino.benchmark [FRAMES]
+
+Feeds the same pseudo-random PDU stream, with some corrupted bytes, to the
+frame decoder and to a reference LineReceiver based decoder, splitting on
+0x20 bytes like the original protocol did, in the chunk sizes delivered
+every 10ms at several baud rates, reporting readings per second, the
+fraction of the serial line's PDU rate that takes, and decoding errors.
+
+Also feeds a version 2 PDU stream, with two channels, like the project's
+two bend sensors, to the frame decoder, aggregating the channels into
+readings.
+"""
+
+import random
+import sys
+from time import perf_counter
+
+from twisted.protocols import basic
+
+from .channels import ChannelAggregator
+from .frames import MULTI_START, START, FrameDecoder
+
+
+
+BAUD_RATES = (9600, 115200, 1000000, 2000000)
+
+# Serial data is delivered every this many seconds.
+CHUNK_TIME = 0.01
+
+# One in this many bytes is corrupted.
+CORRUPTION_RATE = 10000
+
+# Version 2 PDU stream channels.
+CHANNELS = 2
+
+
+
+class _LineReference(basic.LineReceiver):
+
+    # The original, LineReceiver based, decoding: misreads PDUs including
+    # 0x20 bytes.
+
+    delimiter = bytes([START])
+    MAX_LENGTH = 1 << 20
+
+    def __init__(self):
+
+        self.readings = []
+
+
+    def lineReceived(self, line):
+
+        if line:
+            self.readings.append(int.from_bytes(line, byteorder='little'))
+
+
+
+def _stream(count, channels=None, seed=2017):
+
+    # Returns a (values, stream) tuple with `count` random values and their
+    # PDU stream, with some corrupted bytes: version 1 PDUs, if `channels`
+    # is None, or version 2 ones, with `channels` values aggregated into
+    # each of `values`.
+
+    rng = random.Random(seed)
+    stream = bytearray()
+    if channels is None:
+        values = [rng.randint(0, 1023) for _ in range(count)]
+        for value in values:
+            stream.append(START)
+            stream.extend(value.to_bytes(2, byteorder='little'))
+    else:
+        rows = [tuple(rng.randint(0, 1023) for _ in range(channels)) for _ in range(count)]
+        values = ChannelAggregator().aggregate([
+            (channels, [value for row in rows for value in row]),
+        ])
+        for row in rows:
+            payload = bytearray([channels])
+            for value in row:
+                payload.extend(value.to_bytes(2, byteorder='little'))
+            stream.append(MULTI_START)
+            stream.extend(payload)
+            stream.append(sum(payload) & 0xFF)
+    for _ in range(len(stream) // CORRUPTION_RATE):
+        stream[rng.randrange(len(stream))] = rng.randint(0, 255)
+    return values, bytes(stream)
+
+
+def _errors(values, readings):
+
+    # Returns how many `values` are not in `readings`, in order, plus how
+    # many `readings` are not in `values`, aligning them greedily.
+
+    missing = extra = 0
+    index = 0
+    for reading in readings:
+        found = reading in values[index:index+4]
+        if found:
+            skip = values.index(reading, index)
+            missing += skip - index
+            index = skip + 1
+        else:
+            extra += 1
+    return missing + len(values) - index + extra
+
+
+def _run_decoder(chunks):
+
+    decoder = FrameDecoder()
+    aggregator = ChannelAggregator()
+    readings = []
+    for chunk in chunks:
+        readings.extend(aggregator.aggregate(decoder.feed(chunk)))
+    return readings, decoder.counters['resyncs']
+
+
+def _run_reference(chunks):
+
+    reference = _LineReference()
+    for chunk in chunks:
+        reference.dataReceived(chunk)
+    return reference.readings, None
+
+
+def _timed(function, *args):
+
+    # Returns a (result, seconds taken) tuple for `function(*args)`.
+
+    start_time = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - start_time
+
+
+def main(argv):
+
+    count = int(argv[1]) if len(argv) > 1 else 200000
+    v1_stream = _stream(count)
+    streams = {
+        'reference': v1_stream,
+        'frames': v1_stream,
+        'frames-v2': _stream(count, CHANNELS),
+    }
+    functions = (
+        ('reference', _run_reference),
+        ('frames', _run_decoder),
+        ('frames-v2', _run_decoder),
+    )
+
+    print('%-9s %8s %7s %14s %8s %7s %8s' % (
+        'decoder', 'baud', 'chunk', 'readings/s', 'load', 'errors', 'resyncs',
+    ))
+    for baud_rate in BAUD_RATES:
+        chunk_size = max(1, int(baud_rate / 10 * CHUNK_TIME))
+        for name, function in functions:
+            values, stream = streams[name]
+            chunks = [stream[i:i+chunk_size] for i in range(0, len(stream), chunk_size)]
+            line_rate = baud_rate * count / 10 / len(stream)
+            (readings, resyncs), seconds = _timed(function, chunks)
+            print('%-9s %8d %7d %14.0f %7.2f%% %7d %8s' % (
+                name,
+                baud_rate,
+                chunk_size,
+                len(readings) / seconds,
+                100 * line_rate * seconds / len(readings),
+                _errors(values, readings),
+                '-' if resyncs is None else resyncs,
+            ))
+    return 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main(sys.argv))
+
+
+# ----------------------------------------------------------------------------
+# inputs/arduino/benchmark.py
+# ----------------------------------------------------------------------------
@@ -0,0 +1,206 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# inputs/arduino/channels.py
+# ----------------------------------------------------------------------------
+
+"""
+Multi-channel Arduino reading aggregation.
+"""
+
+import collections
+import statistics
+
+from twisted import logger
+
+try:
+    import numpy
+except ImportError:
+    # Rows are aggregated one at a time.
+    numpy = None
+
+
+
+_log = logger.Logger(namespace='inputs.arduino')
+
+
+METHODS = ('weighted', 'max', 'median')
+
+
+
+class ChannelAggregator(object):
+
+    """
+    Aggregates runs of frames' channel values, as decoded by `FrameDecoder`,
+    into single readings, one per frame, with one of `METHODS`:
+    - 'weighted': the sum of the channel values times `weights`, normalised
+      to add up to 1; equal weights, the channels' mean, if not given.
+    - 'max': the largest channel value.
+    - 'median': the median channel value.
+    Readings are rounded to integers; single channel values pass through.
+
+    If `dead_after` is positive, channels whose values are unchanged for
+    that many consecutive readings are considered dead, and left out of the
+    aggregation, until they change again: this is evaluated once per run,
+    at its end. Should all channels look dead, the previously dead ones, if
+    any, are left out.
+
+    Each run is aggregated in bulk, with NumPy, if available.
+    """
+
+    def __init__(self, method='weighted', weights=None, dead_after=0):
+
+        if method not in METHODS:
+            raise ValueError('Invalid aggregation method %r.' % (method,))
+        if weights and (min(weights) < 0 or not sum(weights)):
+            raise ValueError('Invalid aggregation weights %r.' % (weights,))
+        self._method = method
+        self._weights = list(weights) if weights else None
+        self._dead_after = dead_after
+
+        # Channel count the state below refers to, last frame's values, per
+        # channel unchanged reading count, dead channels and weights.
+        self._channels = None
+        self._last_row = None
+        self._unchanged = None
+        self._dead = set()
+        self._channel_weights = None
+
+        # 'frames', 'dead-channels', 'revived-channels'.
+        self.counters = collections.Counter()
+
+
+    def aggregate(self, runs):
+        """
+        Returns a list of readings, one per frame in `runs`, a sequence of
+        (channels, values) tuples, where `values` is a sequence of channel
+        values, frame after frame.
+        """
+        result = []
+        for channels, values in runs:
+            if channels == 1:
+                result.extend(values)
+                continue
+            if channels != self._channels:
+                self._reset(channels)
+            if numpy is not None:
+                result.extend(self._aggregate_numpy(values))
+            else:
+                result.extend(self._aggregate_python(values))
+        self.counters['frames'] += len(result)
+        return result
+
+
+    def _reset(self, channels):
+
+        # Starts tracking `channels` channels.
+
+        self._channels = channels
+        self._last_row = None
+        self._unchanged = [0] * channels
+        self._dead = set()
+        if self._weights and len(self._weights) != channels:
+            _log.warn(
+                'got {c} channels but {w} weights: using equal weights',
+                c=channels,
+                w=len(self._weights),
+            )
+            self._channel_weights = [1] * channels
+        else:
+            self._channel_weights = self._weights or [1] * channels
+
+
+    def _aggregate_numpy(self, values):
+
+        values = numpy.array(values, dtype=numpy.float64).reshape(-1, self._channels)
+        if self._dead_after > 0:
+            if self._last_row is None:
+                self._last_row = values[0]
+            changes = numpy.vstack((self._last_row, values))
+            changed = changes[1:] != changes[:-1]
+            count = len(values)
+            last_change = count - 1 - changed[::-1].argmax(axis=0)
+            unchanged = numpy.where(
+                changed.any(axis=0),
+                count - 1 - last_change,
+                numpy.array(self._unchanged) + count,
+            )
+            self._last_row = values[-1]
+            self._update_dead(unchanged.tolist())
+
+        alive = [c for c in range(self._channels) if c not in self._dead]
+        if self._method == 'weighted':
+            weights = numpy.zeros(self._channels)
+            weights[alive] = [self._channel_weights[c] for c in alive]
+            total = weights.sum()
+            if not total:
+                weights = numpy.array(self._channel_weights, dtype=numpy.float64)
+                total = weights.sum()
+            readings = values @ weights / total
+        elif self._method == 'max':
+            readings = values[:, alive].max(axis=1)
+        else:
+            readings = numpy.median(values[:, alive], axis=1)
+        return numpy.rint(readings).astype(numpy.int64).tolist()
+
+
+    def _aggregate_python(self, values):
+
+        group = list(zip(*[iter(values)] * self._channels))
+        if self._dead_after > 0:
+            unchanged = self._unchanged
+            last_row = self._last_row or group[0]
+            for row in group:
+                unchanged = [
+                    count + 1 if value == last_value else 0
+                    for count, value, last_value in zip(unchanged, row, last_row)
+                ]
+                last_row = row
+            self._last_row = last_row
+            self._update_dead(unchanged)
+
+        alive = [c for c in range(self._channels) if c not in self._dead]
+        if self._method == 'weighted':
+            weights = [self._channel_weights[c] for c in alive]
+            total = sum(weights)
+            if not total:
+                alive = range(self._channels)
+                weights = self._channel_weights
+                total = sum(weights)
+            readings = (
+                sum(row[c] * weight for c, weight in zip(alive, weights)) / total
+                for row in group
+            )
+        elif self._method == 'max':
+            readings = (max(row[c] for c in alive) for row in group)
+        else:
+            readings = (statistics.median(row[c] for c in alive) for row in group)
+        return [int(round(reading)) for reading in readings]
+
+
+    def _update_dead(self, unchanged):
+
+        # Updates the dead channels from the per channel `unchanged` reading
+        # counts; if all channels look dead, like when there's no wind at
+        # all, they're left as they were.
+
+        self._unchanged = unchanged
+        dead = {c for c, count in enumerate(unchanged) if count >= self._dead_after}
+        if len(dead) == self._channels:
+            dead = self._dead
+        for channel in sorted(dead - self._dead):
+            self.counters['dead-channels'] += 1
+            _log.warn(
+                'channel {c} dead: unchanged for {n} readings',
+                c=channel,
+                n=unchanged[channel],
+            )
+        for channel in sorted(self._dead - dead):
+            self.counters['revived-channels'] += 1
+            _log.info('channel {c} revived', c=channel)
+        self._dead = dead
+
+
+# ----------------------------------------------------------------------------
+# inputs/arduino/channels.py
+# ----------------------------------------------------------------------------
@@ -0,0 +1,237 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# inputs/arduino/frames.py
+# ----------------------------------------------------------------------------
+
+"""
+Arduino serial frame encoding and decoding.
+"""
+
+import collections
+import re
+import struct
+
+
+
+# Version 1 frames: a start byte followed by a 16 bit little endian integer.
+START = 0x20
+FRAME = struct.Struct('<xH')
+
+# Version 2 frames: a start byte, a channel count, that many 16 bit little
+# endian integers and a checksum byte: the low byte of the sum of the
+# channel count and integer bytes.
+MULTI_START = 0x21
+MAX_CHANNELS = 16
+
+# Host to device command frames: a start byte, a command byte, a 16 bit
+# little endian argument and a checksum byte, like version 2 frames'.
+COMMAND_START = 0x23
+COMMAND = struct.Struct('<BBHB')
+SET_SAMPLE_RATE = ord('R')
+MIN_SAMPLE_RATE = 1
+MAX_SAMPLE_RATE = 0xFFFF
+
+_START_BYTE = bytes([START])
+_STARTS = re.compile(re.escape(bytes([START, MULTI_START])).join([b'[', b']']))
+
+# Consecutive valid frames needed to (re)synchronise: the integer bytes may
+# be start bytes, too.
+_SYNC_FRAMES = 3
+
+
+
+def _checksum(data):
+
+    # The low byte of the sum of `data` bytes.
+
+    return sum(data) & 0xFF
+
+
+def command_frame(command, argument):
+
+    """
+    Returns a host to device command frame, for `command` and `argument`.
+    """
+
+    payload = struct.pack('<BH', command, argument)
+    return COMMAND.pack(COMMAND_START, command, argument, _checksum(payload))
+
+
+
+class FrameDecoder(object):
+
+    """
+    Decodes a serial byte stream, fed in arbitrary chunks, into runs of
+    frames with the same channel count: version 1 frames have one channel.
+
+    Synchronises by searching for consecutive valid frames, then decodes runs
+    of complete, same sized frames in each chunk in bulk; if a frame lacks
+    its start byte or its checksum doesn't match, synchronisation is lost and
+    searched for again, from there. Incomplete frames are carried over.
+
+    Checksums are verified for whole runs, at once, then frame by frame, to
+    find the first mismatch, if any: errors in different frames of a run
+    that cancel out go undetected.
+    """
+
+    def __init__(self):
+
+        self._carry = b''
+        self._synced = False
+
+        # 'bytes', 'frames', 'resyncs', 'dropped-bytes', 'checksum-errors'.
+        self.counters = collections.Counter()
+
+
+    def feed(self, data):
+        """
+        Decodes `data`, a bytes-like object, returning a list of (channels,
+        values) tuples, one per run of frames, where `values` is a tuple of
+        the run's channel values, frame after frame.
+        """
+        self.counters['bytes'] += len(data)
+        buf = self._carry + data if self._carry else bytes(data)
+        view = memoryview(buf)
+        size = len(buf)
+        frame_size = FRAME.size
+        runs = []
+
+        position = 0
+        while position < size:
+            if not self._synced:
+                start, self._synced = self._find_sync(buf, position)
+                self.counters['dropped-bytes'] += start - position
+                position = start
+                if not self._synced:
+                    break
+
+            first = buf[position]
+            if first == START:
+                count = (size - position) // frame_size
+                end = position + count * frame_size
+                good = count - len(buf[position:end:frame_size].lstrip(_START_BYTE))
+                if good:
+                    good_end = position + good * frame_size
+                    runs.append((1, struct.unpack_from('<' + 'xH' * good, buf, position)))
+                    position = good_end
+                if good == count:
+                    # Incomplete frames are checked once complete.
+                    break
+            elif first == MULTI_START:
+                position, need_more = self._decode_multi_run(buf, view, position, runs)
+                if need_more:
+                    break
+            else:
+                # Framing error: missing start byte.
+                self._lose_sync()
+
+        self._carry = buf[position:]
+        self.counters['frames'] += sum(len(values) // channels for channels, values in runs)
+        return runs
+
+
+    def _lose_sync(self):
+
+        self._synced = False
+        self.counters['resyncs'] += 1
+
+
+    def _decode_multi_run(self, buf, view, position, runs):
+
+        # Decodes the run of same sized version 2 frames at `position` into
+        # `runs`, returning a (position, need_more) tuple: where the run ended
+        # and whether more data is needed to continue; loses synchronisation
+        # on invalid frames.
+
+        if position + 1 >= len(buf):
+            return position, True
+        channels = buf[position+1]
+        if not 0 < channels <= MAX_CHANNELS:
+            self._lose_sync()
+            return position, False
+        frame_size = 3 + 2 * channels
+        count = (len(buf) - position) // frame_size
+        if not count:
+            return position, True
+
+        end = position + count * frame_size
+        good = min(
+            count - len(buf[position:end:frame_size].lstrip(bytes([MULTI_START]))),
+            count - len(buf[position+1:end:frame_size].lstrip(bytes([channels]))),
+        )
+        good_end = position + good * frame_size
+
+        # Each frame's bytes, but the start one, add up to twice its checksum.
+        checksums = sum(buf[position+frame_size-1:good_end:frame_size])
+        if (sum(view[position:good_end]) - good * MULTI_START - 2 * checksums) & 0xFF:
+            for frame_start in range(position, good_end, frame_size):
+                frame_end = frame_start + frame_size - 1
+                if _checksum(view[frame_start+1:frame_end]) != buf[frame_end]:
+                    self.counters['checksum-errors'] += 1
+                    self._lose_sync()
+                    good = (frame_start - position) // frame_size
+                    good_end = frame_start
+                    break
+
+        if good:
+            frame_format = 'xx%dHx' % (channels,)
+            runs.append((channels, struct.unpack_from('<' + frame_format * good, buf, position)))
+        return good_end, self._synced and good_end == len(buf)
+
+
+    @staticmethod
+    def _frame_size(buf, position):
+
+        # Returns the size of the valid frame at `position` in `buf`, 0 if
+        # there's none, or None if more data is needed to tell.
+
+        first = buf[position]
+        if first == START:
+            return FRAME.size if position + FRAME.size <= len(buf) else None
+        if first != MULTI_START:
+            return 0
+        if position + 1 >= len(buf):
+            return None
+        channels = buf[position+1]
+        if not 0 < channels <= MAX_CHANNELS:
+            return 0
+        frame_size = 3 + 2 * channels
+        if position + frame_size > len(buf):
+            return None
+        frame_end = position + frame_size - 1
+        if _checksum(buf[position+1:frame_end]) != buf[frame_end]:
+            return 0
+        return frame_size
+
+
+    @classmethod
+    def _find_sync(cls, buf, position):
+
+        # Returns a (position, synced) tuple: where the first candidate frame
+        # at or after `position` in `buf` starts, and whether the following
+        # ones confirm it; position is len(buf) if there's no candidate.
+
+        while True:
+            match = _STARTS.search(buf, position)
+            if not match:
+                return len(buf), False
+            start = match.start()
+            frame_start = start
+            for _ in range(_SYNC_FRAMES):
+                if frame_start == len(buf):
+                    return start, False
+                frame_size = cls._frame_size(buf, frame_start)
+                if frame_size is None:
+                    return start, False
+                if not frame_size:
+                    break
+                frame_start += frame_size
+            else:
+                return start, True
+            position = start + 1
+
+
+# ----------------------------------------------------------------------------
+# inputs/arduino/frames.py
+# ----------------------------------------------------------------------------
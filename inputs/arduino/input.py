@@ -8,12 +8,13 @@
 High level Arduino input.
 """
 
+from time import monotonic
 
 from twisted.internet import defer, serialport
 from twisted import logger
 
 from inputs import input_base
-from . import protocol
+from . import channels, frames, protocol
 
 
 
@@ -26,17 +27,36 @@ class ArduinoInput(input_base.InputBase):
 
     """
     Processes serial received PDUs (protocol data units) that are integers that
-    will be bigger when the sensors detect "more wind".
+    will be bigger when the sensors detect "more wind": either one per PDU, or
+    one per sensor, aggregated by a `ChannelAggregator` with `aggregation`,
+    `weights` and `dead_after`.
 
-    Produces output by calling `arduino` on the `wiring`.
+    Produces output by calling `arduino_batch` on the `wiring`, with lists of
+    timestamps and readings, then `arduino` with each reading.
+
+    If `sample_rate` is set, requests the device to send that many PDUs per
+    second, once it starts sending; `wiring.set_arduino_sample_rate` calls
+    request a new rate.
     """
 
-    def __init__(self, reactor, wiring, device_file, baud_rate):
+    def __init__(self, reactor, wiring, device_file, baud_rate,
+                 aggregation='weighted', weights=None, dead_after=0, sample_rate=None):
+
+        if sample_rate and not self._valid_sample_rate(sample_rate):
+            raise ValueError('Invalid sample rate %r.' % (sample_rate,))
 
         super(ArduinoInput, self).__init__(reactor, wiring)
         self._device_file = device_file
         self._baud_rate = baud_rate
-        self._output_callable = wiring.arduino
+        self._aggregator = channels.ChannelAggregator(aggregation, weights, dead_after)
+
+        # Requested PDUs per second and whether the device still needs to be
+        # told; the timestamp of the last reading.
+        self._sample_rate = sample_rate
+        self._sample_rate_pending = bool(sample_rate)
+        self._last_ts = 0
+
+        wiring.set_arduino_sample_rate.wire(self._set_sample_rate)
 
         self._serial_protocol = None
         self._serial_port = None
@@ -45,7 +65,7 @@ class ArduinoInput(input_base.InputBase):
     @defer.inlineCallbacks
     def start(self):
 
-        self._serial_protocol = protocol.ArduinoProtocol(self._output_callable)
+        self._serial_protocol = protocol.ArduinoProtocol(self._handle_runs)
         try:
             self._serial_port = serialport.SerialPort(
                 self._serial_protocol,
@@ -64,6 +84,62 @@ class ArduinoInput(input_base.InputBase):
         yield defer.succeed(None)
 
 
+    @staticmethod
+    def _valid_sample_rate(sample_rate):
+
+        return frames.MIN_SAMPLE_RATE <= sample_rate <= frames.MAX_SAMPLE_RATE
+
+
+    def _set_sample_rate(self, sample_rate):
+
+        # Requests the device to send `sample_rate` PDUs per second, now, if
+        # it's already sending, or as soon as it does.
+
+        if not self._valid_sample_rate(sample_rate):
+            _log.warn('invalid sample rate: {r!r}', r=sample_rate)
+            return
+        self._sample_rate = sample_rate
+        self._sample_rate_pending = True
+        if self._last_ts:
+            self._send_sample_rate()
+
+
+    def _send_sample_rate(self):
+
+        # Sends the requested sample rate command to the device.
+
+        self._sample_rate_pending = False
+        self._serial_protocol.send_command(frames.SET_SAMPLE_RATE, self._sample_rate)
+        _log.info('requested {r} PDUs per second', r=self._sample_rate)
+
+
+    def _handle_runs(self, runs, byte_count):
+
+        # Called with the runs of frames in each chunk of received data,
+        # `byte_count` bytes long: their readings are timestamped one
+        # sample period apart, if known, or the chunk's transmission time,
+        # at 10 bits per byte, per reading, otherwise, the last one now, but
+        # never before the previous chunk's.
+
+        if self._sample_rate_pending:
+            self._send_sample_rate()
+
+        readings = self._aggregator.aggregate(runs)
+        now = monotonic()
+        count = len(readings)
+        if self._sample_rate:
+            period = 1 / self._sample_rate
+        else:
+            period = byte_count * 10 / self._baud_rate / count
+        last_ts = self._last_ts
+        timestamps = [
+            max(now - period * (count - n), last_ts)
+            for n in range(1, count + 1)
+        ]
+        self._last_ts = now
+        self._output_readings('arduino', timestamps, readings)
+
+
     @defer.inlineCallbacks
     def stop(self):
 
@@ -81,6 +157,7 @@ class ArduinoInput(input_base.InputBase):
             _log.warn('stopping failed: {e!r}', e=e)
         else:
             _log.info('stopped')
+        _log.info('channel stats: {s!r}', s=dict(self._aggregator.counters))
 
 
 # ----------------------------------------------------------------------------
@@ -10,35 +10,37 @@ Low level, serial Arduino input protocol.
 
 
 from twisted.internet import protocol, defer
-from twisted.protocols import basic
 from twisted import logger
 
+from .frames import FrameDecoder, command_frame
+
 
 
 _log = logger.Logger(namespace='inputs.arduino')
 
 
 
-class ArduinoProtocol(basic.LineReceiver):
+class ArduinoProtocol(protocol.Protocol):
 
     """
     Arduino serial connection protocol.
     """
 
-    # The Arduino serial connection sends a stream of three-byte PDUs:
-    # - The first byte is 0x20.
-    # - The second and third bytes are a 16 bit little endian integer.
-
-    # t.p.basic.LineReceiver handles this with the appropriate delimiter.
-    # Not perfect but works:
-    # - Arduino protocol uses delimiter as a "start of message" indicator.
-    # - LineReceiver consideres delimiter to be "end of line" indicator.
-    # Works because the Arduino keeps sending a stream of PDUs, never stopping.
-    delimiter = b' '
-
-    def __init__(self, pdu_received_callable):
-
-        self._pdu_received_callable = pdu_received_callable
+    # The Arduino serial connection sends a stream of PDUs, either:
+    # - Version 1: 0x20 followed by a 16 bit little endian integer.
+    # - Version 2: 0x21, a channel count, that many 16 bit little endian
+    #   integers and a checksum byte.
+    #
+    # Given that the integer bytes may be start bytes, too, PDUs are decoded
+    # by a `FrameDecoder`, that synchronises on the start bytes; all PDUs in
+    # each chunk of received data are passed to `runs_received_callable`,
+    # together, as `FrameDecoder` runs, along with the chunk's size, in
+    # bytes.
+
+    def __init__(self, runs_received_callable):
+
+        self._runs_received_callable = runs_received_callable
+        self._decoder = FrameDecoder()
         self.disconnected = defer.Deferred()
 
 
@@ -49,32 +51,25 @@ class ArduinoProtocol(basic.LineReceiver):
         _log.debug('connection made')
 
 
-    def lineReceived(self, line):
+    def dataReceived(self, data):
 
-        # Called by Twisted when a PDU is received.
-        # `line` should be a two byte little endian integer.
+        # Called by Twisted when data is received.
 
-        _log.debug('data received: {d!r}', d=line)
-        try:
-            pdu = int.from_bytes(line, byteorder='little')
-        except (TypeError, ValueError):
-            _log.warn('bad value: {d!r}', d=line)
+        runs = self._decoder.feed(data)
+        if not runs:
             return
 
         try:
-            self._pdu_received_callable(pdu)
+            self._runs_received_callable(runs, len(data))
         except Exception as e:
             _log.warn('callable exception: {e!s}', e=e)
 
 
-    def rawDataReceived(self, data):
-
-        # Called by Twisted if the protocol goes to "raw" mode.
-        # Should not happen, given that this code never triggers it.
-        # It is here to ensure a complete protocol implementation, given that
-        # the parent class does not implement it.
-
-        _log.warn('unexpected data: {d!r}', d=data)
+    def send_command(self, command, argument):
+        """
+        Sends a host to device command frame, for `command` and `argument`.
+        """
+        self.transport.write(command_frame(command, argument))
 
 
     def connectionLost(self, reason=protocol.connectionDone):
@@ -82,6 +77,7 @@ class ArduinoProtocol(basic.LineReceiver):
         # Called by Twisted when the serial connection is dropped.
 
         _log.debug('connection lost')
+        _log.info('frame stats: {s!r}', s=dict(self._decoder.counters))
         self.disconnected.callback(None)
 
 
@@ -0,0 +1,216 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# inputs/audio/benchmark.py
+# ----------------------------------------------------------------------------
+
+"""
+Audio input CPU use benchmark.
+
+Usage: python -m inputs.audio.benchmark [SECONDS [DEVICE [ARECORD_BIN]]]
+
+Compares the CPU use of the 'vu' and 'pcm' audio input modes, with the
+sample settings' channels, format, rate and buffer time, reporting CPU
+seconds per audio second, as a percentage of one core, and readings per
+second.
+
+If NumPy is available, also reports the 'pcm' mode CPU use with spectral
+blow detection, processed synchronously, checking that the spectral stage
+itself stays within its real-time CPU budget.
+
+Without a DEVICE, feeds SECONDS of synthetic arecord output to each mode's
+handlers, accounting for this process only; with a DEVICE, runs arecord in
+each mode for SECONDS, accounting for it, too.
+"""
+
+import array
+import math
+import os
+import random
+import resource
+import selectors
+import subprocess
+import sys
+from time import process_time
+
+import wires
+
+from .input import AudioInput
+from .spectral import CPU_BUDGET, SpectralBlow
+
+
+
+CHANNELS = 2
+FORMAT = 'S16_LE'
+RATE = 8000
+BUFFER_TIME = 200000
+
+# arecord's default period time is a quarter of the buffer time.
+PERIOD_FRAMES = RATE * BUFFER_TIME // 4 // 1000000
+
+
+
+def _audio_input(mode, device='default', arecord_bin='arecord'):
+
+    # Returns an AudioInput in `mode` and a list that collects its readings.
+
+    readings = []
+    wiring = wires.Wires()
+    wiring.audio_batch.wire(lambda timestamps, batch: readings.extend(batch))
+    audio_input = AudioInput(
+        None, wiring, 'nice', arecord_bin, device, CHANNELS, FORMAT, RATE,
+        BUFFER_TIME, -1, mode=mode,
+    )
+    return audio_input, readings
+
+
+def _pcm_handlers(audio_input, readings, spectral):
+
+    # Returns a PCM data handler for `audio_input`, in 'pcm' mode, which, if
+    # `spectral` is set, also processes data with a SpectralBlow stage, as
+    # its worker thread would, collecting its readings, and the stage.
+
+    if not spectral:
+        return audio_input._handle_pcm_data, None
+
+    stage = SpectralBlow(None, FORMAT, CHANNELS, RATE)
+    stage._start_ts = 0
+    offsets = [0]
+
+    def handler(data):
+        audio_input._handle_pcm_data(data)
+        _timestamps, batch = stage._process(offsets[0], data)
+        offsets[0] += len(data)
+        readings.extend(batch)
+
+    return handler, stage
+
+
+def _synthetic_periods(seconds, seed=2017):
+
+    # Returns a list of (PCM data, "Max peak" line) tuples, one per period
+    # in `seconds` of sound bursts over noise, as arecord produces.
+
+    rng = random.Random(seed)
+    result = []
+    amplitude = 0
+    for period in range(seconds * RATE // PERIOD_FRAMES):
+        amplitude = max(0, min(30000, amplitude + rng.randint(-3000, 3000)))
+        samples = array.array('h')
+        for frame in range(PERIOD_FRAMES):
+            value = int(amplitude * math.sin(frame / 3)) + rng.randint(-200, 200)
+            samples.extend([value] * CHANNELS)
+        if sys.byteorder != 'little':
+            samples.byteswap()
+        peak = max(map(abs, samples))
+        percent = peak * 100 // 32768
+        line = b'Max peak (%d samples): 0x%08x %s| %d%%\n' % (
+            PERIOD_FRAMES * CHANNELS, peak, b'#' * (percent // 5), percent,
+        )
+        result.append((samples.tobytes(), line))
+    return result
+
+
+def _run_synthetic(mode, periods, spectral=False):
+
+    # Returns a (CPU seconds, readings, spectral stage) tuple for `mode`
+    # handling `periods`.
+
+    audio_input, readings = _audio_input(mode)
+    if mode == 'pcm':
+        (handler, stage), index = _pcm_handlers(audio_input, readings, spectral), 0
+    else:
+        (handler, stage), index = (audio_input._handle_arecord_output, None), 1
+    start_time = process_time()
+    for period in periods:
+        handler(period[index])
+    return process_time() - start_time, len(readings), stage
+
+
+def _run_live(mode, seconds, device, arecord_bin, spectral=False):
+
+    # Returns a (CPU seconds, readings, spectral stage) tuple for `mode`
+    # handling `seconds` of arecord output, including arecord's CPU use.
+
+    audio_input, readings = _audio_input(mode, device, arecord_bin)
+    args = audio_input._spawn_args[1:]
+    args.insert(-1, '--duration=%d' % (seconds,))
+    if mode == 'pcm':
+        handler, stage = _pcm_handlers(audio_input, readings, spectral)
+        handlers = {'stdout': handler, 'stderr': audio_input._handle_arecord_error}
+    else:
+        stage = None
+        handlers = {'stdout': None, 'stderr': audio_input._handle_arecord_output}
+
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start_time = process_time()
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    with selectors.DefaultSelector() as selector:
+        selector.register(proc.stdout, selectors.EVENT_READ, handlers['stdout'])
+        selector.register(proc.stderr, selectors.EVENT_READ, handlers['stderr'])
+        while selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fileobj)
+                elif key.data:
+                    key.data(data)
+    proc.wait()
+    own_time = process_time() - start_time
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    children_time = (
+        children_after.ru_utime - children_before.ru_utime +
+        children_after.ru_stime - children_before.ru_stime
+    )
+    return own_time + children_time, len(readings), stage
+
+
+def main(argv):
+
+    seconds = int(argv[1]) if len(argv) > 1 else 60
+    device = argv[2] if len(argv) > 2 else None
+    arecord_bin = argv[3] if len(argv) > 3 else 'arecord'
+
+    modes = [('vu', False), ('pcm', False)]
+    if SpectralBlow.AVAILABLE:
+        modes.append(('pcm', True))
+
+    if device:
+        print('live arecord capture, %ds from %r' % (seconds, device))
+        runs = [_run_live(mode, seconds, device, arecord_bin, spectral) for mode, spectral in modes]
+    else:
+        print('synthetic arecord output, %ds, this process only' % (seconds,))
+        periods = _synthetic_periods(seconds)
+        runs = [_run_synthetic(mode, periods, spectral) for mode, spectral in modes]
+
+    print('%-13s %10s %8s %12s' % ('mode', 'cpu-secs', 'cpu', 'readings/s'))
+    for (mode, spectral), (cpu_time, readings, _stage) in zip(modes, runs):
+        print('%-13s %10.3f %7.2f%% %12.1f' % (
+            mode + ('+spectral' if spectral else ''),
+            cpu_time,
+            100 * cpu_time / seconds,
+            readings / seconds,
+        ))
+
+    stage = runs[-1][2]
+    if not stage:
+        print('spectral stage not available: NumPy not installed')
+        return 0
+    cpu_use = stage.stats()['cpu_use']
+    within = cpu_use <= CPU_BUDGET
+    print('spectral stage: %.2f%% of one core, budget %.2f%%: %s' % (
+        100 * cpu_use,
+        100 * CPU_BUDGET,
+        'within budget' if within else 'OVER BUDGET',
+    ))
+    return 0 if within else 1
+
+
+if __name__ == '__main__':
+
+    sys.exit(main(sys.argv))
+
+
+# ----------------------------------------------------------------------------
+# inputs/audio/benchmark.py
+# ----------------------------------------------------------------------------
@@ -8,12 +8,16 @@
 The audio input.
 """
 
+from time import monotonic
 
 from twisted.internet import defer
 from twisted import logger
 
 from inputs import input_base
-from common import process
+from common import framing, process
+
+from .pcm import PCMMeter
+from .spectral import CPU_BUDGET, SpectralBlow
 
 
 
@@ -32,14 +36,33 @@ class AudioInput(input_base.InputBase):
     #
     #   "Max peak (800 samples): 0x00007ffc #################### 99%"
     #
-    # These are parsed into individual integer readings and output via the
-    # `wiring.audio` call.
+    # These are framed into lines, regardless of how the output is chunked,
+    # parsed into integer readings and output in batches, along with their
+    # timestamps, via `wiring.audio_batch` calls, then one at a time, via
+    # `wiring.audio` calls.
+    #
+    # Alternatively, with `mode` set to 'pcm', arecord streams raw PCM audio
+    # to stdout, metered by a `PCMMeter` into `pcm_rate` readings per second,
+    # output the same way: no VU meter rendering, nor parsing, and the
+    # reading rate no longer depends on arecord's.
+    #
+    # In 'pcm' mode, with `spectral` set, raw PCM audio is also processed by
+    # a `SpectralBlow` stage, in a worker thread, into 'blow-likeness'
+    # readings, output as a separate source, via `wiring.blow_batch` calls.
+
+    _MODES = ('vu', 'pcm')
 
     def __init__(self, reactor, wiring, nice_bin, arecord_bin,
-                 device, channels, format, rate, buffer_time, respawn_delay):
+                 device, channels, format, rate, buffer_time, respawn_delay,
+                 mode='vu', pcm_rate=20, pcm_measure='peak', pcm_release=0.3,
+                 spectral=False, spectral_window=512, spectral_hop=256, spectral_blow_hz=500):
 
         super(AudioInput, self).__init__(reactor, wiring)
 
+        if mode not in self._MODES:
+            raise ValueError('Invalid audio input mode %r.' % (mode,))
+        self._mode = mode
+
         # Note: running arecord under nice seems to be a good idea.
         self._spawn_args = [
             nice_bin,
@@ -49,14 +72,37 @@ class AudioInput(input_base.InputBase):
             '--format=%s' % (format,),
             '--rate=%s' % (rate,),
             '--buffer-time=%s' % (buffer_time,),
-            '-vvv',
-            '/dev/null',
         ]
+        if mode == 'pcm':
+            self._spawn_args.extend(['--file-type=raw', '--quiet', '-'])
+        else:
+            self._spawn_args.extend(['-vvv', '/dev/null'])
         self._respawn_delay = float(respawn_delay)
         self._arecord_proto = None
 
-        # Someone, somewhere, can track our readings via the `wiring`.
-        self._output_callable = wiring.audio
+        # VU meter output framing, restarted with each arecord process, and
+        # arecord's period time: a quarter of the buffer time, by default.
+        self._vu_framer = framing.LineFramer()
+        self._vu_period = buffer_time / 4 / 1000000
+        self._vu_bad_records = 0
+        self._vu_last_ts = 0
+
+        # PCM metering, restarted with each arecord process, and timestamp
+        # of its first reading's window start.
+        self._pcm_meter_args = (format, channels, rate, pcm_rate, pcm_measure, pcm_release)
+        self._pcm_meter = PCMMeter(*self._pcm_meter_args) if mode == 'pcm' else None
+        self._pcm_start_ts = None
+
+        # Spectral blow detection, restarted with each arecord process.
+        if spectral and mode != 'pcm':
+            raise ValueError('Spectral blow detection requires the pcm mode.')
+        if spectral and not SpectralBlow.AVAILABLE:
+            _log.warn('spectral blow detection not available: NumPy not installed')
+            spectral = False
+        self._spectral_args = (
+            format, channels, rate, spectral_window, spectral_hop, spectral_blow_hz,
+        ) if spectral else None
+        self._spectral = None
 
 
     @defer.inlineCallbacks
@@ -71,11 +117,25 @@ class AudioInput(input_base.InputBase):
     def _spawn_arecord(self):
 
         _log.debug('spawning arecord')
+        if self._mode == 'pcm':
+            self._pcm_meter = PCMMeter(*self._pcm_meter_args)
+            self._pcm_start_ts = None
+            if self._spectral:
+                self._stop_spectral()
+            if self._spectral_args:
+                self._spectral = SpectralBlow(self._wiring.blow_batch, *self._spectral_args)
+            callables = dict(
+                out_callable=self._handle_pcm_data,
+                err_callable=self._handle_arecord_error,
+            )
+        else:
+            self._vu_framer = framing.LineFramer()
+            callables = dict(err_callable=self._handle_arecord_output)
         self._arecord_proto = process.spawn(
             self._reactor,
             self._spawn_args,
             'inputs.audio.proc',
-            err_callable=self._handle_arecord_output,
+            **callables
         )
         _log.debug('waiting arecord start')
         yield self._arecord_proto.started
@@ -102,18 +162,77 @@ class AudioInput(input_base.InputBase):
 
     def _handle_arecord_output(self, data):
 
-        # Called for each stderr output "block" from the arecord process.
+        # Called for each stderr output "block" from the arecord process,
+        # with any number of lines, possibly partial: readings are
+        # timestamped one period apart, the last one now, but never before
+        # the previous batch's.
+
+        readings = []
+        for record in self._vu_framer.feed(data):
+            if not record.startswith(b'Max peak'):
+                continue
+            try:
+                readings.append(int(record[record.rindex(b' ')+1:].rstrip(b'%')))
+            except ValueError:
+                self._vu_bad_records += 1
+                _log.warn('bad record {r!r}', r=record)
+        if not readings:
+            return
 
-        _log.debug('arecord output data={d!r}', d=data)
-        if not data.startswith(b'Max peak'):
+        now = monotonic()
+        count = len(readings)
+        last_ts = self._vu_last_ts
+        timestamps = [
+            max(now - self._vu_period * (count - n), last_ts)
+            for n in range(1, count + 1)
+        ]
+        self._vu_last_ts = now
+        self._output_readings('audio', timestamps, readings)
+
+
+    def _handle_pcm_data(self, data):
+
+        # Called for each stdout output "block" from the arecord process,
+        # in 'pcm' mode: readings are timestamped by the audio sample clock,
+        # starting when the first block arrives.
+
+        if self._spectral:
+            self._spectral.feed(data)
+
+        readings = self._pcm_meter.feed(data)
+        if not readings:
             return
 
-        try:
-            reading = int(data[data.rfind(b' ')+1:-2])
-        except Exception as e:
-            _log.warn('bad data {d!r}: {e!r}', d=data, e=e)
-        else:
-            self._output_callable(reading)
+        meter = self._pcm_meter
+        if self._pcm_start_ts is None:
+            self._pcm_start_ts = monotonic() - meter.window_time * len(readings)
+        first = meter.counters['readings'] - len(readings) + 1
+        timestamps = [
+            self._pcm_start_ts + meter.window_time * n
+            for n in range(first, first + len(readings))
+        ]
+        self._output_readings('audio', timestamps, readings)
+
+
+    def _handle_arecord_error(self, data):
+
+        # Called for each stderr output "block" from the arecord process,
+        # in 'pcm' mode, where it only reports problems.
+
+        _log.warn('arecord: {d!r}', d=data)
+
+
+    @defer.inlineCallbacks
+    def _stop_spectral(self):
+
+        # Stops the spectral blow detection stage, logging its stats.
+
+        spectral, self._spectral = self._spectral, None
+        yield spectral.stop()
+        stats = spectral.stats()
+        _log.info('spectral stats: {s!r}', s=stats)
+        if stats['cpu_use'] > CPU_BUDGET:
+            _log.warn('spectral CPU use {u:.3f} over budget {b:.3f}', u=stats['cpu_use'], b=CPU_BUDGET)
 
 
     @defer.inlineCallbacks
@@ -121,21 +240,24 @@ class AudioInput(input_base.InputBase):
 
         _log.info('stopping')
 
+        if self._pcm_meter:
+            _log.info('pcm meter stats: {s!r}', s=dict(self._pcm_meter.counters))
+        if self._spectral:
+            yield self._stop_spectral()
+        else:
+            stats = dict(self._vu_framer.counters, bad=self._vu_bad_records)
+            _log.info('vu framer stats: {s!r}', s=stats)
+
         if not self._arecord_proto:
             _log.info('no arecord process to stop')
             return
 
         _log.info('signalling arecord termination')
         try:
-            self._arecord_proto.terminate()
+            yield self._arecord_proto.terminate_or_kill()
         except OSError as e:
             _log.warn('signalling arecord failed: {e!r}', e=e)
             raise
-        else:
-            _log.info('signalled arecord termination')
-
-        _log.debug('waiting for arecord termination')
-        yield self._arecord_proto.stopped
         _log.debug('arecord terminated')
 
         _log.info('stopped')
@@ -0,0 +1,163 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# inputs/audio/pcm.py
+# ----------------------------------------------------------------------------
+
+"""
+Raw PCM audio level metering.
+"""
+
+import collections
+import math
+
+try:
+    import numpy
+except ImportError:
+    # Windows are metered via memoryview casts, one at a time.
+    numpy = None
+
+
+
+# Supported ALSA formats: memoryview cast format, NumPy dtype, bytes per
+# sample, silence level and full scale amplitude.
+FORMATS = {
+    'S8': ('b', 'i1', 1, 0, 1 << 7),
+    'U8': ('B', 'u1', 1, 1 << 7, 1 << 7),
+    'S16_LE': ('h', '<i2', 2, 0, 1 << 15),
+    'S32_LE': ('i', '<i4', 4, 0, 1 << 31),
+}
+
+MEASURES = ('peak', 'rms', 'envelope')
+
+
+
+class PCMMeter(object):
+
+    """
+    Turns raw, interleaved, PCM audio data into level readings, one per
+    window of `rate / reading_rate` frames, as a percentage of full scale,
+    like arecord's VU meter:
+    - 'peak': the highest absolute sample value.
+    - 'rms': the root mean square of sample values.
+    - 'envelope': peaks, decaying exponentially with a `release` seconds
+      time constant, when they drop.
+
+    Data is metered in place, via memoryview slices, vectorised if NumPy is
+    available; partial windows are carried over to the next data.
+    """
+
+    def __init__(self, format, channels, rate, reading_rate=20, measure='peak', release=0.3):
+
+        try:
+            cast_format, dtype, width, zero, full_scale = FORMATS[format]
+        except KeyError:
+            raise ValueError('Unsupported PCM format %r.' % (format,))
+        if measure not in MEASURES:
+            raise ValueError('Invalid PCM measure %r.' % (measure,))
+
+        self._cast_format = cast_format
+        self._dtype = dtype
+        self._zero = zero
+        self._full_scale = full_scale
+        self._measure = measure
+
+        frames = max(1, int(round(rate / reading_rate)))
+        self._window_samples = frames * channels
+        self._window_bytes = self._window_samples * width
+
+        # Seconds of audio per reading.
+        self.window_time = frames / rate
+
+        # Envelope decay factor per window, and current value.
+        self._release_factor = math.exp(-self.window_time / release) if release > 0 else 0
+        self._envelope = 0
+
+        # Partial window data, carried over.
+        self._carry = bytearray()
+
+        # 'bytes', 'readings'.
+        self.counters = collections.Counter()
+
+
+    def feed(self, data):
+        """
+        Meters `data`, a bytes-like object, returning a list with one reading
+        per window completed.
+        """
+        self.counters['bytes'] += len(data)
+        view = memoryview(data)
+        levels = []
+
+        if self._carry:
+            needed = self._window_bytes - len(self._carry)
+            self._carry += view[:needed]
+            view = view[needed:]
+            if len(self._carry) < self._window_bytes:
+                return []
+            levels.extend(self._levels(memoryview(self._carry)))
+            self._carry = bytearray()
+
+        complete = len(view) - len(view) % self._window_bytes
+        if complete:
+            levels.extend(self._levels(view[:complete]))
+        if complete < len(view):
+            self._carry += view[complete:]
+
+        return self._readings(levels)
+
+
+    def _levels(self, view):
+
+        # Returns the peak or RMS level of each window in `view`, in sample
+        # units, relative to silence.
+
+        if numpy is not None:
+            return self._levels_numpy(view)
+
+        zero = self._zero
+        samples = view.cast(self._cast_format)
+        size = self._window_samples
+        result = []
+        for start in range(0, len(samples), size):
+            window = samples[start:start+size]
+            if self._measure == 'rms':
+                if zero:
+                    window = [sample - zero for sample in window]
+                result.append(math.sqrt(sum(sample * sample for sample in window) / size))
+            else:
+                result.append(max(max(window) - zero, zero - min(window)))
+        return result
+
+
+    def _levels_numpy(self, view):
+
+        samples = numpy.frombuffer(view, dtype=self._dtype).reshape(-1, self._window_samples)
+        if self._measure == 'rms':
+            values = samples.astype(numpy.float64) - self._zero
+            levels = numpy.sqrt(numpy.einsum('ij,ij->i', values, values) / self._window_samples)
+        else:
+            # Extremes first, such that no full size copy is needed.
+            highest = samples.max(axis=1).astype(numpy.int64) - self._zero
+            lowest = samples.min(axis=1).astype(numpy.int64) - self._zero
+            levels = numpy.maximum(highest, -lowest)
+        return levels.tolist()
+
+
+    def _readings(self, levels):
+
+        # Converts `levels` to readings, as a percentage of full scale.
+
+        result = []
+        for level in levels:
+            if self._measure == 'envelope':
+                level = max(level, self._envelope * self._release_factor)
+                self._envelope = level
+            result.append(int(level * 100 / self._full_scale))
+        self.counters['readings'] += len(result)
+        return result
+
+
+# ----------------------------------------------------------------------------
+# inputs/audio/pcm.py
+# ----------------------------------------------------------------------------
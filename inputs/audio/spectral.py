@@ -0,0 +1,272 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# inputs/audio/spectral.py
+# ----------------------------------------------------------------------------
+
+"""
+Asyncronous, Twisted based, spectral blow detection, over raw PCM audio.
+"""
+
+import collections
+from time import monotonic, thread_time
+
+from twisted.internet import defer, threads
+from twisted import logger
+
+try:
+    import numpy
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+    # Spectral blow detection is not available.
+    numpy = None
+
+from .pcm import FORMATS
+
+
+
+_log = logger.Logger(namespace='inputs.audio.spectral')
+
+
+# Real-time CPU budget: CPU seconds per audio second, in one core, that is,
+# 10% of one core, 2.5% of a 4-core board, like the Raspberry Pi 3.
+CPU_BUDGET = 0.1
+
+# Lower band edge, in Hz: bands are octaves from here up to the Nyquist
+# frequency; the DC bin, below, is ignored.
+_LOWEST_BAND_HZ = 62.5
+
+# Added to energies, avoiding divisions by zero and logarithms of zero.
+_EPSILON = 1e-12
+
+
+
+class SpectralBlow(object):
+
+    """
+    Turns raw, interleaved, PCM audio data into 'blow-likeness' readings,
+    one every `hop` frames, over sliding `window` frame windows, output via
+    `output_callable` batch calls, with lists of timestamps and readings.
+
+    Blowing into a microphone produces turbulence: noise-like sound, with a
+    flat spectrum, concentrated in low frequencies; speech and music, on the
+    other hand, are tonal, with energy concentrated in harmonics, mostly
+    above those. Each reading is the window's peak level, as a percentage of
+    full scale, like `PCMMeter` 'peak' readings, weighted by:
+    - The fraction of energy in the octave bands below `blow_hz`.
+    - The spectral flatness in those bands: the ratio of the geometric to
+      the arithmetic mean of the power spectrum, 1 for noise, near 0 for
+      tones.
+
+    Spectra are computed with NumPy FFTs, in a worker thread, one batch of
+    data at a time: data arriving meanwhile is queued, and dropped, oldest
+    first, if more than `max_pending` seconds of it are queued.
+    """
+
+    # Whether NumPy, required, is available.
+    AVAILABLE = numpy is not None
+
+    def __init__(self, output_callable, format, channels, rate, window=512, hop=256,
+                 blow_hz=500, max_pending=1):
+
+        if numpy is None:
+            raise RuntimeError('Spectral blow detection requires NumPy.')
+        try:
+            _cast_format, dtype, width, zero, full_scale = FORMATS[format]
+        except KeyError:
+            raise ValueError('Unsupported PCM format %r.' % (format,))
+        if not 0 < hop <= window:
+            raise ValueError('Invalid spectral window/hop %r/%r.' % (window, hop))
+
+        self._output_callable = output_callable
+        self._dtype = dtype
+        self._channels = channels
+        self._rate = rate
+        self._zero = zero
+        self._full_scale = full_scale
+        self._window = window
+        self._hop = hop
+        self._frame_bytes = width * channels
+        self._max_pending_bytes = int(max_pending * rate) * self._frame_bytes
+
+        # Window function and FFT bin index ranges for each band, along with
+        # which of those are blow bands.
+        self._window_function = numpy.hanning(window)
+        frequencies = numpy.fft.rfftfreq(window, 1 / rate)
+        edges = [_LOWEST_BAND_HZ]
+        while edges[-1] * 2 < rate / 2:
+            edges.append(edges[-1] * 2)
+        self._band_starts = numpy.unique(numpy.concatenate((
+            [1], numpy.searchsorted(frequencies, edges).clip(1, len(frequencies) - 1),
+        )))
+        band_highs = numpy.append(frequencies[self._band_starts[1:]], rate / 2)
+        self._blow_bands = band_highs <= max(blow_hz, band_highs[0])
+        blow_band_count = int(self._blow_bands.sum())
+        if blow_band_count < len(self._band_starts):
+            self._blow_bins_end = int(self._band_starts[blow_band_count])
+        else:
+            self._blow_bins_end = len(frequencies)
+
+        # Reactor thread state: data queued, as (stream byte offset, data)
+        # tuples, the offset of the next data and the in-flight job, if any.
+        self._pending = collections.deque()
+        self._pending_bytes = 0
+        self._offset = 0
+        self._job_d = None
+        self._start_ts = None
+        self._stopping = False
+
+        # Worker thread state: partial frame bytes, mono samples carried
+        # over, with the frame number of the first one, and the stream byte
+        # offset they end at.
+        self._tail = b''
+        self._carry = numpy.zeros(0)
+        self._carry_frame = 0
+        self._position = 0
+
+        # CPU and audio seconds processed.
+        self._cpu_time = 0
+        self._audio_time = 0
+
+        # 'jobs', 'readings', 'dropped-bytes', 'discontinuities', ...
+        self.counters = collections.Counter()
+
+
+    def feed(self, data):
+        """
+        Queues `data`, a bytes-like object, for processing.
+        """
+        if self._stopping:
+            return
+        if self._start_ts is None:
+            self._start_ts = monotonic() - len(data) / self._frame_bytes / self._rate
+        self._pending.append((self._offset, bytes(data)))
+        self._pending_bytes += len(data)
+        self._offset += len(data)
+        while self._pending_bytes > self._max_pending_bytes and len(self._pending) > 1:
+            _offset, dropped = self._pending.popleft()
+            self._pending_bytes -= len(dropped)
+            self.counters['dropped-bytes'] += len(dropped)
+        if not self._job_d:
+            self._dispatch()
+
+
+    def _dispatch(self):
+
+        # Processes all queued data in a worker thread.
+
+        offset = self._pending[0][0]
+        data = b''.join(chunk for _offset, chunk in self._pending)
+        self._pending.clear()
+        self._pending_bytes = 0
+        self._job_d = threads.deferToThread(self._process, offset, data)
+        self._job_d.addCallbacks(self._output, self._process_failed)
+        self._job_d.addBoth(self._job_done)
+
+
+    def _output(self, result):
+
+        timestamps, readings = result
+        if readings:
+            self._output_callable(timestamps, readings)
+
+
+    def _process_failed(self, failure):
+
+        self.counters['failures'] += 1
+        _log.warn('spectral processing failed: {f}', f=failure.getErrorMessage())
+
+
+    def _job_done(self, _):
+
+        self._job_d = None
+        if self._pending:
+            self._dispatch()
+
+
+    def _process(self, offset, data):
+
+        # Runs in a worker thread: returns a (timestamps, readings) tuple for
+        # the windows completed by `data`, at stream byte `offset`.
+
+        start_cpu_time = thread_time()
+        self.counters['jobs'] += 1
+        frame_bytes = self._frame_bytes
+
+        if offset != self._position:
+            # Queued data was dropped: restart at the next frame boundary.
+            self.counters['discontinuities'] += 1
+            skip = -offset % frame_bytes
+            data = data[skip:]
+            offset += skip
+            self._tail = b''
+            self._carry = numpy.zeros(0)
+            self._carry_frame = offset // frame_bytes
+        self._position = offset + len(data)
+
+        data = self._tail + data if self._tail else data
+        usable = len(data) - len(data) % frame_bytes
+        self._tail = data[usable:]
+        samples = numpy.frombuffer(data, dtype=self._dtype, count=usable // frame_bytes * self._channels)
+        mono = samples.reshape(-1, self._channels).mean(axis=1) - self._zero
+        self._audio_time += len(mono) / self._rate
+
+        values = numpy.concatenate((self._carry, mono)) if len(self._carry) else mono
+        count = (len(values) - self._window) // self._hop + 1 if len(values) >= self._window else 0
+        if not count:
+            self._carry = values
+            self._cpu_time += thread_time() - start_cpu_time
+            return [], []
+
+        frames = sliding_window_view(values, self._window)[::self._hop][:count]
+        spectra = numpy.abs(numpy.fft.rfft(frames * self._window_function, axis=1)) ** 2
+        spectra = spectra[:, 1:] + _EPSILON
+        energies = numpy.add.reduceat(spectra, self._band_starts - 1, axis=1)
+        total = energies.sum(axis=1)
+        low_ratio = energies[:, self._blow_bands].sum(axis=1) / total
+        blow_spectra = spectra[:, :self._blow_bins_end - 1]
+        flatness = numpy.exp(numpy.log(blow_spectra).mean(axis=1)) / blow_spectra.mean(axis=1)
+        peaks = numpy.abs(frames).max(axis=1) * 100 / self._full_scale
+        readings = (peaks * low_ratio * flatness).astype(numpy.int64).tolist()
+
+        first_frame = self._carry_frame
+        ends = first_frame + numpy.arange(count) * self._hop + self._window
+        timestamps = (self._start_ts + ends / self._rate).tolist()
+
+        consumed = count * self._hop
+        self._carry = values[consumed:].copy()
+        self._carry_frame = first_frame + consumed
+        self.counters['readings'] += count
+        self._cpu_time += thread_time() - start_cpu_time
+        return timestamps, readings
+
+
+    @defer.inlineCallbacks
+    def stop(self):
+        """
+        Stops processing, discarding queued data, returning a deferred that
+        fires once the in-flight worker thread job, if any, completes.
+        """
+        self._stopping = True
+        self._pending.clear()
+        self._pending_bytes = 0
+        if self._job_d:
+            done_d = defer.Deferred()
+            self._job_d.addBoth(lambda result: done_d.callback(None) or result)
+            yield done_d
+
+
+    def stats(self):
+        """
+        Returns a dict with the counters and the CPU use, in CPU seconds per
+        audio second, along with the budget.
+        """
+        result = dict(self.counters)
+        result['cpu_use'] = self._cpu_time / self._audio_time if self._audio_time else 0
+        result['cpu_budget'] = CPU_BUDGET
+        return result
+
+
+# ----------------------------------------------------------------------------
+# inputs/audio/spectral.py
+# ----------------------------------------------------------------------------
@@ -49,6 +49,20 @@ class InputBase(object):
         raise NotImplementedError()
 
 
+    def _output_readings(self, name, timestamps, readings):
+
+        """
+        Outputs `readings`, sampled at the respective `timestamps`, by calling
+        `<name>_batch` on the wiring, then `<name>` with each reading, for
+        consumers tracking readings one at a time.
+        """
+
+        self._wiring['%s_batch' % name](timestamps, readings)
+        output_callable = self._wiring[name]
+        for reading in readings:
+            output_callable(reading)
+
+
 # ----------------------------------------------------------------------------
 # inputs/input_base.py
 # ----------------------------------------------------------------------------
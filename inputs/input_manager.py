@@ -93,16 +93,18 @@ class InputManager(object):
     def stop(self):
 
         """
-        Instantiates each configured input, returning a deferred that
+        Stops each input, concurrently, returning a deferred that
         fires on completion.
         """
 
         _log.info('stopping inputs')
-        for input_type, input_obj in self._inputs:
-            try:
-                yield input_obj.stop()
-            except Exception as e:
-                _log.error('failed input {it!r} stop: {e!r}', it=input_type, e=e)
+        results = yield defer.DeferredList(
+            [defer.maybeDeferred(input_obj.stop) for _, input_obj in self._inputs],
+            consumeErrors=True,
+        )
+        for (input_type, _), (success, result) in zip(self._inputs, results):
+            if not success:
+                _log.error('failed input {it!r} stop: {e!r}', it=input_type, e=result.value)
         _log.info('stopped inputs')
 
 
@@ -59,6 +59,14 @@ class WSProto(websocket.WebSocketServerProtocol):
         # Request notification of AGD thresholds.
         self.factory.wiring.request_agd_thresholds()
 
+        # Handle level readiness notifications by pushing them to the client.
+        self.factory.wiring.notify_level_readiness.wire(
+            self._push_level_readiness
+        )
+
+        # Request notification of level readiness.
+        self.factory.wiring.request_level_readiness()
+
 
     def onMessage(self, payload, isBinary):
 
@@ -132,6 +140,11 @@ class WSProto(websocket.WebSocketServerProtocol):
             self._push_agd_threshold
         )
 
+        # Can't push level readiness updates to the client anymore.
+        self.factory.wiring.notify_level_readiness.unwire(
+            self._push_level_readiness
+        )
+
         _log.warn('{p.host}:{p.port} disconnected', p=self.transport.getPeer())
 
 
@@ -167,6 +180,19 @@ class WSProto(websocket.WebSocketServerProtocol):
         _log.info("sent agd threshold: {l!r}={v!r}", v=value, l=level)
 
 
+    def _push_level_readiness(self, level, readiness):
+
+        """
+        Pushes a play level's readiness to the client.
+        """
+
+        self._send_message_dict('level-readiness', {
+            "level": level,
+            "readiness": readiness,
+        })
+        _log.info("sent level readiness: {l!r}={r!r}", l=level, r=readiness)
+
+
     def __call__(self, event):
 
         # Called by Twisted when delivering a log event to this observer.
@@ -230,6 +230,9 @@ function socket_message(msg) {
         case 'chart-threshold':
             _update_chart_threshold(obj);
             break;
+        case 'level-readiness':
+            _update_level_readiness(obj);
+            break;
         case 'log-message':
             update_log(obj.message);
             break;
@@ -267,6 +270,32 @@ function _update_chart_threshold(data_object) {
 
 
 
+// Updates level buttons from an object with .level and .readiness values,
+// creating missing ones, in level order; level 0 has no button.
+
+function _update_level_readiness(data_object) {
+    var level = data_object.level;
+    if ( level == 0 ) {
+        return;
+    }
+    var button = document.getElementById('level_'+level);
+    if ( !button ) {
+        button = document.createElement('button');
+        button.id = 'level_'+level;
+        button.dataset.level = level;
+        button.innerText = ' '+level+' ';
+        button.onclick = function() { change_play_level(level); };
+        var container = document.getElementById('level_control');
+        var next = Array.from(container.children).find(
+            item => Number(item.dataset.level) > level
+        );
+        container.insertBefore(button, next || null);
+    }
+    button.className = data_object.readiness;
+}
+
+
+
 // Asks the user for a new threshold value and notifies the server about it.
 
 function _prompt_level_threshold(level) {
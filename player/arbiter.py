@@ -0,0 +1,197 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/arbiter.py
+# ----------------------------------------------------------------------------
+
+"""
+Asyncronous, Twisted based, play level change request arbitration.
+"""
+
+import collections
+from time import monotonic
+
+from twisted import logger
+
+
+
+_log = logger.Logger(namespace='player.arbiter')
+
+
+
+class _TokenBucket(object):
+
+    """
+    Token bucket rate limiter: allows `burst` requests at once and `rate`
+    requests per second, sustained.
+    """
+
+    def __init__(self, rate, burst):
+
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._last_time = monotonic()
+
+
+    def take(self):
+        """
+        Returns True, taking a token, if one is available.
+        """
+        now = monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._last_time) * self._rate)
+        self._last_time = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+
+class TriggerArbiter(object):
+
+    """
+    Sits between inputs requesting play level changes and the player manager.
+
+    Requests are rate limited per source and coalesced within a time window,
+    such that only the highest level requested in it is delivered; ties go to
+    the highest priority source.
+    """
+
+    # Per source settings used when not configured.
+    _DEFAULT_SOURCE_SETTINGS = {'priority': 0, 'rate': 10, 'burst': 10}
+
+    def __init__(self, reactor, change_play_level_callable, settings):
+
+        """
+        Initializes the arbiter:
+        - `reactor` is the Twisted reactor.
+        - `change_play_level_callable` is called with (level, comment) with
+          arbitrated requests.
+        - `settings` is a dict with the optional ['player']['arbiter'] keys:
+          - 'window': coalescing time window, in seconds, defaults to 0.05;
+            0 disables coalescing.
+          - 'sources': dict keyed by source name, like 'web' or 'agd', of
+            dicts with 'priority', 'rate' and 'burst' keys; the 'default'
+            key applies to other sources.
+        """
+
+        self._reactor = reactor
+        self._change_play_level = change_play_level_callable
+
+        arbiter_settings = settings.get('player', {}).get('arbiter', {})
+        self._window = arbiter_settings.get('window', 0.05)
+        self._source_settings = arbiter_settings.get('sources', {})
+
+        # keys/values: source names/_TokenBucket instances
+        self._buckets = {}
+
+        # The best (level, priority, comment, source) request in the current
+        # coalescing window, if any.
+        self._pending = None
+        self._window_dc = None
+
+        # keys/values: (source, outcome)/count, outcomes being 'accepted',
+        # 'merged' or 'rejected'
+        self.counters = collections.Counter()
+
+
+    @staticmethod
+    def _source_name(comment):
+
+        # Inputs identify themselves in the comment: 'web', 'network' or
+        # 'agd-<source> == <value>'.
+
+        name = comment.split(' ', 1)[0] if comment else ''
+        return name or 'unknown'
+
+
+    def _settings_for(self, source):
+
+        # Returns settings for `source`, falling back to its prefix (like
+        # 'agd' for 'agd-arduino'), then to 'default'.
+
+        for name in (source, source.split('-', 1)[0], 'default'):
+            if name in self._source_settings:
+                source_settings = dict(self._DEFAULT_SOURCE_SETTINGS)
+                source_settings.update(self._source_settings[name])
+                return source_settings
+        return self._DEFAULT_SOURCE_SETTINGS
+
+
+    def _bucket_for(self, source, source_settings):
+
+        bucket = self._buckets.get(source)
+        if bucket is None:
+            bucket = self._buckets[source] = _TokenBucket(
+                source_settings['rate'],
+                source_settings['burst'],
+            )
+        return bucket
+
+
+    def request(self, level, comment=''):
+        """
+        Handles a `level` change request, wired to `change_play_level`.
+        """
+        source = self._source_name(comment)
+        source_settings = self._settings_for(source)
+
+        if not self._bucket_for(source, source_settings).take():
+            self.counters[source, 'rejected'] += 1
+            _log.info('rejected level={l!r} from {s!r}: rate limited', l=level, s=source)
+            return
+
+        candidate = (level, source_settings['priority'], comment, source)
+
+        if not self._window:
+            self.counters[source, 'accepted'] += 1
+            self._change_play_level(level, comment)
+            return
+
+        if self._pending is None:
+            self._pending = candidate
+            self._window_dc = self._reactor.callLater(self._window, self._deliver)
+            return
+
+        # Keep the best of both requests, counting the other one as merged.
+        if candidate[:2] > self._pending[:2]:
+            candidate, self._pending = self._pending, candidate
+        self.counters[candidate[3], 'merged'] += 1
+        _log.debug('merged level={l!r} from {s!r}', l=candidate[0], s=candidate[3])
+
+
+    def _deliver(self):
+
+        # Called at the end of the coalescing window.
+
+        level, _priority, comment, source = self._pending
+        self._pending = None
+        self._window_dc = None
+        self.counters[source, 'accepted'] += 1
+        self._change_play_level(level, comment)
+
+
+    def stats(self):
+        """
+        Returns a dict of source names/dicts of outcomes/counts.
+        """
+        result = collections.defaultdict(dict)
+        for (source, outcome), count in self.counters.items():
+            result[source][outcome] = count
+        return dict(result)
+
+
+    def cancel(self):
+        """
+        Drops any pending request.
+        """
+        if self._window_dc and self._window_dc.active():
+            self._window_dc.cancel()
+        self._window_dc = None
+        self._pending = None
+
+
+# ----------------------------------------------------------------------------
+# player/arbiter.py
+# ----------------------------------------------------------------------------
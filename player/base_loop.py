@@ -0,0 +1,297 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/base_loop.py
+# ----------------------------------------------------------------------------
+
+"""
+Asyncronous, Twisted based, level 0 base video loop.
+"""
+
+import collections
+from time import monotonic
+
+from twisted.internet import defer
+from twisted import logger
+
+
+
+_log = logger.Logger(namespace='player.base')
+
+
+
+class BaseLoop(object):
+
+    """
+    Keeps level 0 video playing, with no visible hitch at its loop point.
+
+    Uses two players, alternating between two layers below the other levels:
+    the active one plays while a standby one is spawned, paused; just before
+    the active one reaches its end, based on the video duration, the standby
+    one is crossfaded in and becomes active, while the previous one stops and
+    is replaced by a new standby one.
+
+    Standby players usually play the same file; optionally, every so often,
+    another level 0 file is picked.
+
+    Players are spawned looping, such that if a crossfade is missed, they
+    still loop on their own.
+    """
+
+    # Layers used by base players: always below other levels.
+    _LAYERS = (0, -1)
+
+    # Crossfades complete this many seconds before the video ends.
+    _END_MARGIN = 0.2
+
+    def __init__(self, reactor, create_player_callable, random_file_callable, settings):
+
+        """
+        Initializes the base loop:
+        - `reactor` is the Twisted reactor.
+        - `create_player_callable` is called with a `filename` and OMXPlayer
+          keyword arguments and should return a deferred firing with a level
+          0 player, spawned; `filename` may be None, for a random one.
+        - `random_file_callable` should return a random level 0 filename.
+        - `settings` is a dict with the optional ['player']['base_loop'] keys:
+          - 'gapless': if False, a single looping player is used, defaults
+            to True.
+          - 'crossfade': crossfade duration, in seconds, defaults to 1.
+          - 'rotate_minutes': minutes after which another file is picked;
+            0, the default, means never.
+        """
+
+        self._reactor = reactor
+        self._create_player = create_player_callable
+        self._random_file = random_file_callable
+
+        base_settings = settings.get('player', {}).get('base_loop', {})
+        self._gapless = base_settings.get('gapless', True)
+        self._crossfade = base_settings.get('crossfade', 1)
+        self._rotate_every = base_settings.get('rotate_minutes', 0) * 60
+
+        # The playing player and the one that will follow it, if any.
+        self.active = None
+        self.standby = None
+
+        self._active_play_time = None
+        self._crossfade_dc = None
+        self._preparing_standby = False
+        self._rotated_time = None
+        self._stopping = False
+
+        # 'crossfades', 'rotations', 'missed', 'standby-failures', ...
+        self.counters = collections.Counter()
+
+
+    @property
+    def players(self):
+        """
+        List of base players: the active one and the standby one, if any.
+        """
+        return [player for player in (self.active, self.standby) if player]
+
+
+    @defer.inlineCallbacks
+    def start(self):
+        """
+        Spawns and plays the first base player, then readies a standby one.
+        Returns a deferred that fires once the first player is playing.
+        """
+        self._rotated_time = monotonic()
+        self.active = yield self._create_player(
+            filename=None,
+            layer=self._LAYERS[0],
+            loop=True,
+            fadeout=self._crossfade,
+        )
+        play_d = self.active.play()
+        self._active_play_time = monotonic()
+        yield play_d
+
+        if not self._gapless:
+            return
+        self._schedule_crossfade()
+        if self._crossfade_dc:
+            self._prepare_standby()
+
+
+    def _schedule_crossfade(self):
+
+        # Schedules the crossfade to complete just before the active player
+        # reaches its end.
+
+        duration = self.active.duration
+        if not duration:
+            _log.warn('unknown duration for {f!r}: plain looping', f=self.active.filename)
+            return
+        elapsed = (monotonic() - self._active_play_time) % duration
+        delay = duration - elapsed - self._crossfade - self._END_MARGIN
+        if delay < 0:
+            # Too late for this loop: aim at the next one.
+            delay += duration
+        self._crossfade_dc = self._reactor.callLater(delay, self._start_crossfade)
+        _log.debug('crossfading in {d:.1f}s', d=delay)
+
+
+    def _cancel_crossfade(self):
+
+        if self._crossfade_dc and self._crossfade_dc.active():
+            self._crossfade_dc.cancel()
+        self._crossfade_dc = None
+
+
+    def _standby_filename(self):
+
+        # The active player's filename or, if it is time to rotate, another
+        # random one, if available.
+
+        filename = self.active.filename
+        if not self._rotate_every:
+            return filename
+        if monotonic() - self._rotated_time < self._rotate_every:
+            return filename
+        self._rotated_time = monotonic()
+        for _ in range(3):
+            new_filename = self._random_file()
+            if new_filename != filename:
+                self.counters['rotations'] += 1
+                _log.info('rotating to {f!r}', f=new_filename)
+                return new_filename
+        return filename
+
+
+    @defer.inlineCallbacks
+    def _prepare_standby(self):
+
+        # Spawns the standby player on the layer the active one isn't using.
+
+        if self._preparing_standby or self.standby or self._stopping:
+            return
+        self._preparing_standby = True
+        layer = self._LAYERS[1] if self.active.layer == self._LAYERS[0] else self._LAYERS[0]
+        try:
+            standby = yield self._create_player(
+                filename=self._standby_filename(),
+                layer=layer,
+                loop=True,
+                fadein=self._crossfade,
+                fadeout=self._crossfade,
+            )
+        except Exception as e:
+            self.counters['standby-failures'] += 1
+            _log.warn('failed preparing standby player: {e!r}', e=e)
+            return
+        finally:
+            self._preparing_standby = False
+
+        if self._stopping:
+            yield standby.stop()
+            return
+        self.standby = standby
+        _log.info('standby player ready: {p!r}', p=standby)
+
+
+    def _start_crossfade(self):
+
+        # Crossfades, logging unexpected failures.
+
+        d = self._do_crossfade()
+        d.addErrback(self._crossfade_failed)
+
+
+    def _crossfade_failed(self, failure):
+
+        # Called when crossfading fails unexpectedly.
+
+        _log.warn('crossfading failed: {f}', f=failure.value)
+
+
+    @defer.inlineCallbacks
+    def _do_crossfade(self):
+
+        # Crossfades the standby player in, replacing the active one.
+
+        self._crossfade_dc = None
+        standby, outgoing = self.standby, self.active
+        if not standby:
+            # The active player loops on its own, with a hitch.
+            self.counters['missed'] += 1
+            _log.warn('no standby player ready: missed crossfade')
+            self._schedule_crossfade()
+            self._prepare_standby()
+            return
+
+        self.standby = None
+        self.active = standby
+        try:
+            if standby.layer > outgoing.layer:
+                # Fade the new player in, above the outgoing one.
+                crossfade_d = standby.play()
+                self._active_play_time = monotonic()
+            else:
+                # Show the new player below the outgoing one, fading that out.
+                play_d = standby.play(skip_fadein=True)
+                self._active_play_time = monotonic()
+                yield play_d
+                crossfade_d = outgoing.fadeout()
+            self._schedule_crossfade()
+            yield crossfade_d
+            self.counters['crossfades'] += 1
+        except Exception as e:
+            _log.warn('crossfade failed: {e!r}', e=e)
+        try:
+            yield outgoing.stop()
+        except Exception as e:
+            _log.warn('stopping outgoing player failed: {e!r}', e=e)
+        self._prepare_standby()
+
+
+    def player_ended(self, player):
+        """
+        Tracks that `player` ended, crossfading straight away to the standby
+        one, if the active player ended unexpectedly.
+        """
+        if self._stopping:
+            return
+        if player is self.standby:
+            _log.warn('standby player ended unexpectedly')
+            self.standby = None
+            self._prepare_standby()
+        elif player is self.active and self.standby:
+            _log.warn('active player ended unexpectedly')
+            self._cancel_crossfade()
+            self._start_crossfade()
+
+
+    def forget(self, player):
+        """
+        Forgets about `player`, such that a new standby one is prepared, if
+        it was the standby one.
+        """
+        if player is self.standby:
+            self.standby = None
+            self._prepare_standby()
+
+
+    def stop(self):
+        """
+        Stops crossfading and preparing new players, returning the active
+        player and the standby one (either may be None) for the caller to
+        stop them.
+        """
+        self._stopping = True
+        self._cancel_crossfade()
+        return self.active, self.standby
+
+
+    def stats(self):
+        """
+        Returns a dict with the counters.
+        """
+        return dict(self.counters)
+
+
+# ----------------------------------------------------------------------------
+# player/base_loop.py
+# ----------------------------------------------------------------------------
@@ -0,0 +1,281 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/catalog.py
+# ----------------------------------------------------------------------------
+
+"""
+Asyncronous, Twisted based, per level video file catalog.
+"""
+
+import os
+import random
+
+from twisted.internet import defer
+from twisted.python import filepath
+from twisted import logger
+
+try:
+    from twisted.internet import inotify
+except ImportError:
+    # Not on Linux: folders can't be watched.
+    inotify = None
+
+
+
+_log = logger.Logger(namespace='player.catalog')
+
+
+
+class _FileSet(object):
+
+    """
+    Set of filenames supporting O(1) addition, removal and random choice.
+    """
+
+    def __init__(self):
+
+        self._names = []
+
+        # keys/values: filenames/indexes in self._names
+        self._indexes = {}
+
+
+    def __len__(self):
+
+        return len(self._names)
+
+
+    def __iter__(self):
+
+        return iter(list(self._names))
+
+
+    def __contains__(self, name):
+
+        return name in self._indexes
+
+
+    def add(self, name):
+        """
+        Adds `name`, if not already present.
+        """
+        if name not in self._indexes:
+            self._indexes[name] = len(self._names)
+            self._names.append(name)
+
+
+    def discard(self, name):
+        """
+        Removes `name`, if present, by moving the last name into its place.
+        """
+        index = self._indexes.pop(name, None)
+        if index is None:
+            return
+        last_name = self._names.pop()
+        if last_name != name:
+            self._names[index] = last_name
+            self._indexes[last_name] = index
+
+
+    def choice(self):
+        """
+        Returns a random name; raises IndexError if empty.
+        """
+        return random.choice(self._names)
+
+
+
+class VideoCatalog(object):
+
+    """
+    Tracks the available video files for each level, optionally watching
+    level folders with inotify to incrementally follow files showing up,
+    changing or going away, while the metadata index scans new and changed
+    files such that unplayable ones are left out.
+    """
+
+    # Complete files showing up or changing, and files going away.
+    _ADDED_MASK = 0
+    _REMOVED_MASK = 0
+    if inotify:
+        _ADDED_MASK = inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO
+        _REMOVED_MASK = inotify.IN_DELETE | inotify.IN_MOVED_FROM
+
+    def __init__(self, reactor, metadata, settings):
+
+        """
+        Initializes the catalog:
+        - `reactor` is the Twisted reactor.
+        - `metadata` is a VideoMetadataIndex.
+        - `settings` is a dict with:
+           - ['levels'][*]['folder']
+           - ['player']['watch_folders'], optional, defaults to True
+        """
+
+        self._reactor = reactor
+        self._metadata = metadata
+
+        # keys/values: integer levels/level folders
+        self._folders = {
+            int(level): level_info['folder']
+            for level, level_info in settings['levels'].items()
+        }
+        self._watch = settings.get('player', {}).get('watch_folders', True)
+        self._notifier = None
+
+        # keys/values: integer levels/_FileSet instances
+        self._files = {level: _FileSet() for level in self._folders}
+
+        # Called with (level, filename) when a file is added or removed.
+        self.file_added_callable = None
+        self.file_removed_callable = None
+
+
+    @staticmethod
+    def _ignored(name):
+
+        # Hidden files, like the ones some copying tools create while
+        # copying, are ignored.
+
+        return name.startswith('.')
+
+
+    def load(self):
+        """
+        Populates the catalog from each level's folder contents.
+        """
+        for level, folder in self._folders.items():
+            for name in os.listdir(folder):
+                if not self._ignored(name):
+                    self._files[level].add(os.path.join(folder, name))
+        _log.debug('files found: {d!r}', d={l: list(f) for l, f in self._files.items()})
+
+
+    @defer.inlineCallbacks
+    def index(self):
+        """
+        Obtains metadata for all files, leaving out unplayable ones.
+        Returns a deferred that fires when done.
+        """
+        all_files = [name for files in self._files.values() for name in files]
+        yield self._metadata.update(all_files)
+
+        for level, files in self._files.items():
+            for name in files:
+                error = self._metadata.error(name)
+                if error:
+                    _log.warn('ignoring unplayable {n!r}: {e}', n=name, e=error)
+                    files.discard(name)
+            if not files:
+                _log.error('no playable files for level {l!r}', l=level)
+
+
+    def random_file(self, level):
+        """
+        Returns a random filename for `level`.
+        """
+        return self._files[level].choice()
+
+
+    def has_files(self, level):
+        """
+        Returns True if `level` has any files available.
+        """
+        return bool(self._files[level])
+
+
+    def has_file(self, level, name):
+        """
+        Returns True if `name` is available for `level`.
+        """
+        return name in self._files[level]
+
+
+    def start_watching(self):
+        """
+        Starts watching level folders for changes, if so configured.
+        """
+        if not self._watch:
+            return
+        if not inotify:
+            _log.warn('cannot watch folders: inotify not available')
+            return
+
+        self._notifier = inotify.INotify(self._reactor)
+        self._notifier.startReading()
+        for level, folder in self._folders.items():
+            self._notifier.watch(
+                filepath.FilePath(folder),
+                mask=self._ADDED_MASK | self._REMOVED_MASK,
+                callbacks=[lambda _, path, mask, level=level: self._folder_changed(level, path, mask)],
+            )
+            _log.info('watching {f!r}', f=folder)
+
+
+    def stop_watching(self):
+        """
+        Stops watching level folders for changes.
+        """
+        if self._notifier:
+            self._notifier.loseConnection()
+            self._notifier = None
+
+
+    def _folder_changed(self, level, path, mask):
+
+        # Called by inotify when a file in a `level` folder changes.
+
+        name = path.path
+        if isinstance(name, bytes):
+            name = name.decode('utf-8', 'surrogateescape')
+        if self._ignored(os.path.basename(name)):
+            return
+
+        if mask & self._REMOVED_MASK:
+            self._remove_file(level, name)
+        elif mask & self._ADDED_MASK:
+            # Changed files are removed first: players using them are stale.
+            self._remove_file(level, name)
+            self._add_file(level, name)
+
+
+    def _remove_file(self, level, name):
+
+        # Forgets `name`, letting our user know.
+
+        if name not in self._files[level]:
+            return
+        self._files[level].discard(name)
+        _log.info('removed level={l!r} {n!r}', l=level, n=name)
+        if self.file_removed_callable:
+            self.file_removed_callable(level, name)
+
+
+    @defer.inlineCallbacks
+    def _add_file(self, level, name):
+
+        # Scans new or changed `name` and adds it, if playable.
+
+        try:
+            yield self._metadata.update([name])
+        except Exception as e:
+            _log.warn('failed scanning {n!r}: {e!r}', n=name, e=e)
+            return
+
+        error = self._metadata.error(name)
+        if error:
+            _log.warn('ignoring unplayable {n!r}: {e}', n=name, e=error)
+            self._remove_file(level, name)
+            return
+
+        if name not in self._files[level]:
+            self._files[level].add(name)
+            _log.info('added level={l!r} {n!r}', l=level, n=name)
+            if self.file_added_callable:
+                self.file_added_callable(level, name)
+
+
+# ----------------------------------------------------------------------------
+# player/catalog.py
+# ----------------------------------------------------------------------------
@@ -5,24 +5,350 @@
 # ----------------------------------------------------------------------------
 
 """
-Asyncrounous, Twisted Based, DBus connection setup and name tracking.
+Asyncrounous, Twisted Based, DBus connection setup, name tracking and
+remote call scheduling.
 """
 
+import bisect
+import collections
+import heapq
+import itertools
 import os
+from time import monotonic
 
 from twisted.internet import defer
+from twisted.python import failure
 from twisted import logger
 
-from txdbus import client as txdbus_client
+from txdbus import client as txdbus_client, error
 
 from common import process
 
+from .dbus_names import DBusNameRegistry
+
 
 
 _log = logger.Logger(namespace='player.dbus')
 
 
 
+class _Histogram(object):
+
+    """
+    Fixed bucket histogram of durations, in seconds.
+    """
+
+    # Bucket upper bounds, in milliseconds; the last bucket is unbounded.
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self):
+
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.total = 0
+        self.max = 0
+
+
+    def add(self, seconds):
+        """
+        Tracks a `seconds` long duration.
+        """
+        self.counts[bisect.bisect_left(self.BOUNDS_MS, seconds * 1000)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+    def stats(self):
+        """
+        Returns a dict with 'count', 'avg' and 'max', in seconds, and
+        '<=Nms' keys with non-zero per-bucket counts.
+        """
+        count = sum(self.counts)
+        result = {
+            'count': count,
+            'avg': self.total / count if count else 0,
+            'max': self.max,
+        }
+        labels = ['<=%sms' % (bound,) for bound in self.BOUNDS_MS] + ['>%sms' % (self.BOUNDS_MS[-1],)]
+        for label, bucket_count in zip(labels, self.counts):
+            if bucket_count:
+                result[label] = bucket_count
+        return result
+
+
+
+class _Call(object):
+
+    """
+    A scheduled DBus remote method call.
+    """
+
+    def __init__(self, priority, remote_obj, method, args, interface, deadline, supersede_key):
+
+        self.priority = priority
+        self.remote_obj = remote_obj
+        self.method = method
+        self.args = args
+        self.interface = interface
+        self.enqueue_time = monotonic()
+        self.deadline = self.enqueue_time + deadline
+        self.supersede_key = supersede_key
+        self.superseded = False
+        self.deferred = defer.Deferred()
+
+
+
+class DBusCallScheduler(object):
+
+    """
+    Schedules DBus remote method calls by priority class, bounding how many
+    are in flight, such that urgent calls don't wait behind less urgent ones.
+
+    Priority classes, most urgent first:
+    - 'transport': playback control, like PlayPause, Stop or SetPosition.
+    - 'alpha': alpha changes, driving fades.
+    - 'property': property reads.
+
+    Each call has a deadline: calls still queued past it fail without being
+    sent, and sent calls time out when it is reached. Queued calls with the
+    same supersede key are replaced by newer ones, like alpha changes that
+    have gone stale.
+
+    Tracks per method queue time and round trip time histograms.
+    """
+
+    PRIORITIES = ('transport', 'alpha', 'property')
+
+    # Default per class deadlines, in seconds.
+    _DEFAULT_DEADLINES = {'transport': 2, 'alpha': 0.5, 'property': 2}
+
+    def __init__(self, settings):
+
+        """
+        Initializes the scheduler from `settings`, a dict with the optional
+        ['player']['dbus_calls'] keys:
+        - 'max_in_flight': calls in flight, defaults to 4; property reads
+          use at most half of these, such that urgent calls find a slot.
+        - 'deadlines': dict of per priority class deadlines, in seconds.
+        """
+
+        calls_settings = settings.get('player', {}).get('dbus_calls', {})
+        self._max_in_flight = calls_settings.get('max_in_flight', 4)
+        self._max_reads_in_flight = max(1, self._max_in_flight // 2)
+        self._deadlines = dict(self._DEFAULT_DEADLINES)
+        self._deadlines.update(calls_settings.get('deadlines', {}))
+
+        # Heap of (priority index, sequence number, _Call) tuples.
+        self._queue = []
+        self._sequence = itertools.count()
+
+        # keys/values: supersede keys/queued _Call instances
+        self._supersedable = {}
+
+        self._in_flight = 0
+        self._reads_in_flight = 0
+
+        # keys/values: method names/_Histogram instances
+        self._queue_times = collections.defaultdict(_Histogram)
+        self._round_trip_times = collections.defaultdict(_Histogram)
+
+        # keys/values: (method name, outcome)/count, outcomes being 'ok',
+        # 'failed', 'expired' or 'superseded'
+        self.counters = collections.Counter()
+
+
+    def call(self, remote_obj, method, *args, priority, interface=None,
+             deadline=None, supersede_key=None):
+        """
+        Schedules calling `method` with `args` on the txdbus `remote_obj`,
+        with `priority`, one of PRIORITIES; `deadline` is in seconds, the
+        class default if None. If `supersede_key` is set, any queued call
+        with the same key is superseded, its deferred firing with None.
+
+        Returns a deferred that fires with the call result, or fails with a
+        txdbus TimeOut error if the deadline is reached.
+        """
+        priority_index = self.PRIORITIES.index(priority)
+        if deadline is None:
+            deadline = self._deadlines[priority]
+        call = _Call(priority, remote_obj, method, args, interface, deadline, supersede_key)
+
+        if supersede_key is not None:
+            stale_call = self._supersedable.pop(supersede_key, None)
+            if stale_call:
+                stale_call.superseded = True
+                self.counters[method, 'superseded'] += 1
+                stale_call.deferred.callback(None)
+            self._supersedable[supersede_key] = call
+
+        heapq.heappush(self._queue, (priority_index, next(self._sequence), call))
+        self._send_queued()
+        return call.deferred
+
+
+    def _send_queued(self):
+
+        # Sends queued calls, most urgent first, while there are free slots.
+
+        while self._queue and self._in_flight < self._max_in_flight:
+            _priority_index, _sequence, call = self._queue[0]
+            if call.superseded:
+                heapq.heappop(self._queue)
+                continue
+            if call.priority == 'property' and self._reads_in_flight >= self._max_reads_in_flight:
+                # Property reads are the least urgent: nothing else queued.
+                break
+            heapq.heappop(self._queue)
+            if call.supersede_key is not None and self._supersedable.get(call.supersede_key) is call:
+                del self._supersedable[call.supersede_key]
+            self._send(call)
+
+
+    def _send(self, call):
+
+        # Sends `call`, unless its deadline has been reached.
+
+        now = monotonic()
+        remaining = call.deadline - now
+        if remaining <= 0:
+            self.counters[call.method, 'expired'] += 1
+            _log.warn('{m} call expired after {t:.3f}s queued', m=call.method, t=now-call.enqueue_time)
+            call.deferred.errback(error.TimeOut('%s call deadline reached while queued' % (call.method,)))
+            return
+
+        self._queue_times[call.method].add(now - call.enqueue_time)
+        self._in_flight += 1
+        if call.priority == 'property':
+            self._reads_in_flight += 1
+        d = call.remote_obj.callRemote(
+            call.method,
+            *call.args,
+            interface=call.interface,
+            timeout=remaining
+        )
+        d.addBoth(self._call_done, call, now)
+
+
+    def _call_done(self, result, call, send_time):
+
+        # Called when a sent `call` completes or fails.
+
+        self._in_flight -= 1
+        if call.priority == 'property':
+            self._reads_in_flight -= 1
+        self._round_trip_times[call.method].add(monotonic() - send_time)
+        outcome = 'failed' if isinstance(result, failure.Failure) else 'ok'
+        self.counters[call.method, outcome] += 1
+
+        self._send_queued()
+        call.deferred.callback(result)
+
+
+    def stats(self):
+        """
+        Returns a dict of method names/dicts with outcome counts and
+        'queue' and 'round_trip' time histogram stats.
+        """
+        result = collections.defaultdict(dict)
+        for (method, outcome), count in self.counters.items():
+            result[method][outcome] = count
+        for method, histogram in self._queue_times.items():
+            result[method]['queue'] = histogram.stats()
+        for method, histogram in self._round_trip_times.items():
+            result[method]['round_trip'] = histogram.stats()
+        return dict(result)
+
+
+
+class _TrafficMeter(object):
+
+    """
+    Counts DBus messages and bytes per member and direction, by wrapping a
+    txdbus connection's message sending and per message type handlers.
+
+    Method returns and errors are accounted to the member of the call they
+    reply to, errors as '<member>!'.
+    """
+
+    # Sent method call members, kept to account replies to, are bounded.
+    _MAX_PENDING = 1024
+
+    def __init__(self):
+
+        # keys/values: ('in'|'out', member)/[message count, byte count]
+        self._traffic = collections.defaultdict(lambda: [0, 0])
+
+        # keys/values: sent method call serials/members, oldest first
+        self._pending = collections.OrderedDict()
+
+
+    def instrument(self, dbus_conn):
+        """
+        Starts accounting `dbus_conn` traffic.
+        """
+        send_message = dbus_conn.sendMessage
+
+        def _send_message(msg):
+            self._track_sent(msg)
+            send_message(msg)
+
+        dbus_conn.sendMessage = _send_message
+
+        for name in ('methodCallReceived', 'methodReturnReceived',
+                     'errorReceived', 'signalReceived'):
+            setattr(dbus_conn, name, self._wrap_handler(getattr(dbus_conn, name)))
+
+
+    def _wrap_handler(self, handler):
+
+        # Returns a received message `handler` wrapper that tracks messages.
+
+        def _handle_message(msg):
+            self._track_received(msg)
+            handler(msg)
+
+        return _handle_message
+
+
+    def _track_sent(self, msg):
+
+        # Tracks sent `msg`, remembering its member if a reply is expected.
+
+        member = getattr(msg, 'member', None) or '-'
+        if msg._messageType == 1 and getattr(msg, 'expectReply', False):
+            self._pending[msg.serial] = member
+            if len(self._pending) > self._MAX_PENDING:
+                self._pending.popitem(last=False)
+        counts = self._traffic['out', member]
+        counts[0] += 1
+        counts[1] += len(msg.rawMessage)
+
+
+    def _track_received(self, msg):
+
+        # Tracks received `msg`, accounting replies to the call's member.
+
+        member = getattr(msg, 'member', None)
+        if member is None:
+            member = self._pending.pop(getattr(msg, 'reply_serial', None), '-')
+            if msg._messageType == 3:
+                member += '!'
+        counts = self._traffic['in', member]
+        counts[0] += 1
+        counts[1] += len(msg.rawHeader) + len(msg.rawPadding) + len(msg.rawBody)
+
+
+    def stats(self):
+        """
+        Returns a dict of 'in'/'out' directions/dicts of members/dicts with
+        'messages' and 'bytes' counts.
+        """
+        result = {'in': {}, 'out': {}}
+        for (direction, member), (messages, byte_count) in sorted(self._traffic.items()):
+            result[direction][member] = {'messages': messages, 'bytes': byte_count}
+        return result
+
+
+
 class DBusManager(object):
 
     """
@@ -32,21 +358,49 @@ class DBusManager(object):
 
     def __init__(self, reactor, settings):
 
+        """
+        Initializes the DBus manager:
+        - `reactor` is the Twisted reactor.
+        - `settings` is a dict with:
+           - ['environment']['dbus_daemon_bin']
+           - ['player']['dbus_names'], optional, see DBusNameRegistry
+           - ['player']['dbus_calls'], optional, see DBusCallScheduler
+        """
+
         self._reactor = reactor
 
         # Will be set once the private DBus process is spawned.
         self._dbus_daemon_bin = settings['environment']['dbus_daemon_bin']
         self._dbus_proto = None
 
+        # The private DBus address, without the guid, reused on respawns.
+        self._dbus_daemon_address = None
+
+        # What `connect_to_dbus` was asked to connect to and the namespace
+        # of the names to track, if set.
+        self._bus_address = None
+        self._name_namespace = None
+
         # Our connection to DBus.
         self._dbus_conn = None
 
         # Will be called on DBus disconnect.
         self._disconnect_callable = None
 
-        # keys/values: DBus names/Twisted deferreds
-        self._names_starting = {}
-        self._names_stopping = {}
+        # The org.freedesktop.DBus object, once connected.
+        self._dbus_obj = None
+
+        # Tracks DBus names showing up/going away.
+        self._names = DBusNameRegistry(reactor, settings)
+
+        # Schedules remote calls to players.
+        self._calls = DBusCallScheduler(settings)
+
+        # Accounts DBus traffic, across reconnections.
+        self._traffic = _TrafficMeter()
+
+        # 'owner-replaced', 'foreign-names'
+        self.counters = collections.Counter()
 
 
     @property
@@ -61,15 +415,22 @@ class DBusManager(object):
 
 
     @defer.inlineCallbacks
-    def connect_to_dbus(self, bus_address='session', disconnect_callable=None):
+    def connect_to_dbus(self, bus_address='session', disconnect_callable=None,
+                        name_namespace=None):
         """
         Connects to DBus and sets up DBus object name tracking.
+
+        If `name_namespace` is set, like 'a.b', only names in it, like 'a.b'
+        or 'a.b.c', are tracked: DBus doesn't even deliver changes to others.
         """
         if not self._dbus_proto:
             yield self._spawn_dbus_daemon()
 
+        self._bus_address = bus_address
+        self._name_namespace = name_namespace
         _log.info('connecting to dbus')
         self._dbus_conn = yield txdbus_client.connect(self._reactor, bus_address)
+        self._traffic.instrument(self._dbus_conn)
         _log.info('connected to dbus')
 
         # Track DBus disconnections.
@@ -83,10 +444,19 @@ class DBusManager(object):
             'org.freedesktop.DBus',
             '/org/freedesktop/DBus'
         )
+        self._dbus_obj = dbus_obj
+
+        # Subscribe with a match rule of our own, such that DBus filters out
+        # NameOwnerChanged signals for names outside the namespace.
         _log.debug('subscribing to NameOwnerChanged signal')
-        yield dbus_obj.notifyOnSignal(
-            'NameOwnerChanged',
-            self._dbus_signal_name_owner_changed
+        yield self._dbus_conn.addMatch(
+            self._dbus_signal_name_owner_changed,
+            mtype='signal',
+            sender='org.freedesktop.DBus',
+            interface='org.freedesktop.DBus',
+            member='NameOwnerChanged',
+            path='/org/freedesktop/DBus',
+            arg0namespace=name_namespace,
         )
         _log.debug('subscribed to NameOwnerChanged signal')
 
@@ -96,14 +466,19 @@ class DBusManager(object):
 
         # Spawns a child DBus daemon, reads its address from its stdout and
         # sets the DBUS_SESSION_BUS_ADDRESS environment variable (so that we
-        # and our child processes can connect to it).
+        # and our child processes can connect to it). Respawned daemons
+        # listen on the same address, such that it remains valid.
 
         stdout_queue = defer.DeferredQueue()
 
+        args = [self._dbus_daemon_bin, '--session', '--print-address', '--nofork']
+        if self._dbus_daemon_address:
+            args.append('--address=%s' % (self._dbus_daemon_address,))
+
         _log.info('spawning dbus daemon {ddb!r}', ddb=self._dbus_daemon_bin)
         self._dbus_proto = process.spawn(
             self._reactor,
-            [self._dbus_daemon_bin, '--session', '--print-address', '--nofork'],
+            args,
             'player.proc.dbus-daemon',
             out_callable=stdout_queue.put,
         )
@@ -125,12 +500,76 @@ class DBusManager(object):
             raise
         else:
             os.environ['DBUS_SESSION_BUS_ADDRESS'] = bus_address
+            self._dbus_daemon_address = ','.join(
+                part for part in bus_address.split(',')
+                if not part.startswith('guid=')
+            )
+
+
+    @defer.inlineCallbacks
+    def reconnect(self, timeout=2):
+        """
+        Reconnects to DBus after a disconnection, respawning the DBus daemon
+        if it is gone or if connecting to it fails within `timeout` seconds.
+
+        Returns a deferred that fires with the set of well-known names on the
+        bus, once reconnected.
+        """
+        if self._dbus_proto:
+            try:
+                # The daemon may be on its way out: give it a chance.
+                yield self._dbus_proto.wait_stopped(timeout=timeout/4)
+            except defer.TimeoutError:
+                pass
+            else:
+                _log.warn('dbus daemon is gone')
+                self._dbus_proto = None
+
+        try:
+            connecting = self.connect_to_dbus(
+                self._bus_address, self._disconnect_callable, self._name_namespace,
+            )
+            connecting.addTimeout(timeout, self._reactor)
+            yield connecting
+        except Exception as e:
+            if not self._dbus_proto:
+                raise
+            _log.warn('failed reconnecting: {e!r}', e=e)
+            # The daemon seems broken: replace it.
+            yield self._dbus_proto.terminate_or_kill()
+            self._dbus_proto = None
+            yield self.connect_to_dbus(
+                self._bus_address, self._disconnect_callable, self._name_namespace,
+            )
+
+        bus_names = yield self.bus_names(timeout=timeout)
+        defer.returnValue(bus_names)
+
+
+    @defer.inlineCallbacks
+    def bus_names(self, timeout=1):
+        """
+        Returns a deferred that fires with the set of well-known names on the
+        bus, other than DBus' own.
+        """
+        if not self._dbus_obj:
+            raise RuntimeError('Not connected to DBus.')
+        bus_names = yield self._dbus_obj.callRemote(
+            'ListNames',
+            interface='org.freedesktop.DBus',
+            timeout=timeout,
+        )
+        defer.returnValue({
+            name for name in bus_names
+            if not name.startswith(':') and name != 'org.freedesktop.DBus'
+        })
 
 
     @defer.inlineCallbacks
-    def cleanup(self):
+    def cleanup(self, kill_after=1):
         """
-        Ensures the spawned DBus daemon is properly stopped.
+        Ensures the spawned DBus daemon is properly stopped, sending it a
+        SIGKILL if it does not terminate within `kill_after` seconds.
         """
         _log.info('cleaning up')
 
@@ -140,15 +579,10 @@ class DBusManager(object):
 
         _log.info('signalling dbus daemon termination')
         try:
-            self._dbus_proto.terminate()
+            yield self._dbus_proto.terminate_or_kill(kill_after)
         except OSError as e:
             _log.warn('signalling dbus daemon failed: {e!r}', e=e)
             raise
-        else:
-            _log.info('signalled dbus daemon termination')
-
-        _log.debug('waiting for dbus daemon termination')
-        yield self._dbus_proto.stopped
         _log.debug('dbus daemon terminated')
 
         _log.info('cleaned up')
@@ -160,12 +594,10 @@ class DBusManager(object):
 
         _log.info('lost connection: {f}', f=failure.value)
         self._dbus_conn = None
+        self._dbus_obj = None
 
-        # Assume any names being waited on for stopping are gone.
-        for name in self._names_stopping:
-            _log.debug('assuming name {n!r} stopped', n=name)
-            self._signal_name_change(self._names_stopping, name)
-            _log.debug('assumed name {n!r} stopped', n=name)
+        # Assume all names are gone.
+        self._names.disconnected()
 
         if self._disconnect_callable:
             try:
@@ -174,81 +606,131 @@ class DBusManager(object):
                 _log.warn('disconnect callable failed: {e}', e=e)
 
 
-    def _dbus_signal_name_owner_changed(self, name, old_addr, new_addr):
+    def call_remote(self, remote_obj, method, *args, **kwargs):
+        """
+        Calls `method` on `remote_obj` through the call scheduler: see
+        DBusCallScheduler.call for details.
+        """
+        return self._calls.call(remote_obj, method, *args, **kwargs)
 
-        # DBus NameOwnerChanged signal handler
-        # ------------------------------------
-        # `old_addr` will be '' if name just showed up on the bus.
-        # `new_addr` will be '' if name is just gone from the bus.
 
-        _log.debug('name {n!r} owner change: {f!r} to {t!r}', n=name,
-                   f=old_addr, t=new_addr)
-        if not old_addr:
-            tracking_dict = self._names_starting
-        elif not new_addr:
-            tracking_dict = self._names_stopping
-        else:
-            _log.error('unexpected signal data')
+    def call_stats(self):
+        """
+        Returns remote call stats: see DBusCallScheduler.stats.
+        """
+        return self._calls.stats()
 
-        self._signal_name_change(tracking_dict, name)
 
+    def traffic_stats(self):
+        """
+        Returns DBus traffic stats: see _TrafficMeter.stats.
+        """
+        return self._traffic.stats()
 
-    @staticmethod
-    def _signal_name_change(tracking_dict, name):
 
-        # Fires the associated `name` deferred in `tracking_dict`.
+    def _in_namespace(self, name):
+
+        # True if `name` is in the tracked names namespace, if any.
+
+        namespace = self._name_namespace
+        return not namespace or name == namespace or name.startswith(namespace + '.')
 
-        d = tracking_dict.get(name)
-        if not d:
-            _log.debug('no deferred for {n!r}', n=name)
-            return
+
+    def _dbus_signal_name_owner_changed(self, msg):
+
+        # DBus NameOwnerChanged signal message handler
+        # --------------------------------------------
+        # The body holds the name, the old and new owner addresses:
+        # - The old address will be '' if name just showed up on the bus.
+        # - The new address will be '' if name is just gone from the bus.
 
         try:
-            if not d.called:
-                d.callback(None)
-        except Exception as e:
-            _log.error('failed firing {n!r} deferred: {e!r}', n=name, e=e)
+            name, old_addr, new_addr = msg.body
+        except (TypeError, ValueError):
+            _log.warn('bad NameOwnerChanged signal body: {b!r}', b=msg.body)
+            return
+
+        if not self._in_namespace(name):
+            # DBus filters these: unless some other match rule lets them in.
+            self.counters['foreign-names'] += 1
+            return
+
+        _log.debug('name {n!r} owner change: {f!r} to {t!r}', n=name,
+                   f=old_addr, t=new_addr)
+        if not old_addr:
+            self._names.started(name)
+        elif not new_addr:
+            self._names.stopped(name)
+        else:
+            # Owner replaced: not something we care about.
+            self.counters['owner-replaced'] += 1
+            _log.debug('name {n!r} owner replaced', n=name)
 
 
     def track_dbus_name(self, name):
         """
         Starts `name` lifecycle tracking on DBus.
         """
-        if name in self._names_starting:
-            raise RuntimeError('Name %r already tracked.' % (name, ))
+        self._names.track(name)
 
-        # These will fire, respectively, when name shows up/goes away.
-        self._names_starting[name] = defer.Deferred()
-        self._names_stopping[name] = defer.Deferred()
-        _log.info('tracking dbus name {n!r}', n=name)
+
+    def reattach_dbus_name(self, name):
+        """
+        Resumes `name` lifecycle tracking on DBus, after a reconnection,
+        given that it is on the bus.
+        """
+        self._names.reattach(name)
+
+
+    def release_dbus_name(self, name):
+        """
+        Stops `name` lifecycle tracking on DBus: to be called when the
+        process owning `name` ends.
+        """
+        self._names.release(name)
 
 
     @defer.inlineCallbacks
     def wait_dbus_name_start(self, name):
         """
         Returns a deferred that fires when `name` shows up on the bus.
+        Fails if it doesn't show up in time, or if its owner is gone.
         """
-        try:
-            _log.info('waiting name {n!r} start', n=name)
-            yield self._names_starting[name]
-            _log.info('name {n!r} started', n=name)
-            del self._names_starting[name]
-        except KeyError:
-            raise RuntimeError('name %r not tracked.' % (name,))
+        _log.info('waiting name {n!r} start', n=name)
+        yield self._names.wait_started(name)
+        _log.info('name {n!r} started', n=name)
 
 
     @defer.inlineCallbacks
     def wait_dbus_name_stop(self, name):
         """
         Returns a deferred that fires when `name` goes away from the bus.
+        Fails with a TimeoutError if it doesn't go away in time.
         """
-        try:
-            _log.info('waiting name {n!r} stop', n=name)
-            yield self._names_stopping[name]
-            _log.info('name {n!r} stopped', n=name)
-            del self._names_stopping[name]
-        except KeyError:
-            raise RuntimeError('name %r not tracked.' % (name,))
+        _log.info('waiting name {n!r} stop', n=name)
+        yield self._names.wait_stopped(name)
+        _log.info('name {n!r} stopped', n=name)
+
+
+    @defer.inlineCallbacks
+    def introspect(self, timeout=1):
+        """
+        Returns a deferred that fires with a dict of tracked name counts per
+        state, tracking counters, and:
+        - 'leaked': live names, per tracking, that are not on the bus.
+        - 'untracked': well-known names on the bus that are not tracked.
+        Bus names are only compared if connected.
+        """
+        result = self._names.stats()
+        result.update(self.counters)
+        if not self._dbus_obj:
+            defer.returnValue(result)
+
+        bus_names = yield self.bus_names(timeout=timeout)
+        live_names = self._names.live_names()
+        result['leaked'] = len(live_names - bus_names)
+        result['untracked'] = len(bus_names - live_names)
+        defer.returnValue(result)
 
 
 # ----------------------------------------------------------------------------
@@ -0,0 +1,307 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/dbus_names.py
+# ----------------------------------------------------------------------------
+
+"""
+Asyncronous, Twisted based, DBus name lifecycle tracking.
+"""
+
+import collections
+from time import monotonic
+
+from twisted.internet import defer
+from twisted import logger
+
+
+
+_log = logger.Logger(namespace='player.dbus.names')
+
+
+
+class _NameEntry(object):
+
+    """
+    A tracked DBus name: its state and who is waiting on it.
+    """
+
+    def __init__(self, name):
+
+        self.name = name
+        self.state = DBusNameRegistry.EXPECTED
+        self.state_time = monotonic()
+
+        # Deferreds to be fired when the name shows up/goes away.
+        self.start_waiters = []
+        self.stop_waiters = []
+
+        # Twisted IDelayedCall for the start timeout and for the eviction.
+        self.timeout_dc = None
+        self.evict_dc = None
+
+
+
+class DBusNameRegistry(object):
+
+    """
+    Tracks DBus names through explicit states:
+    - EXPECTED: tracked, not yet on the bus.
+    - PRESENT: on the bus.
+    - GONE: gone from the bus, or its owner process ended.
+    - FAILED: did not show up in time, or DBus was disconnected before it did.
+
+    Names that don't show up within a timeout fail, and GONE/FAILED names are
+    evicted after lingering for a while, such that late waiters get answers,
+    keeping the registry bounded regardless of how many names are tracked.
+    """
+
+    EXPECTED = 'expected'
+    PRESENT = 'present'
+    GONE = 'gone'
+    FAILED = 'failed'
+
+    def __init__(self, reactor, settings):
+
+        """
+        Initializes the registry:
+        - `reactor` is the Twisted reactor.
+        - `settings` is a dict with the optional ['player']['dbus_names'] keys:
+          - 'start_timeout': seconds for names to show up, defaults to 10.
+          - 'stop_timeout': seconds waiters wait for names to go away,
+            defaults to 10.
+          - 'linger': seconds GONE/FAILED names are kept, defaults to 5.
+        """
+
+        self._reactor = reactor
+
+        names_settings = settings.get('player', {}).get('dbus_names', {})
+        self._start_timeout = names_settings.get('start_timeout', 10)
+        self._stop_timeout = names_settings.get('stop_timeout', 10)
+        self._linger = names_settings.get('linger', 5)
+
+        # keys/values: DBus names/_NameEntry instances
+        self._entries = {}
+
+        # 'tracked', 'started', 'stopped', 'start-timeouts', 'evicted', ...
+        self.counters = collections.Counter()
+
+
+    def _set_state(self, entry, state):
+
+        # Moves `entry` to `state`, scheduling its eviction if finished.
+
+        _log.debug('name {n!r} {f} -> {t}', n=entry.name, f=entry.state, t=state)
+        entry.state = state
+        entry.state_time = monotonic()
+        if entry.timeout_dc and entry.timeout_dc.active():
+            entry.timeout_dc.cancel()
+        entry.timeout_dc = None
+        if state in (self.GONE, self.FAILED) and not entry.evict_dc:
+            entry.evict_dc = self._reactor.callLater(self._linger, self._evict, entry)
+
+
+    def _evict(self, entry):
+
+        # Forgets about finished `entry`, unless replaced meanwhile.
+
+        if self._entries.get(entry.name) is entry:
+            del self._entries[entry.name]
+            self.counters['evicted'] += 1
+            _log.debug('evicted name {n!r}', n=entry.name)
+
+
+    @staticmethod
+    def _fire(waiters, failure=None):
+
+        # Fires all `waiters`, failing them with `failure`, if set.
+
+        pending = list(waiters)
+        del waiters[:]
+        for d in pending:
+            if d.called:
+                continue
+            if failure is None:
+                d.callback(None)
+            else:
+                d.errback(failure)
+
+
+    def track(self, name):
+        """
+        Starts tracking `name`, expected to show up on the bus.
+        """
+        entry = self._entries.get(name)
+        if entry and entry.state in (self.EXPECTED, self.PRESENT):
+            raise RuntimeError('Name %r already tracked.' % (name,))
+        if entry and entry.evict_dc and entry.evict_dc.active():
+            entry.evict_dc.cancel()
+
+        entry = self._entries[name] = _NameEntry(name)
+        entry.timeout_dc = self._reactor.callLater(
+            self._start_timeout, self._start_timed_out, entry,
+        )
+        self.counters['tracked'] += 1
+        _log.info('tracking dbus name {n!r}', n=name)
+
+
+    def reattach(self, name):
+        """
+        Tracks `name`, known to be on the bus, after a DBus reconnection.
+        """
+        entry = self._entries.get(name)
+        if entry and entry.evict_dc and entry.evict_dc.active():
+            entry.evict_dc.cancel()
+        entry = self._entries[name] = _NameEntry(name)
+        entry.state = self.PRESENT
+        self.counters['reattached'] += 1
+        _log.info('reattached dbus name {n!r}', n=name)
+
+
+    def _start_timed_out(self, entry):
+
+        # Called when `entry` did not show up on the bus in time.
+
+        entry.timeout_dc = None
+        self.counters['start-timeouts'] += 1
+        _log.warn('name {n!r} did not show up in time', n=entry.name)
+        self._set_state(entry, self.FAILED)
+        self._fire(entry.start_waiters, defer.TimeoutError(
+            'name %r did not show up in %ss' % (entry.name, self._start_timeout)
+        ))
+        self._fire(entry.stop_waiters)
+
+
+    def started(self, name):
+        """
+        Tracks that `name` showed up on the bus.
+        """
+        entry = self._entries.get(name)
+        if not entry or entry.state != self.EXPECTED:
+            self.counters['unexpected-starts'] += 1
+            _log.debug('unexpected start of name {n!r}', n=name)
+            return
+        self.counters['started'] += 1
+        self._set_state(entry, self.PRESENT)
+        self._fire(entry.start_waiters)
+
+
+    def stopped(self, name):
+        """
+        Tracks that `name` went away from the bus.
+        """
+        entry = self._entries.get(name)
+        if not entry or entry.state not in (self.EXPECTED, self.PRESENT):
+            self.counters['unexpected-stops'] += 1
+            _log.debug('unexpected stop of name {n!r}', n=name)
+            return
+        self.counters['stopped'] += 1
+        failed = entry.state == self.EXPECTED
+        self._set_state(entry, self.GONE)
+        if failed:
+            self._fire(entry.start_waiters, RuntimeError('name %r gone' % (name,)))
+        self._fire(entry.stop_waiters)
+
+
+    def release(self, name):
+        """
+        Tracks that the process owning `name` ended: it can't be on the bus.
+        """
+        entry = self._entries.get(name)
+        if not entry or entry.state not in (self.EXPECTED, self.PRESENT):
+            return
+        self.counters['released'] += 1
+        _log.debug('released name {n!r}', n=name)
+        failed = entry.state == self.EXPECTED
+        self._set_state(entry, self.GONE if not failed else self.FAILED)
+        if failed:
+            self._fire(entry.start_waiters, RuntimeError('name %r owner ended' % (name,)))
+        self._fire(entry.stop_waiters)
+
+
+    def disconnected(self):
+        """
+        Tracks that DBus was disconnected: all names are assumed gone.
+        """
+        for entry in list(self._entries.values()):
+            if entry.state == self.EXPECTED:
+                self._set_state(entry, self.FAILED)
+                self._fire(entry.start_waiters, RuntimeError('DBus disconnected'))
+            elif entry.state == self.PRESENT:
+                _log.debug('assuming name {n!r} stopped', n=entry.name)
+                self._set_state(entry, self.GONE)
+            self._fire(entry.stop_waiters)
+
+
+    def wait_started(self, name):
+        """
+        Returns a deferred that fires when `name` shows up on the bus, or
+        fails if it doesn't.
+        """
+        entry = self._entries.get(name)
+        if not entry:
+            return defer.fail(RuntimeError('Name %r not tracked.' % (name,)))
+        if entry.state == self.PRESENT:
+            return defer.succeed(None)
+        if entry.state != self.EXPECTED:
+            return defer.fail(RuntimeError('Name %r %s.' % (name, entry.state)))
+        d = defer.Deferred()
+        entry.start_waiters.append(d)
+        return d
+
+
+    def wait_stopped(self, name):
+        """
+        Returns a deferred that fires when `name` is gone from the bus, or
+        fails with a TimeoutError if it's still there after the stop timeout.
+        Untracked names are assumed gone.
+        """
+        entry = self._entries.get(name)
+        if not entry or entry.state not in (self.EXPECTED, self.PRESENT):
+            return defer.succeed(None)
+        d = defer.Deferred()
+        entry.stop_waiters.append(d)
+
+        def _timed_out():
+            if d in entry.stop_waiters:
+                entry.stop_waiters.remove(d)
+                self.counters['stop-timeouts'] += 1
+                d.errback(defer.TimeoutError(
+                    'name %r not gone in %ss' % (name, self._stop_timeout)
+                ))
+
+        def _cancel_timeout(result):
+            if timeout_dc.active():
+                timeout_dc.cancel()
+            return result
+
+        timeout_dc = self._reactor.callLater(self._stop_timeout, _timed_out)
+        d.addBoth(_cancel_timeout)
+        return d
+
+
+    def live_names(self):
+        """
+        Returns the set of EXPECTED or PRESENT names.
+        """
+        return {
+            name for name, entry in self._entries.items()
+            if entry.state in (self.EXPECTED, self.PRESENT)
+        }
+
+
+    def stats(self):
+        """
+        Returns a dict with per state name counts and the counters.
+        """
+        result = dict(self.counters)
+        states = collections.Counter(entry.state for entry in self._entries.values())
+        for state in (self.EXPECTED, self.PRESENT, self.GONE, self.FAILED):
+            result[state] = states[state]
+        result['live'] = states[self.EXPECTED] + states[self.PRESENT]
+        return result
+
+
+# ----------------------------------------------------------------------------
+# player/dbus_names.py
+# ----------------------------------------------------------------------------
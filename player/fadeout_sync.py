@@ -0,0 +1,97 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/fadeout_sync.py
+# ----------------------------------------------------------------------------
+
+"""
+End-of-video fade out synchronisation settings and stats.
+"""
+
+import collections
+
+
+
+class FadeoutSync(object):
+
+    """
+    Shared by all players, which schedule end-of-video fade outs from the
+    video duration and then sample the playback position a few times, at
+    half the remaining time, re-arming the fade out timer if it drifted.
+
+    Tracks the drift corrected on re-arming and how far each fade out
+    started from its scheduled position.
+    """
+
+    def __init__(self, settings):
+
+        """
+        Initializes the tracker:
+        - `settings` is a dict with the optional ['player']['fadeout_sync'] keys:
+          - 'samples': position samples per video play, defaults to 3;
+            0 disables synchronisation.
+          - 'tolerance': drift, in seconds, below which the fade out timer is
+            left alone, defaults to 0.05.
+        """
+
+        sync_settings = settings.get('player', {}).get('fadeout_sync', {})
+        self.samples = sync_settings.get('samples', 3)
+        self.tolerance = sync_settings.get('tolerance', 0.05)
+
+        # Absolute drift/error totals and maximums, in seconds.
+        self._drift_total = 0
+        self._drift_max = 0
+        self._error_total = 0
+        self._error_max = 0
+
+        # 'samples', 'sample-failures', 'rearms', 'fadeouts', ...
+        self.counters = collections.Counter()
+
+
+    def track_sample(self, drift, rearmed):
+        """
+        Tracks a position sample, where the fade out timer was off by `drift`
+        seconds, positive if late, and whether it was re-armed.
+        """
+        self.counters['samples'] += 1
+        if not rearmed:
+            return
+        self.counters['rearms'] += 1
+        self._drift_total += abs(drift)
+        self._drift_max = max(self._drift_max, abs(drift))
+
+
+    def track_sample_failure(self):
+        """
+        Tracks a failed position sample.
+        """
+        self.counters['sample-failures'] += 1
+
+
+    def track_fadeout(self, error):
+        """
+        Tracks a fade out that started `error` seconds past its scheduled
+        position, negative if early.
+        """
+        self.counters['fadeouts'] += 1
+        self._error_total += abs(error)
+        self._error_max = max(self._error_max, abs(error))
+
+
+    def stats(self):
+        """
+        Returns a dict with the counters and absolute drift/error stats.
+        """
+        result = dict(self.counters)
+        rearms = self.counters['rearms']
+        fadeouts = self.counters['fadeouts']
+        result['drift_avg'] = self._drift_total / rearms if rearms else 0
+        result['drift_max'] = self._drift_max
+        result['error_avg'] = self._error_total / fadeouts if fadeouts else 0
+        result['error_max'] = self._error_max
+        return result
+
+
+# ----------------------------------------------------------------------------
+# player/fadeout_sync.py
+# ----------------------------------------------------------------------------
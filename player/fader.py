@@ -0,0 +1,268 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/fader.py
+# ----------------------------------------------------------------------------
+
+"""
+Asyncronous, Twisted based, centrally scheduled alpha fading.
+"""
+
+from time import monotonic
+
+from twisted.internet import defer, task
+from twisted import logger
+
+
+
+_log = logger.Logger(namespace='player.fade')
+
+
+
+class _Fade(object):
+
+    """
+    A single, linear, alpha fade.
+    """
+
+    def __init__(self, duration, from_alpha, to_alpha):
+
+        self.start_time = monotonic()
+        self.duration = duration
+        self.from_alpha = from_alpha
+        self.to_alpha = to_alpha
+
+        # Fires once `to_alpha` is acknowledged.
+        self.deferred = defer.Deferred()
+
+
+    def alpha_at(self, now):
+        """
+        Returns a (rounded alpha, done flag) tuple at `now`.
+        """
+        if not self.duration:
+            return round(self.to_alpha), True
+        progress = (now - self.start_time) / self.duration
+        if progress >= 1:
+            return round(self.to_alpha), True
+        alpha = self.from_alpha + (self.to_alpha - self.from_alpha) * progress
+        return round(alpha), False
+
+
+
+class _FadeTarget(object):
+
+    """
+    Per player alpha setting state.
+    """
+
+    def __init__(self, set_alpha):
+
+        self.set_alpha = set_alpha
+
+        # The active fade, if any.
+        self.fade = None
+
+        # Alpha setting calls in flight, last requested alpha and the
+        # latest alpha waiting for an in flight slot, if any.
+        self.in_flight = 0
+        self.requested_alpha = None
+        self.pending_alpha = None
+
+        # Result of the latest completed alpha setting call, or its failure,
+        # if it failed.
+        self.result = None
+        self.failure = None
+
+        # Deferreds to fire once all requested alphas are acknowledged.
+        self.waiters = []
+
+
+    @property
+    def idle(self):
+        """
+        True if there is nothing in progress.
+        """
+        return (
+            self.fade is None and
+            not self.in_flight and
+            self.pending_alpha is None
+        )
+
+
+
+class FadeScheduler(object):
+
+    """
+    Drives all alpha fades from a single periodic tick.
+
+    Each tick computes every active fade's alpha from a monotonic clock, such
+    that fades take the requested time regardless of DBus latency: with a
+    bounded number of calls in flight per player, steps that don't change the
+    rounded alpha are skipped and, if DBus lags, stale values are superseded
+    by the latest one.
+    """
+
+    def __init__(self, reactor, settings):
+
+        """
+        Initializes the fade scheduler:
+        - `reactor` is the Twisted reactor.
+        - `settings` is a dict with the optional ['player']['fade'] keys:
+          - 'interval': tick interval, in seconds, defaults to 0.019.
+          - 'max_in_flight': alpha calls in flight per player, defaults to 1.
+        """
+
+        fade_settings = settings.get('player', {}).get('fade', {})
+        self._interval = fade_settings.get('interval', 0.019)
+        self._max_in_flight = fade_settings.get('max_in_flight', 1)
+
+        self._loop = task.LoopingCall(self._tick)
+        self._loop.clock = reactor
+
+        # keys/values: fade target keys (players)/_FadeTarget instances
+        self._targets = {}
+
+
+    def fade(self, key, set_alpha, duration, from_alpha, to_alpha):
+
+        """
+        Fades `key`'s alpha from `from_alpha` to `to_alpha` in `duration`
+        seconds, calling `set_alpha` with integer alphas; it should return a
+        deferred that fires once the alpha is set.
+
+        Any in progress fade for the same `key` is superseded.
+
+        Returns a deferred that fires with the last `set_alpha` result once
+        the final alpha is acknowledged; it fails if that call failed.
+        """
+
+        target = self._targets.get(key)
+        if target is None:
+            target = self._targets[key] = _FadeTarget(set_alpha)
+
+        if target.fade:
+            _log.debug('superseding fade on {k!r}', k=key)
+            target.waiters.append(target.fade.deferred)
+
+        fade = _Fade(duration, from_alpha, to_alpha)
+        target.fade = fade
+
+        # Don't wait for the first tick to request the starting alpha.
+        self._step(key, target, monotonic())
+        self._update_loop()
+
+        return fade.deferred
+
+
+    def _update_loop(self):
+
+        # Ticks only while there are active fades.
+
+        active = any(target.fade for target in self._targets.values())
+        if active and not self._loop.running:
+            self._loop.start(self._interval, now=False)
+        elif not active and self._loop.running:
+            self._loop.stop()
+
+
+    def _tick(self):
+
+        # Called periodically by the LoopingCall while fades are active.
+
+        now = monotonic()
+        for key, target in list(self._targets.items()):
+            if target.fade:
+                self._step(key, target, now)
+        self._update_loop()
+
+
+    def _step(self, key, target, now):
+
+        # Requests `target`'s alpha at `now`, completing its fade if done.
+
+        fade = target.fade
+        alpha, done = fade.alpha_at(now)
+        self._request_alpha(key, target, alpha)
+        if done:
+            target.fade = None
+            target.waiters.append(fade.deferred)
+            self._check_idle(key, target)
+
+
+    def _request_alpha(self, key, target, alpha):
+
+        # Sends `alpha` unless it matches the last requested one; if too many
+        # calls are in flight, keeps it as pending, superseding stale values.
+
+        if target.pending_alpha is None and alpha == target.requested_alpha:
+            return
+
+        if target.in_flight >= self._max_in_flight:
+            if target.pending_alpha is not None:
+                _log.debug('{k!r} alpha {a} superseded', k=key, a=target.pending_alpha)
+            target.pending_alpha = alpha
+            return
+
+        target.pending_alpha = None
+        target.requested_alpha = alpha
+        target.in_flight += 1
+        _log.debug('{k!r} alpha {a}', k=key, a=alpha)
+        d = defer.maybeDeferred(target.set_alpha, alpha)
+        d.addCallbacks(
+            self._alpha_set, self._alpha_failed,
+            callbackArgs=(key, target), errbackArgs=(key, target),
+        )
+
+
+    def _alpha_set(self, result, key, target):
+
+        # Called when an alpha setting call completes.
+
+        target.in_flight -= 1
+        target.result = result
+        target.failure = None
+        self._send_pending(key, target)
+
+
+    def _alpha_failed(self, failure, key, target):
+
+        # Called when an alpha setting call fails.
+
+        target.in_flight -= 1
+        target.failure = failure
+        _log.warn('{k!r} setting alpha failed: {f}', k=key, f=failure.value)
+        self._send_pending(key, target)
+
+
+    def _send_pending(self, key, target):
+
+        # Sends the pending alpha, if any, then checks for completion.
+
+        if target.pending_alpha is not None:
+            alpha = target.pending_alpha
+            target.pending_alpha = None
+            self._request_alpha(key, target, alpha)
+        self._check_idle(key, target)
+
+
+    def _check_idle(self, key, target):
+
+        # Once all requested alphas are acknowledged fires the waiters, with
+        # the latest call's failure, if it failed, and forgets about `target`.
+
+        if not target.idle:
+            return
+        waiters, target.waiters = target.waiters, []
+        if self._targets.get(key) is target:
+            del self._targets[key]
+        for d in waiters:
+            if target.failure:
+                d.errback(target.failure)
+            else:
+                d.callback(target.result)
+
+
+# ----------------------------------------------------------------------------
+# player/fader.py
+# ----------------------------------------------------------------------------
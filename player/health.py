@@ -0,0 +1,183 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/health.py
+# ----------------------------------------------------------------------------
+
+"""
+Asyncronous, Twisted based, player health probing.
+"""
+
+import collections
+from time import monotonic
+
+from twisted.internet import task
+from twisted import logger
+from txdbus import error
+
+
+
+_log = logger.Logger(namespace='player.health')
+
+
+
+class HealthProber(object):
+
+    """
+    Periodically probes players, round robin, with cheap DBus property reads,
+    under a probes per second budget, tracking response latencies.
+
+    Players that miss the probe deadline too many times in a row are deemed
+    wedged and reported, such that they can be replaced before being used;
+    other probe failures, like DBus errors, are tracked but aren't misses.
+    """
+
+    def __init__(self, reactor, targets_callable, wedged_callable, settings):
+
+        """
+        Initializes the prober:
+        - `reactor` is the Twisted reactor.
+        - `targets_callable` is called with no arguments and should return
+          a list of players to probe; each should have a `probe(deadline)`
+          method returning a deferred that fails with a txdbus TimeOut if
+          the deadline is missed.
+        - `wedged_callable` is called with a player deemed wedged.
+        - `settings` is a dict with the optional ['player']['health'] keys:
+          - 'rate': probes per second, defaults to 2; 0 disables probing.
+          - 'deadline': probe response deadline, in seconds, defaults to 1.
+          - 'max_misses': consecutive missed probes after which a player is
+            deemed wedged, defaults to 2.
+        """
+
+        self._targets_callable = targets_callable
+        self._wedged_callable = wedged_callable
+
+        health_settings = settings.get('player', {}).get('health', {})
+        self._rate = health_settings.get('rate', 2)
+        self._deadline = health_settings.get('deadline', 1)
+        self._max_misses = health_settings.get('max_misses', 2)
+
+        self._loop = task.LoopingCall(self._probe_next)
+        self._loop.clock = reactor
+
+        # Players yet to be probed in this round.
+        self._round = collections.deque()
+
+        # Players with probes in flight.
+        self._probing = set()
+
+        # keys/values: players/consecutive missed probes
+        self._misses = collections.Counter()
+
+        # Response latency stats, in seconds.
+        self._latency_total = 0
+        self._latency_max = 0
+
+        # 'probes', 'ok', 'missed', 'failed', 'wedged'
+        self.counters = collections.Counter()
+
+
+    def start(self):
+        """
+        Starts probing, unless disabled.
+        """
+        if self._rate > 0:
+            self._loop.start(1 / self._rate, now=False)
+            _log.info('probing at {r} per second', r=self._rate)
+
+
+    def stop(self):
+        """
+        Stops probing.
+        """
+        if self._loop.running:
+            self._loop.stop()
+
+
+    def _probe_next(self):
+
+        # Called by the LoopingCall: probes one player, at most, such that
+        # the probe rate budget is honoured.
+
+        if not self._round:
+            targets = self._targets_callable()
+            self._round.extend(targets)
+            # Forget about players that are gone.
+            for player in list(self._misses):
+                if player not in targets:
+                    del self._misses[player]
+
+        while self._round:
+            player = self._round.popleft()
+            if player not in self._probing:
+                self._probe(player)
+                return
+
+
+    def _probe(self, player):
+
+        # Sends `player` a probe, tracking the outcome.
+
+        self._probing.add(player)
+        self.counters['probes'] += 1
+        d = player.probe(self._deadline)
+        d.addCallbacks(
+            self._probe_answered, self._probe_missed,
+            callbackArgs=(player, monotonic()), errbackArgs=(player,),
+        )
+
+
+    def _probe_answered(self, _result, player, send_time):
+
+        # Called when `player` answered a probe in time.
+
+        self._probing.discard(player)
+        latency = monotonic() - send_time
+        self.counters['ok'] += 1
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+        self._misses.pop(player, None)
+        _log.debug('{p!r} answered in {l:.3f}s', p=player, l=latency)
+
+
+    def _probe_missed(self, failure, player):
+
+        # Called when `player` failed answering a probe: only deadline
+        # misses count towards deeming it wedged.
+
+        self._probing.discard(player)
+        if not failure.check(error.TimeOut):
+            self.counters['failed'] += 1
+            _log.warn('{p!r} probe failed: {f}', p=player, f=failure.value)
+            return
+
+        self.counters['missed'] += 1
+        self._misses[player] += 1
+        misses = self._misses[player]
+        _log.warn('{p!r} missed probe {m}/{mm}: {f}', p=player, m=misses,
+                  mm=self._max_misses, f=failure.value)
+        if misses < self._max_misses:
+            return
+
+        del self._misses[player]
+        self.counters['wedged'] += 1
+        try:
+            self._wedged_callable(player)
+        except Exception as e:
+            _log.error('wedged callable failed: {e!r}', e=e)
+
+
+    def stats(self):
+        """
+        Returns a dict with probe counters and response latency stats.
+        """
+        result = dict(self.counters)
+        answered = self.counters['ok']
+        result['latency_avg'] = self._latency_total / answered if answered else 0
+        result['latency_max'] = self._latency_max
+        return result
+
+
+# ----------------------------------------------------------------------------
+# player/health.py
+# ----------------------------------------------------------------------------
@@ -0,0 +1,318 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/metadata.py
+# ----------------------------------------------------------------------------
+
+"""
+Video file metadata scanning and on-disk caching.
+"""
+
+from concurrent import futures
+import json
+import os
+import struct
+
+from twisted.internet import defer, threads
+from twisted import logger
+
+
+
+_log = logger.Logger(namespace='player.meta')
+
+
+
+# File extensions expected to be ISO base media (MP4 and friends) files.
+_MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.3gp')
+
+# Boxes holding other boxes we care about, within the `moov` box.
+_CONTAINER_BOXES = (b'moov', b'trak', b'mdia', b'minf', b'stbl')
+
+# Handler types, in `hdlr` boxes, and our stream type names.
+_HANDLER_TYPES = {b'vide': 'video', b'soun': 'audio'}
+
+
+
+class ScanError(Exception):
+
+    """
+    Raised when a video file can't be scanned.
+    """
+
+
+
+def _iter_boxes(data, offset=0, end=None):
+
+    # Generates (box type, payload start, payload end) tuples for each
+    # ISO base media box in `data`, from `offset` to `end`.
+
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise ScanError('truncated box header')
+            size, = struct.unpack_from('>Q', data, offset + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise ScanError('bad %r box size' % (box_type,))
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+
+def _read_moov(f, file_size):
+
+    # Returns the `moov` box contents read from the open file `f`, skipping
+    # over the top level boxes that precede it, like (big) `mdat` boxes.
+
+    offset = 0
+    first = True
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, box_type = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', header, 8)
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if first and box_type != b'ftyp':
+            raise ScanError('not an MP4 file')
+        first = False
+        if size < header_size or offset + size > file_size:
+            raise ScanError('bad top level %r box size' % (box_type,))
+        if box_type == b'moov':
+            f.seek(offset)
+            data = f.read(size)
+            return memoryview(data)[header_size:]
+        offset += size
+    raise ScanError('no moov box')
+
+
+
+def _parse_mvhd(data, start):
+
+    # Returns the duration, in seconds, from an `mvhd` box payload.
+
+    version = data[start]
+    if version == 1:
+        timescale, duration = struct.unpack_from('>IQ', data, start + 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', data, start + 12)
+    if not timescale:
+        raise ScanError('zero timescale')
+    return duration / timescale
+
+
+
+def _parse_trak(data, start, end):
+
+    # Returns a stream info dict from a `trak` box payload.
+
+    stream = {'type': None, 'codec': None}
+    pending = [(start, end)]
+    while pending:
+        box_start, box_end = pending.pop()
+        for box_type, payload_start, payload_end in _iter_boxes(data, box_start, box_end):
+            if box_type in _CONTAINER_BOXES:
+                pending.append((payload_start, payload_end))
+            elif box_type == b'tkhd':
+                # Width and height are the last two 16.16 fixed point values.
+                width, height = struct.unpack_from('>II', data, payload_end - 8)
+                stream['width'] = width >> 16
+                stream['height'] = height >> 16
+            elif box_type == b'hdlr':
+                handler_type = bytes(data[payload_start+8:payload_start+12])
+                stream['type'] = _HANDLER_TYPES.get(handler_type)
+            elif box_type == b'stsd':
+                # Version/flags, entry count and first entry size precede the
+                # first entry's format, which identifies the codec.
+                codec = bytes(data[payload_start+12:payload_start+16])
+                stream['codec'] = codec.decode('ascii', 'replace')
+    return stream
+
+
+
+def scan_file(filename):
+
+    """
+    Returns a metadata dict for `filename`, with the keys:
+    - 'duration': in seconds, None if unknown.
+    - 'streams': list of dicts with 'type', 'codec' and, maybe, 'width'
+      and 'height' keys.
+    - 'error': None, or a string describing why the file is unplayable.
+
+    Only MP4 like files are scanned; others get an unknown duration.
+    """
+
+    result = {'duration': None, 'streams': [], 'error': None}
+    if os.path.splitext(filename)[1].lower() not in _MP4_EXTENSIONS:
+        return result
+
+    try:
+        with open(filename, 'rb') as f:
+            moov = _read_moov(f, os.fstat(f.fileno()).st_size)
+        for box_type, payload_start, payload_end in _iter_boxes(moov):
+            if box_type == b'mvhd':
+                result['duration'] = _parse_mvhd(moov, payload_start)
+            elif box_type == b'trak':
+                result['streams'].append(_parse_trak(moov, payload_start, payload_end))
+        if not result['duration']:
+            raise ScanError('no duration')
+        if not any(stream['type'] == 'video' for stream in result['streams']):
+            raise ScanError('no video stream')
+    except (ScanError, OSError, struct.error, IndexError) as e:
+        result['error'] = str(e) or repr(e)
+    return result
+
+
+
+class VideoMetadataIndex(object):
+
+    """
+    Tracks video file metadata, scanning files in parallel worker processes
+    and persisting results to an on-disk JSON cache keyed by file path, with
+    entries invalidated when file sizes or modification times change.
+    """
+
+    def __init__(self, settings):
+
+        """
+        Initializes the index from `settings`, a dict with the optional
+        ['player'] keys:
+        - 'metadata_cache': JSON cache filename; no caching if not set.
+        - 'metadata_workers': worker process count, defaults to CPU count.
+        """
+
+        player_settings = settings.get('player', {})
+        self._cache_filename = player_settings.get('metadata_cache')
+        self._workers = player_settings.get('metadata_workers') or os.cpu_count()
+
+        # keys/values: filenames/dicts with 'size', 'mtime' and 'metadata'
+        self._entries = {}
+
+
+    def _load_cache(self):
+
+        # Loads previously cached entries, if any.
+
+        if not self._cache_filename:
+            return
+        try:
+            with open(self._cache_filename, 'rt') as f:
+                self._entries = json.loads(f.read())
+        except FileNotFoundError:
+            _log.info('no metadata cache at {f!r}', f=self._cache_filename)
+        except (OSError, ValueError) as e:
+            _log.warn('ignored bad metadata cache {f!r}: {e!r}',
+                      f=self._cache_filename, e=e)
+
+
+    def _save_cache(self):
+
+        # Saves current entries, replacing the cache file atomically.
+
+        if not self._cache_filename:
+            return
+        temp_filename = '%s.tmp' % (self._cache_filename,)
+        try:
+            with open(temp_filename, 'wt') as f:
+                f.write(json.dumps(self._entries, indent=1, sort_keys=True))
+            os.replace(temp_filename, self._cache_filename)
+        except OSError as e:
+            _log.warn('failed saving metadata cache {f!r}: {e!r}',
+                      f=self._cache_filename, e=e)
+
+
+    @staticmethod
+    def _stat_key(filename):
+
+        # Returns a (size, mtime) tuple used to validate cached entries.
+
+        stat = os.stat(filename)
+        return stat.st_size, stat.st_mtime_ns
+
+
+    def _scan_files(self, filenames):
+
+        # Scans `filenames` in worker processes, blocking: meant to be called
+        # in a thread; returns a dict of filenames/metadata dicts.
+
+        if len(filenames) == 1:
+            return {filenames[0]: scan_file(filenames[0])}
+        workers = min(self._workers, len(filenames))
+        with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(filenames, executor.map(scan_file, filenames)))
+
+
+    @defer.inlineCallbacks
+    def update(self, filenames):
+        """
+        Ensures metadata is available for all `filenames`, scanning the ones
+        not in the cache or changed since cached, and saving the cache.
+        Returns a deferred that fires when done.
+        """
+        if not self._entries:
+            self._load_cache()
+
+        stale = []
+        stat_keys = {}
+        for filename in filenames:
+            try:
+                stat_keys[filename] = self._stat_key(filename)
+            except OSError as e:
+                _log.warn('cannot stat {f!r}: {e!r}', f=filename, e=e)
+                self._entries[filename] = {
+                    'size': None,
+                    'mtime': None,
+                    'metadata': {'duration': None, 'streams': [], 'error': str(e)},
+                }
+                continue
+            entry = self._entries.get(filename)
+            if not entry or (entry['size'], entry['mtime']) != stat_keys[filename]:
+                stale.append(filename)
+
+        _log.info('{c} files cached, {s} to scan', c=len(stat_keys)-len(stale), s=len(stale))
+        if not stale:
+            return
+
+        results = yield threads.deferToThread(self._scan_files, stale)
+        for filename, metadata in results.items():
+            size, mtime = stat_keys[filename]
+            self._entries[filename] = {'size': size, 'mtime': mtime, 'metadata': metadata}
+            _log.debug('scanned {f!r}: {m!r}', f=filename, m=metadata)
+        self._save_cache()
+
+
+    def metadata(self, filename):
+        """
+        Returns the metadata dict for `filename`, or None if unknown.
+        """
+        entry = self._entries.get(filename)
+        return entry['metadata'] if entry else None
+
+
+    def duration(self, filename):
+        """
+        Returns the duration of `filename`, in seconds, or None if unknown.
+        """
+        metadata = self.metadata(filename)
+        return metadata['duration'] if metadata else None
+
+
+    def error(self, filename):
+        """
+        Returns why `filename` is flagged as unplayable, or None.
+        """
+        metadata = self.metadata(filename)
+        return metadata['error'] if metadata else None
+
+
+# ----------------------------------------------------------------------------
+# player/metadata.py
+# ----------------------------------------------------------------------------
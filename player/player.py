@@ -10,7 +10,7 @@ Asyncronous, Twisted based, omxplayer process wrapper.
 """
 
 import os
-from time import time
+from time import monotonic
 
 from twisted.internet import defer
 from twisted import logger
@@ -18,7 +18,6 @@ from twisted import logger
 from txdbus import error, interface as txdbus_interface
 
 from common import process
-from .misc import sleep
 
 
 
@@ -28,8 +27,16 @@ class OMXPlayer(object):
     Asyncronous, Twisted based, wrapper/proxy for omxplayer processes.
     """
 
+    # Seconds before the end of the video at which the fade out completes;
+    # recycled players need some more, to be paused before the video ends.
+    _END_MARGIN = 0.1
+    _RECYCLE_END_MARGIN = 0.5
+
+    # No point in sampling the position this close to the fade out.
+    _SYNC_MIN_REMAINING = 0.5
+
     def __init__(self, filename, player_mgr, *, layer=0, loop=False, alpha=255,
-                 fadein=0, fadeout=0):
+                 fadein=0, fadeout=0, duration=None, recycle_callable=None):
 
         """
         Initialization arguments:
@@ -40,6 +47,10 @@ class OMXPlayer(object):
         - `alpha`:  used with omxplayer --alpha argument.
         - `fadein`: fade in duration, in seconds.
         - `fadeout`: fade out duration, in seconds.
+        - `duration`: video duration, in seconds; obtained via DBus if None.
+        - `recycle_callable`: if set, the player is paused and rewound instead
+          of ending when the video completes, and then `recycle_callable` is
+          called with it as the single argument.
         """
 
         self._filename = filename
@@ -50,9 +61,10 @@ class OMXPlayer(object):
         self._alpha = alpha
         self._fadein = fadein
         self._fadeout = fadeout
+        self._recycle_callable = recycle_callable
 
-        # Will be obtained by querying the omxplayer process via DBus.
-        self._duration = None
+        # If unknown, will be obtained by querying the omxplayer process via DBus.
+        self._duration = duration
 
         # Use a known name so that we can track omxplayer's DBus presence.
         self._dbus_player_name = self.generate_player_name(filename)
@@ -67,12 +79,31 @@ class OMXPlayer(object):
         # DBus proxy object for the player: used to control it.
         self._dbus_player = None
 
+        # Spawn phase name/duration tuples, in seconds, filled in by `spawn`.
+        self.spawn_timings = []
+        self._phase_start_time = None
+
         # Lifecycle tracking.
         self._ready = defer.Deferred()
         self._stop_in_progress = False
         self._fadeout_dc = None
         self._fading_out = False
 
+        # End-of-video fade out synchronisation state: the video position at
+        # which it is due, the next position sampling IDelayedCall, samples
+        # left and a generation number, bumped on each (re-)scheduling.
+        self._fadeout_position = None
+        self._sync_dc = None
+        self._syncs_left = 0
+        self._fadeout_generation = 0
+        self._rewinding = False
+
+        # omxplayer starts playing; tracked to pause it before rewinding.
+        self._playing = True
+
+        # How many times `play` was called.
+        self.uses = 0
+
 
     def __repr__(self):
 
@@ -82,16 +113,56 @@ class OMXPlayer(object):
         )
 
 
+    @property
+    def filename(self):
+        """
+        The movie filename.
+        """
+        return self._filename
+
+
+    @property
+    def duration(self):
+        """
+        The movie duration, in seconds, None if unknown.
+        """
+        return self._duration
+
+
+    @property
+    def layer(self):
+        """
+        The visual layer the movie is displayed on.
+        """
+        return self._layer
+
+
+    @property
+    def dbus_name(self):
+        """
+        The spawned omxplayer's DBus name.
+        """
+        return self._dbus_player_name
+
+
+    # All player names are in this DBus name namespace.
+    DBUS_NAMESPACE = 'c.p'
+
     _player_id = 0
 
     @staticmethod
     def generate_player_name(filename):
         """
-        Generate unique player name.
+        Generate unique player name, in the DBUS_NAMESPACE namespace.
         """
         OMXPlayer._player_id = (OMXPlayer._player_id + 1) % 1000
-        return 'c.p%s-%03i' % (
-            os.path.splitext(os.path.basename(filename))[0],
+        basename = os.path.splitext(os.path.basename(filename))[0]
+        if basename[:1].isdigit():
+            # DBus name elements can't start with a digit.
+            basename = '_' + basename
+        return '%s.%s-%03i' % (
+            OMXPlayer.DBUS_NAMESPACE,
+            basename,
             OMXPlayer._player_id,
         )
 
@@ -129,7 +200,8 @@ class OMXPlayer(object):
 
         The optional `end_callable` will be called when the spawned omxplayer
         process terminates, and passed in a single argument with the omxplayer's
-        exit code.
+        exit code. If spawning fails, the process is terminated, without
+        calling it.
         """
 
         player_name = self._dbus_player_name
@@ -138,30 +210,58 @@ class OMXPlayer(object):
         # Ask DBus manager to track this player's name bus presence.
         self._dbus_mgr.track_dbus_name(player_name)
 
+        self._phase_start_time = monotonic()
         self._spawn_process()
 
-        # Wait for process started confirmation.
-        yield self._process_protocol.started
-
-        # Wait until the player name shows up on DBus.
-        yield self._dbus_mgr.wait_dbus_name_start(player_name)
+        try:
+            # Getting the DBus object involves no bus round trip, given that
+            # the interfaces are explicitly declared: get it while the process
+            # starts.
+            yield self._get_dbus_player_object()
+
+            # Wait for process started confirmation.
+            yield self._process_protocol.started
+            self._track_spawn_phase('process')
+
+            # Wait until the player name shows up on DBus.
+            yield self._dbus_mgr.wait_dbus_name_start(player_name)
+            self._track_spawn_phase('dbus-name')
+
+            # Since omxplayer defaults to starting in play mode, ask it to
+            # play/pause straight away; we promised to have it paused when
+            # done. Asking for the duration, if unknown, is independent: both
+            # requests are sent out together, sharing the same DBus round
+            # trip.
+            requests = [self._request_play_pause()]
+            if self._duration is None:
+                requests.append(self._determine_duration())
+            try:
+                yield defer.gatherResults(requests, consumeErrors=True)
+            except defer.FirstError as e:
+                e.subFailure.raiseException()
+            self._track_spawn_phase('pause' if len(requests) == 1 else 'pause-duration')
+        except Exception as e:
+            # Don't leave an uncontrolled process behind.
+            self._log.warn('spawning failed: {e!r}', e=e)
+            yield self._stop_via_sigterm(kill_after=1)
+            raise
 
         # Setup the optional notification of process termination.
         if end_callable:
             self._process_protocol.stopped.addCallback(end_callable)
 
-        yield self._get_dbus_player_object()
-
-        yield self._determine_duration()
-
         # Player is now ready to be controlled.
         self._log.info('ready')
         self._ready.callback(None)
 
-        # Since omxplayer defaults to starting in play mode, ask it to
-        # play/pause straight away; we promised to have it paused when
-        # done.
-        yield self.play_pause()
+
+    def _track_spawn_phase(self, phase):
+
+        # Appends the time taken by the just completed spawn `phase`.
+
+        now = monotonic()
+        self.spawn_timings.append((phase, now - self._phase_start_time))
+        self._phase_start_time = now
 
 
     def _spawn_process(self):
@@ -184,6 +284,27 @@ class OMXPlayer(object):
             'player.proc.%s' % (self._dbus_player_name,),
         )
 
+        # Once the process ends, its name can't be on DBus.
+        self._process_protocol.wait_stopped().addCallback(
+            lambda _: self._dbus_mgr.release_dbus_name(self._dbus_player_name)
+        )
+
+
+    @defer.inlineCallbacks
+    def reattach(self):
+
+        """
+        Resumes control over the spawned omxplayer after a DBus reconnection,
+        given that its name is on the bus. Returns a deferred that fires when
+        done.
+        """
+
+        self._log.info('reattaching')
+        self._dbus_conn = self._dbus_mgr.dbus_conn
+        self._dbus_mgr.reattach_dbus_name(self._dbus_player_name)
+        yield self._get_dbus_player_object()
+        self._log.info('reattached')
+
 
     @defer.inlineCallbacks
     def _get_dbus_player_object(self):
@@ -205,13 +326,34 @@ class OMXPlayer(object):
         self._log.debug('got dbus object')
 
 
+    def probe(self, deadline):
+
+        """
+        Reads the spawned omxplayer's Position, as a health check: unlike
+        PlaybackStatus, a string, it matches the declared `Get` signature.
+
+        Returns a deferred that fires with the position, in microseconds, or
+        fails with a txdbus TimeOut if no answer comes within `deadline`
+        seconds.
+        """
+
+        return self._dbus_mgr.call_remote(
+            self._dbus_player,
+            'Get', 'org.mpris.MediaPlayer2.Player', 'Position',
+            priority='property',
+            deadline=deadline,
+        )
+
+
     @defer.inlineCallbacks
     def _determine_duration(self):
 
         # Ask omxplayer for the duration of the video file.
 
-        duration_microsecs = yield self._dbus_player.callRemote(
+        duration_microsecs = yield self._dbus_mgr.call_remote(
+            self._dbus_player,
             'Get', 'org.mpris.MediaPlayer2.Player', 'Duration',
+            priority='property',
         )
         self._duration = duration_microsecs / 1000000
         self._log.debug('duration is {d:.1f}s', d=self._duration)
@@ -235,7 +377,7 @@ class OMXPlayer(object):
 
 
     @defer.inlineCallbacks
-    def stop(self, skip_dbus=False, timeout=1):
+    def stop(self, skip_dbus=False, timeout=1, kill_after=1):
 
         """
         Stops the spawned omxplayer process.
@@ -244,8 +386,9 @@ class OMXPlayer(object):
         waiting for it to cleanly stop.
         In that case, returns a deferred that fires with the exit code.
 
-        If that fails, tries to send a SIGTERM signal to the process.
-        If it works, waits for the process to cleanly stop.
+        If that fails, tries to send a SIGTERM signal to the process,
+        escalating to a SIGKILL if it does not stop within `kill_after`
+        seconds. Either way, waits for the process to stop.
 
         In the non DBus controlled clean stop, returns a deferred that fires
         with None, when completed.
@@ -260,7 +403,7 @@ class OMXPlayer(object):
         if self._process_protocol.stopped.called:
             # Prevent race condition: do nothing if process is gone.
             self._log.info('no process to stop', p=player_name)
-            exit_code = yield self._process_protocol.stopped
+            exit_code = yield self._process_protocol.wait_stopped()
             defer.returnValue(exit_code)
             return
 
@@ -279,7 +422,7 @@ class OMXPlayer(object):
                 self._log.warn('stopping failed: {e!r}', e=e)
 
         if stop_via_sigterm:
-            yield self._stop_via_sigterm()
+            yield self._stop_via_sigterm(kill_after)
 
         self._log.info('stopped')
 
@@ -303,10 +446,12 @@ class OMXPlayer(object):
             try:
                 # Prevent race condition with timeout: process might have
                 # terminated or DBus may have become unreachable.
-                yield self._dbus_player.callRemote(
+                yield self._dbus_mgr.call_remote(
+                    self._dbus_player,
                     'Stop',
                     interface='org.mpris.MediaPlayer2.Player',
-                    timeout=timeout,
+                    priority='transport',
+                    deadline=timeout,
                 )
             except error.TimeOut:
                 self._log.info('stop request timed out')
@@ -324,25 +469,45 @@ class OMXPlayer(object):
             yield self._dbus_mgr.wait_dbus_name_stop(player_name)
 
         # Finally, wait for the actual process to end and get exit code.
-        exit_code = yield self._process_protocol.stopped
+        exit_code = yield self._process_protocol.wait_stopped()
         defer.returnValue(exit_code)
 
 
     @defer.inlineCallbacks
-    def _stop_via_sigterm(self):
+    def _stop_via_sigterm(self, kill_after):
 
-        # Sends a SIGTERM to the spawned process and waits for it to exit.
+        # Sends a SIGTERM to the spawned process, escalating to a SIGKILL
+        # after `kill_after` seconds, and waits for it to exit.
 
         self._log.debug('signalling process termination')
         try:
-            self._process_protocol.terminate()
+            yield self._process_protocol.terminate_or_kill(kill_after)
         except OSError as e:
             self._log.warn('signalling process failed: {e!r}', e=e)
+            # Wait for the process to end, anyhow.
+            yield self._process_protocol.wait_stopped()
         else:
-            self._log.debug('signalled process termination')
+            self._log.debug('process terminated')
+
+
+    def kill(self):
+
+        """
+        Immediately kills the spawned omxplayer process with a SIGKILL.
+
+        Returns a deferred that fires with the exit code, when it exits.
+        """
+
+        self._cancel_scheduled_fadeout()
+        if not self._process_protocol:
+            return defer.succeed(None)
 
-        # Finally, wait for the process to end, discarding the exit code.
-        yield self._process_protocol.stopped
+        self._log.warn('killing')
+        try:
+            self._process_protocol.kill()
+        except OSError as e:
+            self._log.warn('killing failed: {e!r}', e=e)
+        return self._process_protocol.wait_stopped()
 
 
     @defer.inlineCallbacks
@@ -354,13 +519,22 @@ class OMXPlayer(object):
         """
 
         yield self._wait_ready('play/pause')
+        yield self._request_play_pause()
+
+
+    @defer.inlineCallbacks
+    def _request_play_pause(self):
 
         # Based on https://github.com/popcornmix/omxplayer
+
         self._log.debug('requesting play/pause')
-        yield self._dbus_player.callRemote(
+        yield self._dbus_mgr.call_remote(
+            self._dbus_player,
             'PlayPause',
-            interface='org.mpris.MediaPlayer2.Player'
+            interface='org.mpris.MediaPlayer2.Player',
+            priority='transport',
         )
+        self._playing = not self._playing
         self._log.debug('requested play/pause')
 
 
@@ -377,6 +551,7 @@ class OMXPlayer(object):
         Returns a deferred that fires when the video as faded in completely.
         """
 
+        self.uses += 1
         yield self.play_pause()
 
         if not self._loop:
@@ -385,6 +560,43 @@ class OMXPlayer(object):
         yield self.fadein(immediate=skip_fadein)
 
 
+    @defer.inlineCallbacks
+    def restart(self):
+
+        """
+        Asks the spawned omxplayer to seek back to the start of the video,
+        re-scheduling the end-of-video fade out, if not looping.
+        Does nothing if a fade out is in progress.
+        Returns a deferred that fires once the seek is acknowledged.
+        """
+
+        yield self._wait_ready('restart')
+
+        if self._fading_out:
+            self._log.info('not restarting: fade out in progress')
+            return
+
+        self._log.info('restarting')
+        yield self._set_position(0)
+
+        if not self._loop:
+            self._schedule_fadeout()
+
+
+    @defer.inlineCallbacks
+    def _set_position(self, microsecs):
+
+        # Asks the spawned omxplayer to seek to `microsecs`.
+
+        result = yield self._dbus_mgr.call_remote(
+            self._dbus_player,
+            'SetPosition', '/not/used', microsecs,
+            interface='org.mpris.MediaPlayer2.Player',
+            priority='transport',
+        )
+        defer.returnValue(result)
+
+
     def _schedule_fadeout(self):
 
         """
@@ -394,23 +606,133 @@ class OMXPlayer(object):
 
         self._cancel_scheduled_fadeout()
 
-        delta_t = self._duration - self._fadeout - 0.1
-        self._fadeout_dc = self._reactor.callLater(delta_t, self.fadeout)
+        if self._recycle_callable:
+            end_margin, end_action = self._RECYCLE_END_MARGIN, self.fadeout_and_rewind
+        else:
+            end_margin, end_action = self._END_MARGIN, self.fadeout
+        delta_t = self._duration - self._fadeout - end_margin
+        self._fadeout_position = delta_t
+        self._fadeout_generation += 1
+        self._fadeout_dc = self._reactor.callLater(delta_t, self._fadeout_due, end_action)
 
         self._log.debug('will fade out in {d:.1f} seconds', d=delta_t)
 
+        # Playback may start late or drift: keep the timer in sync with it.
+        self._syncs_left = self._player_mgr.fadeout_sync.samples
+        self._schedule_fadeout_sync(delta_t)
+
+
+    def _schedule_fadeout_sync(self, remaining):
+
+        # Schedules the next position sample halfway to the fade out, due in
+        # `remaining` seconds, such that samples get denser near it.
+
+        if self._syncs_left <= 0 or remaining < self._SYNC_MIN_REMAINING:
+            return
+        self._syncs_left -= 1
+        self._sync_dc = self._reactor.callLater(
+            remaining / 2, self._sync_fadeout, self._fadeout_generation,
+        )
+
+
+    @defer.inlineCallbacks
+    def _sync_fadeout(self, generation):
+
+        # Samples the playback position and re-arms the fade out timer if
+        # it drifted more than the tolerance.
+
+        self._sync_dc = None
+        sync = self._player_mgr.fadeout_sync
+        try:
+            position = yield self._get_position()
+        except Exception as e:
+            sync.track_sample_failure()
+            self._log.warn('position sampling failed: {e!r}', e=e)
+            return
+
+        fadeout_dc = self._fadeout_dc
+        if generation != self._fadeout_generation or not fadeout_dc or not fadeout_dc.active():
+            # Fade out re-scheduled, cancelled or started meanwhile.
+            return
+
+        remaining = self._fadeout_position - position
+        drift = (fadeout_dc.getTime() - self._reactor.seconds()) - remaining
+        rearm = abs(drift) > sync.tolerance
+        if rearm:
+            fadeout_dc.reset(max(0, remaining))
+            self._log.debug('re-armed fade out in {r:.2f}s, drift {d:+.3f}s', r=remaining, d=drift)
+        sync.track_sample(drift, rearm)
+        self._schedule_fadeout_sync(remaining)
+
+
+    @defer.inlineCallbacks
+    def _get_position(self):
+
+        # Asks omxplayer for the playback position, returning a deferred that
+        # fires with it, in seconds, compensated for half the round trip.
+
+        send_time = monotonic()
+        position_microsecs = yield self._dbus_mgr.call_remote(
+            self._dbus_player,
+            'Get', 'org.mpris.MediaPlayer2.Player', 'Position',
+            priority='property',
+        )
+        position = position_microsecs / 1000000 + (monotonic() - send_time) / 2
+        defer.returnValue(position)
+
+
+    def _fadeout_due(self, end_action):
+
+        # Called when the end-of-video fade out is due: triggers it via
+        # `end_action` and reports how far from the scheduled position it was.
+
+        self._fadeout_dc = None
+        d = self._get_position()
+        d.addCallbacks(
+            self._report_fadeout_error, self._report_fadeout_error_failed,
+            callbackArgs=(self._fadeout_position,),
+        )
+        d = end_action()
+        d.addErrback(self._fadeout_failed)
+
+
+    def _report_fadeout_error(self, position, scheduled_position):
+
+        # Tracks the end-of-video fade out position error.
+
+        error = position - scheduled_position
+        self._player_mgr.fadeout_sync.track_fadeout(error)
+        self._log.info('fade out started {e:+.3f}s off schedule', e=error)
+
+
+    def _report_fadeout_error_failed(self, failure):
+
+        # Tracks that the end-of-video fade out position could not be read.
+
+        self._player_mgr.fadeout_sync.track_sample_failure()
+        self._log.warn('fade out position unknown: {f}', f=failure.value)
+
+
+    def _fadeout_failed(self, failure):
+
+        # Called when the end-of-video fade out fails: the video still ends.
+
+        self._log.warn('fade out failed: {f}', f=failure.value)
+
 
     def _cancel_scheduled_fadeout(self):
 
         """
-        Cancel any eventually scheduled fadeout.
+        Cancel any eventually scheduled fadeout and position sampling.
         """
 
-        if self._fadeout_dc:
-            try:
-                self._fadeout_dc.cancel()
-            except Exception:
-                pass
+        for dc in (self._fadeout_dc, self._sync_dc):
+            if dc:
+                try:
+                    dc.cancel()
+                except Exception:
+                    pass
+        self._sync_dc = None
 
 
     @defer.inlineCallbacks
@@ -421,38 +743,28 @@ class OMXPlayer(object):
         Returns a deferred that fires once the command is acknowledged.
         """
 
-        result = yield self._dbus_player.callRemote(
+        # Queued alpha changes are superseded by newer ones: no point in
+        # sending stale values.
+        result = yield self._dbus_mgr.call_remote(
+            self._dbus_player,
             'SetAlpha', '/not/used', int64,
-            interface='org.mpris.MediaPlayer2.Player'
+            interface='org.mpris.MediaPlayer2.Player',
+            priority='alpha',
+            supersede_key=(self._dbus_player_name, 'alpha'),
         )
         defer.returnValue(result)
 
 
-    @defer.inlineCallbacks
     def _fade(self, duration, from_alpha, to_alpha):
 
-        # Issues timed calls to `_set_alpha` to ensure that the spawned
-        # omxplayer's alpha is faded between the passed in alpha values:
+        # Asks the player manager's fade scheduler to fade the spawned
+        # omxplayer's alpha between the passed in alpha values:
         # - `duration` represents time in seconds.
+        # Returns a deferred that fires when the final alpha is set.
 
-        # Notes:
-        # - Assumes 25fps video.
-        # - Uses delay < 20ms which is 2x framerate.
-
-        if duration:
-            delay = 0.019
-            start_time = time()
-            delta_alpha = to_alpha - from_alpha
-            relative_time = 0
-            while relative_time < 1:
-                alpha = from_alpha + delta_alpha * relative_time
-                self._log.debug('alpha {s}', s=alpha)
-                yield self._set_alpha(round(alpha))
-                yield sleep(delay, self._reactor)
-                relative_time = (time() - start_time) / duration
-
-        result = yield self._set_alpha(round(to_alpha))
-        defer.returnValue(result)
+        return self._player_mgr.fader.fade(
+            self, self._set_alpha, duration, from_alpha, to_alpha,
+        )
 
 
     @defer.inlineCallbacks
@@ -488,22 +800,78 @@ class OMXPlayer(object):
         self._cancel_scheduled_fadeout()
 
         self._fading_out = True
-        result = yield self._fade(self._fadeout, 255, 0)
-        self._fading_out = False
+        try:
+            result = yield self._fade(self._fadeout, 255, 0)
+        finally:
+            self._fading_out = False
 
         self._log.info('fade out completed')
         defer.returnValue(result)
 
 
     @defer.inlineCallbacks
-    def fadeout_and_stop(self):
+    def fadeout_and_stop(self, skip_dbus=False, timeout=1, kill_after=1):
+
+        """
+        Stops after a fade out, skipped if `skip_dbus` is True: see `stop`.
+        """
+
+        if not skip_dbus:
+            try:
+                yield self.fadeout()
+            except Exception as e:
+                self._log.warn('fading out failed: {e!r}', e=e)
+        yield self.stop(skip_dbus, timeout, kill_after)
+
+
+    @defer.inlineCallbacks
+    def rewind(self):
+
+        """
+        Immediately hides, pauses and seeks the spawned omxplayer back to the
+        start of the video, such that it can `play` again, then calls the
+        `recycle_callable`; stops the player if that fails.
+        Returns a deferred that fires when done.
+        """
+
+        yield self._wait_ready('rewind')
+
+        if self._rewinding:
+            self._log.info('rewind in progress')
+            return
+
+        self._log.info('rewinding')
+        self._rewinding = True
+        self._cancel_scheduled_fadeout()
+        try:
+            yield self._fade(0, 0, 0)
+            if self._playing:
+                yield self._request_play_pause()
+            yield self._set_position(0)
+        except Exception as e:
+            self._log.warn('rewinding failed: {e!r}', e=e)
+            self._rewinding = False
+            yield self.stop()
+            return
+        self._rewinding = False
+        self._log.info('rewound')
+
+        if self._recycle_callable:
+            self._recycle_callable(self)
+
+
+    @defer.inlineCallbacks
+    def fadeout_and_rewind(self):
 
         """
-        Stops after a fade out.
+        Rewinds after a fade out, even if it fails: see `rewind`.
         """
 
-        yield self.fadeout()
-        yield self.stop()
+        try:
+            yield self.fadeout()
+        except Exception as e:
+            self._log.warn('fading out failed: {e!r}', e=e)
+        yield self.rewind()
 
 
 # ----------------------------------------------------------------------------
@@ -10,13 +10,23 @@ Asyncronous, Twisted based, video playing interface.
 
 import collections
 import os
-import random
+from time import monotonic
 
 from twisted.internet import defer
 from twisted import logger
 
+from .arbiter import TriggerArbiter
+from .base_loop import BaseLoop
+from .catalog import VideoCatalog
 from .dbus_manager import DBusManager
+from .fader import FadeScheduler
+from .fadeout_sync import FadeoutSync
+from .health import HealthProber
+from .metadata import VideoMetadataIndex
 from .player import OMXPlayer
+from .pool import PoolManager, SpawnSlots
+from .prefetch import ClipPrefetcher
+from .shutdown import ShutdownCoordinator
 
 
 
@@ -32,26 +42,50 @@ class PlayerManager(object):
 
     # General lifecycle
     # -----------------
-    # - Initialization finds available video files from the settings.
+    # - Initialization finds available video files from the settings; level
+    #   folders are then watched for changes, if so configured.
     # - Starting:
-    #   - Spawns one OMXPlayer per level (which start in paused mode).
-    #   - Unpause level 0 player.
+    #   - Spawns the level 0 OMXPlayer and unpauses it, accepting level
+    #     triggering calls from then on.
+    #   - Spawns one OMXPlayer per level (which start in paused mode), up to
+    #     `spawn_concurrency` at a time, lower levels first; each level is
+    #     ready, accepting triggers, once it has one.
+    #   - Fills the pools in the background, after any urgent spawns.
     # - Level triggering calls (from the outside):
+    #   - Arbitrated: rate limited per source and coalesced.
     #   - Unpause level X player.
     #   - Track player completion / process exit.
     #   - Respawn a new level X player.
+    #   - Or, if recycling, rewind and pause it, putting it back in the pool.
 
     def __init__(self, reactor, wiring, settings):
         """
         Initializes the player manager:
         - `reactor` is the Twisted reactor.
-        - `wiring` is used to register `change_play_level` handling.
+        - `wiring` is used to register `change_play_level` and
+          `request_level_readiness` handling, and to publish level readiness
+          changes via `notify_level_readiness`.
         - `settings` is a dict with:
            - ['environment']['ld_library_path']
            - ['environment']['omxplayer_bin']
-           - ['levels'][*]['folder']
+           - ['levels'][*]['folder'], where '0' is the base level
            - ['levels'][*]['fadein']
            - ['levels'][*]['fadeout']
+           - ['levels'][*]['pool_size'|'priority'|'decoder_mb'], optional,
+             see PoolManager
+           - ['player']['spawn_concurrency'], optional, defaults to 1
+           - ['player']['pool'], optional, see PoolManager
+           - ['player']['budget'], optional, see PoolManager
+           - ['player']['fade'], optional, see FadeScheduler
+           - ['player']['metadata_*'], optional, see VideoMetadataIndex
+           - ['player']['watch_folders'], optional, see VideoCatalog
+           - ['player']['prefetch*'], optional, see ClipPrefetcher
+           - ['player']['arbiter'], optional, see TriggerArbiter
+           - ['player']['health'], optional, see HealthProber
+           - ['player']['dbus_recovery'], optional, defaults to True
+           - ['player']['base_loop'], optional, see BaseLoop
+           - ['player']['recycle'], optional, defaults to False
+           - ['player']['recycle_uses'], optional, defaults to 0 (unlimited)
         """
         self._wiring = wiring
         self._settings = settings
@@ -59,21 +93,88 @@ class PlayerManager(object):
         # part of our public interface, OMXPlayer will use this
         self.reactor = reactor
         self.dbus_mgr = DBusManager(reactor, settings)
+        self.fader = FadeScheduler(reactor, settings)
+        self.fadeout_sync = FadeoutSync(settings)
 
-        # keys/values: integer levels/queue of video files
-        self._files = {}
+        # Video file durations and playability, scanned at start time.
+        self._metadata = VideoMetadataIndex(settings)
+
+        # Available video files per level, following level folder changes.
+        self._catalog = VideoCatalog(reactor, self._metadata, settings)
+        self._catalog.file_added_callable = self._file_added
+        self._catalog.file_removed_callable = self._file_removed
+
+        # Warms the page cache with files chosen for players, ahead of play.
+        self._prefetcher = ClipPrefetcher(settings)
+
+        # Coalesces and rate limits `change_play_level` calls.
+        self._arbiter = TriggerArbiter(reactor, self._change_play_level, settings)
+
+        # Detects wedged players, such that they can be replaced.
+        self._prober = HealthProber(
+            reactor, self._probe_targets, self._player_wedged, settings,
+        )
 
         # keys/values: integer levels/list of OMXPlayer instances
         self._players = collections.defaultdict(collections.deque)
 
-        self._base_player = None
+        # Players whose files were removed, to be retired when next used.
+        self._stale_players = set()
+
+        # keys/values: integer levels/count of players being spawned
+        self._players_spawning = collections.Counter()
+
+        # keys/values: integer levels/count of player processes being spawned
+        # or running, including the ones playing or stopping
+        self._players_alive = collections.Counter()
+
+        # Decides per level pool sizes and what to do when pools run empty.
+        self._pool_mgr = PoolManager(settings)
+
+        # Limits how many players are spawned at the same time: level 0 and
+        # each level's first warm player go first, then the pool fill.
+        player_settings = settings.get('player', {})
+        spawn_concurrency = player_settings.get('spawn_concurrency', 1)
+        self._spawn_slots = SpawnSlots(spawn_concurrency)
+
+        # keys/values: integer levels/readiness, one of:
+        # - 'starting': no warm player yet, triggers are ignored.
+        # - 'ready': has warm players.
+        # - 'empty': was ready, has no warm players right now.
+        self._readiness = {level: 'starting' for level in [0] + self._pool_mgr.levels}
+
+        # Levels with an urgent player spawn in progress.
+        self._levels_warming = set()
+        self._wiring.request_level_readiness.wire(self._notify_level_readiness)
+
+        # If recycling, level players are rewound and put back in their pool
+        # when done, instead of ending; after `recycle_uses` plays, if not 0,
+        # they end such that a player for a different file is spawned.
+        self._recycle = player_settings.get('recycle', False)
+        self._recycle_uses = player_settings.get('recycle_uses', 0)
+
+        # keys/values: integer levels/set of players out of the pool that
+        # will be put back in, when recycling
+        self._players_out = collections.defaultdict(set)
+
+        # Keeps level 0 playing, gaplessly.
+        self._base_loop = BaseLoop(
+            reactor,
+            lambda filename=None, **kwargs: self._create_player(0, filename, **kwargs),
+            lambda: self._get_file_for_level(0),
+            settings,
+        )
         self._current_player = None     # if not level 0
         self._current_level = None
 
         self._update_ld_lib_path()
-        self._find_files()
+        self._catalog.load()
 
         self._stopping = False
+
+        # Recovering from a DBus connection loss, if so configured.
+        self._dbus_recovery = player_settings.get('dbus_recovery', True)
+        self._recovering = False
         self.done = defer.Deferred()
 
 
@@ -94,25 +195,35 @@ class PlayerManager(object):
             _log.debug('LD_LIBRARY_PATH set to {v!r}', v=new_ld_lib_path)
 
 
-    def _find_files(self):
+    def _get_file_for_level(self, level):
+
+        # Return a random filename from the available files in `level`,
+        # getting it warmed in the page cache before it is played.
 
-        # Populate self._files by finding available files under each
-        # level's configured folder in the settings dict.
+        filename = self._catalog.random_file(level)
+        self._prefetcher.warm(filename)
+        return filename
 
-        for level, level_info in self._settings['levels'].items():
-            level_folder = level_info['folder']
-            self._files[int(level)] = [
-                os.path.join(level_folder, name)
-                for name in os.listdir(level_folder)
-            ]
-        _log.debug('files found: {d!r}', d=self._files)
 
+    def _file_added(self, level, name):
+
+        # Called by the catalog when `name` becomes available: a level left
+        # with no files may now get its pool filled.
+
+        if not self._stopping and not self._recovering:
+            self._refill_pools()
 
-    def _get_file_for_level(self, level):
 
-        # Return a random filename from the available files in `level`.
+    def _file_removed(self, level, name):
 
-        return random.sample(self._files[level], 1)[0]
+        # Called by the catalog when `name` is no longer available: players
+        # using it become stale, to be retired when next used.
+
+        players = list(self._players[level]) + list(self._players_out[level])
+        for player in players:
+            if player.filename == name:
+                _log.info('player {p!r} is stale', p=player)
+                self._stale_players.add(player)
 
 
     @property
@@ -130,104 +241,475 @@ class PlayerManager(object):
         """
         _log.info('starting')
 
-        yield self.dbus_mgr.connect_to_dbus(disconnect_callable=self._dbus_disconnected)
+        yield self._catalog.index()
+        self._catalog.start_watching()
+
+        yield self.dbus_mgr.connect_to_dbus(
+            disconnect_callable=self._dbus_disconnected,
+            name_namespace=OMXPlayer.DBUS_NAMESPACE,
+        )
+
+        start_time = monotonic()
 
-        self._base_player = yield self._create_player(level=0)
-        yield self._base_player.play()
+        # Request the level 0 player first such that it is spawned ahead of
+        # the others; then get it playing while the others are spawned.
+        base_loop_deferred = self._base_loop.start()
+        players_deferred = self._create_players()
+
+        yield base_loop_deferred
         self._current_level = 0
+        self._set_readiness(0, 'ready')
+        _log.info('base loop playing after {e:.2f}s', e=monotonic() - start_time)
 
-        yield self._create_players()
+        # Ready to respond to change level requests: levels not yet ready
+        # ignore them.
+        self._wiring.change_play_level.wire(self._request_play_level)
+        self._prober.start()
 
-        # Ready to respond to change level requests.
-        self._wiring.change_play_level.wire(self._change_play_level)
+        yield players_deferred
+        self._log_startup_report(monotonic() - start_time)
 
         _log.info('started')
 
 
+    def _set_readiness(self, level, readiness):
+
+        # Tracks `level` readiness, publishing changes.
+
+        if self._readiness.get(level) == readiness:
+            return
+        self._readiness[level] = readiness
+        _log.info('level={l!r} {r}', l=level, r=readiness)
+        self._wiring.notify_level_readiness(level, readiness)
+
+
+    def _update_readiness(self, level):
+
+        # Updates non-zero `level` readiness from its pool of warm players.
+
+        if self._players[level]:
+            self._set_readiness(level, 'ready')
+        elif self._readiness[level] != 'starting':
+            self._set_readiness(level, 'empty')
+
+
+    def _notify_level_readiness(self):
+
+        # Called via `request_level_readiness`: publishes all levels' readiness.
+
+        for level, readiness in sorted(self._readiness.items()):
+            self._wiring.notify_level_readiness(level, readiness)
+
+
+    def _log_startup_report(self, elapsed):
+
+        # Logs per player, per phase, spawn timings.
+
+        players = [(0, self._base_loop.active)]
+        for level, level_players in sorted(self._players.items()):
+            players.extend((level, player) for player in level_players)
+
+        for level, player in players:
+            timings = ' '.join(
+                '%s=%.2fs' % (phase, seconds)
+                for phase, seconds in player.spawn_timings
+            )
+            total = sum(seconds for _, seconds in player.spawn_timings)
+            _log.info('startup level={l!r} {p!r}: {t} total={tt:.2f}s',
+                      l=level, p=player, t=timings, tt=total)
+        _log.info('startup took {e:.2f}s with {n} players', e=elapsed, n=len(players))
+
+
     @defer.inlineCallbacks
     def _dbus_disconnected(self):
 
         # Called by DBus manager when DBus connection is lost.
 
-        if self._stopping:
+        if self._stopping or self._recovering:
             return
 
+        if self._dbus_recovery:
+            self._recovering = True
+            try:
+                yield self._recover_dbus()
+            except Exception as e:
+                _log.error('DBus recovery failed: {e!r}', e=e)
+            else:
+                self._recovering = False
+                return
+
         _log.warn('lost DBus connection: stopping')
         yield self.stop(skip_dbus=True)
         _log.warn('lost DBus connection: stopped')
 
 
     @defer.inlineCallbacks
-    def _create_player(self, level):
+    def _recover_dbus(self):
+
+        # Reconnects to DBus, respawning its daemon if needed, re-attaching
+        # to the players whose names show up on the new bus and replacing the
+        # others; the base player keeps playing, regardless.
+
+        _log.warn('lost DBus connection: recovering')
+        recovery_start_time = monotonic()
+        self._prober.stop()
+
+        bus_names = yield self.dbus_mgr.reconnect()
+
+        players = {}
+        for level, pooled_players in self._players.items():
+            for player in pooled_players:
+                players[player] = level
+        for level, out_players in self._players_out.items():
+            for player in out_players:
+                players[player] = level
+        if self._current_player:
+            players[self._current_player] = self._current_level
+        for player in self._base_loop.players:
+            players[player] = 0
+
+        reattached = replaced = 0
+        for player, level in players.items():
+            if player.dbus_name in bus_names:
+                try:
+                    yield player.reattach()
+                except Exception as e:
+                    _log.warn('failed reattaching {p!r}: {e!r}', p=player, e=e)
+                else:
+                    reattached += 1
+                    continue
+            if player is self._base_loop.active:
+                # Better playing uncontrolled than not playing at all.
+                _log.warn('base player left playing, detached from DBus')
+                continue
+            self._base_loop.forget(player)
+            _log.info('replacing detached player level={l!r} {p!r}', l=level, p=player)
+            if player in self._players[level]:
+                self._players[level].remove(player)
+                self._update_readiness(level)
+            self._players_out[level].discard(player)
+            player.stop(skip_dbus=True)
+            replaced += 1
+
+        _log.warn('recovered from DBus loss in {t:.3f}s: {r} players reattached, {s} replaced',
+                  t=monotonic() - recovery_start_time, r=reattached, s=replaced)
+        self._prober.start()
+        self._refill_pools()
+
+
+    @defer.inlineCallbacks
+    def _create_player(self, level, filename=None, urgent=False, **player_kwargs):
 
-        # Spawns a player with a random video file for the given `level`.
+        # Spawns a player with `filename`, or a random video file, for the
+        # given `level`, ahead of non-`urgent` spawns if `urgent` or level 0;
+        # `player_kwargs` override OMXPlayer arguments.
         # Ensures:
         # - Level 0 players loop.
         # - Player end is tracked.
 
         _log.info('creating player level={l!r}', l=level)
-        player = OMXPlayer(
-            self._get_file_for_level(level),
-            self,
-            layer=level,
-            alpha=0,
-            loop=(level == 0),
-            fadein=self._settings['levels'][str(level)]['fadein'],
-            fadeout=self._settings['levels'][str(level)]['fadeout'],
-        )
-        yield player.spawn(end_callable=lambda _: self._player_ended(player, level))
+        self._players_alive[level] += 1
+        queued_time = monotonic()
+        yield self._spawn_slots.acquire(urgent or level == 0)
+        if self._recycle and level != 0:
+            recycle_callable = lambda p: self._player_recycled(p, level)
+        else:
+            recycle_callable = None
+        try:
+            # The level may have no files left: the slot must be released.
+            if filename is None:
+                filename = self._get_file_for_level(level)
+            kwargs = dict(
+                layer=level,
+                alpha=0,
+                loop=(level == 0),
+                fadein=self._settings['levels'][str(level)]['fadein'],
+                fadeout=self._settings['levels'][str(level)]['fadeout'],
+                duration=self._metadata.duration(filename),
+                recycle_callable=recycle_callable,
+            )
+            kwargs.update(player_kwargs)
+            player = OMXPlayer(filename, self, **kwargs)
+            player.spawn_timings.append(('queued', monotonic() - queued_time))
+            yield player.spawn(end_callable=lambda _: self._player_ended(player, level))
+        except Exception:
+            self._players_alive[level] -= 1
+            raise
+        finally:
+            self._spawn_slots.release()
         return player
 
 
     @defer.inlineCallbacks
-    def _create_players(self):
+    def _create_level_player(self, level, urgent=False):
+
+        # Spawns a player for `level` and adds it to that level's pool,
+        # tracking it as being spawned while in progress.
+
+        self._players_spawning[level] += 1
+        if urgent:
+            self._levels_warming.add(level)
+        spawn_start_time = monotonic()
+        try:
+            player = yield self._create_player(level, urgent=urgent)
+        finally:
+            self._players_spawning[level] -= 1
+            if urgent:
+                self._levels_warming.discard(level)
+        self._pool_mgr.track_spawn(level, monotonic() - spawn_start_time)
+        self._add_pool_player(player, level)
+
+
+    def _add_pool_player(self, player, level):
 
-        # Populate or re-populate self._players.
+        # Adds `player` to the `level` pool.
 
-        for level in range(1, 4):
-            need_player_count = 2 if level != 3 else 1
-            have_player_count = len(self._players[level])
+        self._players[level].append(player)
+        self._update_readiness(level)
+
+        # A trigger may have been queued while this level's pool was empty.
+        comment = self._pool_mgr.pop_queued_trigger(level)
+        if comment is not None and not self._stopping:
+            self._change_play_level(level, '%s (queued)' % (comment,))
+
+
+    @defer.inlineCallbacks
+    def _create_players(self):
+
+        # Populate, re-populate or shrink self._players, as sized by the pool
+        # manager, requesting lower level players first (spawned concurrently,
+        # up to the spawn slots limit); levels with no warm players get one
+        # urgently, ahead of the remaining background pool fill.
+
+        spawns = []
+        sizes = self._pool_mgr.budgeted_sizes(*self._budget_in_use())
+        for level in self._pool_mgr.levels:
+            need_player_count = sizes[level]
+            have_player_count = self._pool_player_count(level)
+            if not self._catalog.has_files(level):
+                # Nothing to spawn with, until files show up.
+                need_player_count = min(need_player_count, have_player_count)
+            urgent = not self._players[level] and level not in self._levels_warming
             for _ in range(need_player_count-have_player_count):
-                player = yield self._create_player(level)
-                self._players[level].append(player)
+                spawns.append(self._create_level_player(level, urgent))
+                urgent = False
+            self._retire_players(level, have_player_count-need_player_count)
+        try:
+            yield defer.gatherResults(spawns, consumeErrors=True)
+        except defer.FirstError as e:
+            e.subFailure.raiseException()
+
+
+    def _refill_pools(self):
+
+        # Re-sizes the pools, like `_create_players`, for callers that don't
+        # wait on it: spawn failures are logged, instead of left unhandled.
+
+        d = self._create_players()
+        d.addErrback(self._refill_pools_failed)
+        return d
+
+
+    def _refill_pools_failed(self, failure):
+
+        # Called when re-sizing the pools failed spawning a player.
+
+        _log.warn('pool refill failed: {e}', e=failure.getErrorMessage())
+
+
+    def _pool_player_count(self, level):
+
+        # Players in, being spawned for or out of the `level` pool.
+
+        return (
+            len(self._players[level]) +
+            self._players_spawning[level] +
+            len(self._players_out[level])
+        )
+
+
+    def _budget_in_use(self):
+
+        # Returns a (players, decoder MiB) tuple, accounting for processes
+        # that aren't pool players, like the base, playing or stopping ones.
+
+        players = decoder_mb = 0
+        for level, alive_count in self._players_alive.items():
+            if level != 0:
+                alive_count -= self._pool_player_count(level)
+            alive_count = max(0, alive_count)
+            players += alive_count
+            decoder_mb += alive_count * self._pool_mgr.decoder_mb(level)
+        return players, decoder_mb
+
+
+    def _retire_players(self, level, count):
+
+        # Stops up to `count` warm players from the `level` pool.
+
+        players = self._players[level]
+        for _ in range(min(count, len(players))):
+            _log.info('retiring player level={l!r}', l=level)
+            players.pop().stop()
+        self._update_readiness(level)
+
+
+    def _probe_targets(self):
+
+        # Called by the health prober: pooled, current and base players.
+
+        targets = [player for players in self._players.values() for player in players]
+        for player in [self._current_player] + self._base_loop.players:
+            if player and player not in targets:
+                targets.append(player)
+        return targets
+
+
+    def _player_wedged(self, player):
+
+        # Called by the health prober when `player` seems wedged: stops it,
+        # replacing it if pooled, before a trigger gets to use it.
+
+        if self._stopping:
+            return
+
+        for level, players in self._players.items():
+            if player in players:
+                _log.warn('replacing wedged player level={l!r} {p!r}', l=level, p=player)
+                players.remove(player)
+                self._update_readiness(level)
+                self._pool_mgr.counters['wedged'] += 1
+                player.stop()
+                self._refill_pools()
+                return
+
+        if player is self._base_loop.active:
+            # Nothing better to do: stopping it would leave nothing playing.
+            _log.error('base player seems wedged: {p!r}', p=player)
+        elif player is self._base_loop.standby:
+            _log.warn('replacing wedged standby base player {p!r}', p=player)
+            self._base_loop.forget(player)
+            player.stop()
+        elif player is self._current_player:
+            _log.warn('stopping wedged current player {p!r}', p=player)
+            player.stop()
 
 
     def _get_player(self, level):
 
-        # Return the next player for level.
+        # Return the next player for level, or None if none is ready,
+        # retiring stale players.
+
+        while True:
+            try:
+                player = self._players[level].popleft()
+            except IndexError:
+                self._pool_mgr.track_miss(level)
+                return None
+            finally:
+                self._update_readiness(level)
+            if player not in self._stale_players:
+                break
+            _log.info('retiring stale player {p!r}', p=player)
+            player.stop()
+        self._pool_mgr.track_hit(level)
+        if self._recycle:
+            self._players_out[level].add(player)
+        return player
+
+
+    def _handle_empty_pool(self, level, comment):
+
+        # Applies the pool manager's policy to a `level` trigger that found
+        # no warm player.
+
+        policy = self._pool_mgr.empty_policy
+        if policy == 'queue':
+            self._pool_mgr.queue_trigger(level, comment)
+        elif policy == 'retrigger' and self._current_player:
+            self._pool_mgr.counters['retriggered'] += 1
+            d = self._current_player.restart()
+            d.addErrback(self._restart_failed, self._current_player)
+        else:
+            self._pool_mgr.counters['dropped'] += 1
+            _log.info('dropped level={l!r} trigger', l=level)
+
+        # Don't wait for the current player to end to refill the pool.
+        self._refill_pools()
+
+
+    def _restart_failed(self, failure, player):
+
+        # Called when restarting the current player, on an empty pool
+        # retrigger, fails: it still plays on until it ends.
 
-        return self._players[level].popleft()
+        _log.warn('restarting {p!r} failed: {f}', p=player, f=failure.value)
+
+
+    def _request_play_level(self, level, comment=''):
+
+        # Wired to `change_play_level`: passes requests on to the arbiter,
+        # unless `level` isn't configured, like when inputs have more level
+        # thresholds than there are levels.
+
+        if level != 0 and level not in self._pool_mgr.levels:
+            self._pool_mgr.counters['unknown-level'] += 1
+            _log.warn('level={l!r} not configured: ignored, comment={c!r}', l=level, c=comment)
+            return
+        self._arbiter.request(level, comment)
 
 
     def _change_play_level(self, new_level, comment=''):
         """
         Triggers video playing level change.
         Does nothing if:
-        - Startup isn't completed.
+        - `new_level` isn't ready, still spawning its first player.
         - `new_level` is less than or equal to the currently running level.
         """
 
         _log.info('new_level={l!r} comment={c!r}', l=new_level, c=comment)
 
+        if self._recovering:
+            _log.info('recovering from DBus loss: ignored')
+            return
+
         if new_level == 0:
             _log.info('will not go to rest ahead of time')
             return
 
-        if self._current_level == 3:
-            _log.info('will not override level 3 player')
+        if self._readiness.get(new_level) == 'starting':
+            self._pool_mgr.counters['not-ready'] += 1
+            _log.info('level={l!r} not ready: ignored', l=new_level)
+            return
+
+        top_level = self._pool_mgr.levels[-1]
+        if self._current_level == top_level:
+            _log.info('will not override level {l!r} player', l=top_level)
             return
 
         if new_level >= self._current_level:
-            retrigger = new_level == self._current_level
+            self._pool_mgr.track_trigger(new_level)
             new_player = self._get_player(level=new_level)
-            new_player.play(skip_fadein=retrigger)
+            if new_player is None:
+                self._handle_empty_pool(new_level, comment)
+                return
+            retrigger = new_level == self._current_level
+            self._prefetcher.track_playback(new_player.filename)
+            d = new_player.play(skip_fadein=retrigger)
+            d.addErrback(self._play_failed, new_player)
             if self._current_player:
                 if retrigger:
                     _log.info('re-triggering level {l!r}', l=new_level)
-                    self._current_player.stop()
+                    if self._recycle:
+                        self._current_player.rewind()
+                    else:
+                        self._current_player.stop()
                 else:
                     _log.debug('smoothly stopping current player')
-                    self._current_player.fadeout_and_stop()
+                    if self._recycle:
+                        self._current_player.fadeout_and_rewind()
+                    else:
+                        self._current_player.fadeout_and_stop()
             else:
                 _log.debug('no current player to smoothly stop')
             self._current_player = new_player
@@ -238,6 +720,41 @@ class PlayerManager(object):
         _log.info('will not trigger a lower level')
 
 
+    def _play_failed(self, failure, player):
+
+        # Called when playing a triggered player fails, such as when fading
+        # it in: it still plays, possibly hidden, until it ends.
+
+        _log.warn('playing {p!r} failed: {f}', p=player, f=failure.value)
+
+
+    def _player_recycled(self, player, level):
+
+        # Called when a `level` player is rewound (see _create_player): puts
+        # it back in the pool, unless it was used enough times.
+
+        _log.info('player level={l!r} rewound', l=level)
+        self._players_out[level].discard(player)
+        if player is self._current_player:
+            _log.debug('current player set to none')
+            self._current_player = None
+            self._current_level = 0
+        if self._stopping:
+            return
+        if self._recycle_uses and player.uses >= self._recycle_uses:
+            # Ending it will spawn a new player, likely with a different file.
+            _log.info('player level={l!r} used {u!r} times', l=level, u=player.uses)
+            player.stop()
+            return
+        if player in self._stale_players:
+            _log.info('retiring stale player {p!r}', p=player)
+            player.stop()
+            return
+        self._pool_mgr.counters['recycled'] += 1
+        self._add_pool_player(player, level)
+        self._refill_pools()
+
+
     @defer.inlineCallbacks
     def _player_ended(self, player, level):
 
@@ -245,22 +762,36 @@ class PlayerManager(object):
         # that new player is created such that it is ready when needed.
 
         _log.info('player level={l!r} ended', l=level)
+        self._players_alive[level] -= 1
         if self._stopping:
             return
+        if level == 0:
+            self._base_loop.player_ended(player)
+            if not self._recovering:
+                # Budget may have been freed for pools.
+                yield self._refill_pools()
+            return
         if player in self._players[level]:
             _log.warn('process ended unexpectedly')
             self._players[level].remove(player)
-        yield self._create_players()
+            self._update_readiness(level)
+        self._players_out[level].discard(player)
+        self._stale_players.discard(player)
         if player is self._current_player:
             _log.debug('current player set to none')
             self._current_player = None
-        self._current_level = 0
+            self._current_level = 0
+        if self._recovering:
+            # DBus recovery creates players once reconnected.
+            return
+        yield self._refill_pools()
 
 
     @defer.inlineCallbacks
     def stop(self, skip_dbus=False):
         """
-        Asks all players to stop (IOW: terminate) and exits cleanly.
+        Asks all players to stop (IOW: terminate) and exits cleanly, killing
+        whatever does not stop before the shutdown deadline.
         """
         if self._stopping:
             return
@@ -268,21 +799,80 @@ class PlayerManager(object):
         _log.info('stopping')
 
         self._stopping = True
-        self._wiring.change_play_level.unwire(self._change_play_level)
-        for level, players in self._players.items():
-            while players:
-                _log.info('stopping player level={l!r}', l=level)
-                yield players.popleft().stop(skip_dbus)
-                _log.info('stopped player level={l!r}', l=level)
-        
-        _log.info('stopping base player')
-        yield self._base_player.fadeout_and_stop()
-        _log.info('stopped base player')
-
-        _log.info('cleaning up dbus manager')
-        yield self.dbus_mgr.cleanup()
-        _log.info('cleaned up dbus manager')
-
+        shutdown = ShutdownCoordinator(self.reactor, self._settings)
+        shutdown.start()
+
+        # Introspection counts against the shutdown deadline: skipped if DBus
+        # is lost or there is no time to spare for it.
+        introspect_timeout = min(0.5, shutdown.remaining() - shutdown.kill_after)
+        if skip_dbus or introspect_timeout <= 0:
+            _log.info('dbus names introspection skipped')
+        else:
+            try:
+                dbus_names = yield self.dbus_mgr.introspect(timeout=introspect_timeout)
+            except Exception as e:
+                _log.warn('dbus names introspection failed: {e!r}', e=e)
+            else:
+                _log.info('dbus names: {s!r}', s=dbus_names)
+
+        self._wiring.change_play_level.unwire(self._request_play_level)
+        self._wiring.request_level_readiness.unwire(self._notify_level_readiness)
+        self._arbiter.cancel()
+        _log.info('arbiter stats: {s!r}', s=self._arbiter.stats())
+        self._prober.stop()
+        _log.info('health stats: {s!r}', s=self._prober.stats())
+        self._catalog.stop_watching()
+        _log.info('pool stats: {s!r}', s=self._pool_mgr.stats())
+        _log.info('prefetch stats: {s!r}', s=self._prefetcher.stats())
+        _log.info('dbus call stats: {s!r}', s=self.dbus_mgr.call_stats())
+        _log.info('dbus traffic stats: {s!r}', s=self.dbus_mgr.traffic_stats())
+        _log.info('fade out sync stats: {s!r}', s=self.fadeout_sync.stats())
+
+        # All players, pooled, in use or playing, are stopped concurrently.
+        players = {}
+        for level, pooled_players in self._players.items():
+            for player in pooled_players:
+                players[player] = level
+            pooled_players.clear()
+        for level, out_players in self._players_out.items():
+            for player in out_players:
+                players[player] = level
+        if self._current_player:
+            players[self._current_player] = self._current_level
+        base_player, standby_base_player = self._base_loop.stop()
+        _log.info('base loop stats: {s!r}', s=self._base_loop.stats())
+        if standby_base_player:
+            players[standby_base_player] = 0
+        players.pop(base_player, None)
+
+        dbus_timeout = max(0, min(1, shutdown.remaining() - shutdown.kill_after))
+        stoppables = [
+            (
+                'player level=%r %s' % (level, player.filename),
+                lambda player=player: player.stop(skip_dbus, dbus_timeout, shutdown.kill_after),
+                player.kill,
+            )
+            for player, level in players.items()
+        ]
+        if base_player:
+            stoppables.append((
+                'base player',
+                lambda: base_player.fadeout_and_stop(
+                    skip_dbus, dbus_timeout, shutdown.kill_after,
+                ),
+                base_player.kill,
+            ))
+        yield shutdown.run_phase('players', stoppables)
+
+        self._prefetcher.cleanup()
+
+        yield shutdown.run_phase('dbus', [(
+            'dbus daemon',
+            lambda: self.dbus_mgr.cleanup(shutdown.kill_after),
+            None,
+        )])
+
+        shutdown.report()
         _log.info('stopped')
         self.done.callback(None)
 
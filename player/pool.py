@@ -0,0 +1,331 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/pool.py
+# ----------------------------------------------------------------------------
+
+"""
+Trigger rate driven player pool sizing and usage tracking.
+"""
+
+import collections
+import math
+from time import monotonic
+
+from twisted.internet import defer
+from twisted import logger
+
+
+
+_log = logger.Logger(namespace='player.pool')
+
+
+
+class PoolManager(object):
+
+    """
+    Decides how many warm (spawned and paused) players each level should have,
+    based on how often each level is triggered and how long spawning takes.
+
+    Pool sizes are capped by a global budget of player processes and
+    estimated decoder memory: lower priority pools are shrunk first.
+
+    Also holds the policy applied when a level is triggered with no warm
+    players available, and tracks pool usage counters.
+    """
+
+    # What to do when a level is triggered and its pool is empty:
+    # - 'queue': play it as soon as a player is ready, unless too late.
+    # - 'drop': ignore the trigger.
+    # - 'retrigger': restart the currently playing player, if any.
+    EMPTY_POLICIES = ('queue', 'drop', 'retrigger')
+
+    def __init__(self, settings):
+
+        """
+        Initializes the pool manager from `settings`, a dict with:
+        - ['levels'][*], where '0' is the base level, with no pool, and the
+          other levels have the optional keys:
+          - 'pool_size': warm players before the level is triggered,
+            defaults to 1.
+          - 'priority': higher priority pools are shrunk last, to fit the
+            budget, defaults to the level number.
+          - 'decoder_mb': estimated decoder memory per player, in MiB,
+            defaults to the budget's 'player_decoder_mb'; also for level 0.
+        - ['player']['pool'], with the optional keys:
+          - 'min_size': minimum warm players per level, defaults to 1.
+          - 'max_size': maximum warm players per level, defaults to 3.
+          - 'rate_window': seconds over which trigger rates are tracked.
+          - 'empty_policy': one of EMPTY_POLICIES, defaults to 'queue'.
+          - 'queue_timeout': seconds after which queued triggers are dropped.
+        - ['player']['budget'], with the optional keys:
+          - 'max_players': maximum player processes, including the ones
+            playing or stopping; 0, the default, means no limit.
+          - 'decoder_mb': maximum estimated decoder memory, in MiB, for all
+            player processes; 0, the default, means no limit.
+          - 'player_decoder_mb': default estimated decoder memory per player,
+            in MiB, defaults to 32.
+        """
+
+        pool_settings = settings.get('player', {}).get('pool', {})
+        self._min_size = pool_settings.get('min_size', 1)
+        self._max_size = pool_settings.get('max_size', 3)
+        self._rate_window = pool_settings.get('rate_window', 60)
+        self.empty_policy = pool_settings.get('empty_policy', 'queue')
+        self._queue_timeout = pool_settings.get('queue_timeout', 1)
+
+        if self.empty_policy not in self.EMPTY_POLICIES:
+            raise ValueError('Invalid empty pool policy %r.' % (self.empty_policy,))
+
+        budget_settings = settings.get('player', {}).get('budget', {})
+        self._max_players = budget_settings.get('max_players', 0)
+        self._max_decoder_mb = budget_settings.get('decoder_mb', 0)
+        player_decoder_mb = budget_settings.get('player_decoder_mb', 32)
+
+        # keys/values: integer levels/initial pool sizes, priorities and
+        # per player decoder memory estimates
+        levels = {int(level): info for level, info in settings['levels'].items()}
+        self._initial_sizes = {
+            level: info.get('pool_size', 1)
+            for level, info in levels.items() if level != 0
+        }
+        self._priorities = {
+            level: info.get('priority', level)
+            for level, info in levels.items() if level != 0
+        }
+        self._decoder_mb = {
+            level: info.get('decoder_mb', player_decoder_mb)
+            for level, info in levels.items()
+        }
+
+        # Sorted pooled levels, and the same, lowest priority first.
+        self.levels = sorted(self._initial_sizes)
+        self._shrink_order = sorted(self.levels, key=lambda l: (self._priorities[l], l))
+
+        # Latest budgeted per level pool sizes.
+        self._budgeted_sizes = {}
+
+        # keys/values: integer levels/deque of trigger monotonic times
+        self._trigger_times = collections.defaultdict(collections.deque)
+
+        # keys/values: integer levels/average spawn latency, in seconds
+        self._spawn_latency = {}
+
+        # Single pending (level, comment, monotonic time) trigger, if any.
+        self._queued_trigger = None
+
+        # Usage counters: 'hits', 'misses', 'queued', 'dropped', ...
+        self.counters = collections.Counter()
+        self._spawn_latency_max = 0
+
+
+    def _expire_triggers(self, level, now):
+
+        # Forget `level` triggers that are older than the tracking window.
+
+        trigger_times = self._trigger_times[level]
+        while trigger_times and now - trigger_times[0] > self._rate_window:
+            trigger_times.popleft()
+
+
+    def track_trigger(self, level):
+        """
+        Tracks a trigger of `level`.
+        """
+        now = monotonic()
+        self._trigger_times[level].append(now)
+        self._expire_triggers(level, now)
+
+
+    def trigger_rate(self, level):
+        """
+        Returns the `level` trigger rate, in triggers per second.
+        """
+        self._expire_triggers(level, monotonic())
+        return len(self._trigger_times[level]) / self._rate_window
+
+
+    def track_spawn(self, level, seconds):
+        """
+        Tracks that spawning a `level` player took `seconds`.
+        """
+        previous = self._spawn_latency.get(level)
+        if previous is None:
+            self._spawn_latency[level] = seconds
+        else:
+            # Exponentially weighted, favouring recent spawns.
+            self._spawn_latency[level] = 0.7 * previous + 0.3 * seconds
+        self._spawn_latency_max = max(self._spawn_latency_max, seconds)
+        self.counters['spawns'] += 1
+        self.counters['spawn_time'] += seconds
+
+
+    def track_hit(self, level):
+        """
+        Tracks that a `level` trigger found a warm player.
+        """
+        self.counters['hits'] += 1
+        _log.debug('hit level={l!r}', l=level)
+
+
+    def track_miss(self, level):
+        """
+        Tracks that a `level` trigger found no warm player.
+        """
+        self.counters['misses'] += 1
+        _log.warn('miss level={l!r}: applying {p!r} policy', l=level,
+                  p=self.empty_policy)
+
+
+    def desired_size(self, level):
+        """
+        Returns how many warm players `level` should have.
+        """
+        # Size the pool to cover the triggers expected while a replacement
+        # player is being spawned, plus the one that will take the trigger.
+        if not self._trigger_times[level]:
+            size = self._initial_sizes.get(level, 1)
+        else:
+            expected_triggers = self.trigger_rate(level) * self._spawn_latency.get(level, 0)
+            size = 1 + math.ceil(expected_triggers)
+        return max(self._min_size, min(self._max_size, size))
+
+
+    def decoder_mb(self, level):
+        """
+        Returns the estimated decoder memory of a `level` player, in MiB.
+        """
+        return self._decoder_mb[level]
+
+
+    def budgeted_sizes(self, players, decoder_mb):
+        """
+        Returns a dict of levels/pool sizes: the desired sizes, shrunk such
+        that pooled players fit in the available budget, given that the
+        remaining `players` and `decoder_mb` are in use elsewhere.
+
+        Lower priority pools are shrunk down to one player first, then to
+        none, such that higher priority levels keep warm players longest.
+        """
+        sizes = {level: self.desired_size(level) for level in self.levels}
+        available_players = self._max_players - players
+        available_mb = self._max_decoder_mb - decoder_mb
+
+        def over_budget():
+            if self._max_players and sum(sizes.values()) > available_players:
+                return True
+            if self._max_decoder_mb:
+                pooled_mb = sum(size * self._decoder_mb[l] for l, size in sizes.items())
+                return pooled_mb > available_mb
+            return False
+
+        for floor in (1, 0):
+            for level in self._shrink_order:
+                while sizes[level] > floor and over_budget():
+                    sizes[level] -= 1
+
+        if sizes != self._budgeted_sizes:
+            if any(sizes[level] < self.desired_size(level) for level in self.levels):
+                self.counters['budget-shrinks'] += 1
+                _log.info('pool sizes shrunk to fit budget: {s!r}', s=sizes)
+            self._budgeted_sizes = sizes
+        return sizes
+
+
+    def queue_trigger(self, level, comment):
+        """
+        Queues a `level` trigger, replacing any pending lower level one.
+        """
+        if self._queued_trigger and self._queued_trigger[0] > level:
+            _log.info('not queueing level={l!r}: higher level queued', l=level)
+            self.counters['dropped'] += 1
+            return
+        self._queued_trigger = (level, comment, monotonic())
+        self.counters['queued'] += 1
+
+
+    def pop_queued_trigger(self, level):
+        """
+        Returns the comment of a still valid queued `level` trigger, if any,
+        forgetting it; returns None otherwise.
+        """
+        if not self._queued_trigger or self._queued_trigger[0] != level:
+            return None
+        _level, comment, queued_time = self._queued_trigger
+        self._queued_trigger = None
+        if monotonic() - queued_time > self._queue_timeout:
+            _log.info('queued level={l!r} trigger expired', l=level)
+            self.counters['expired'] += 1
+            return None
+        return comment
+
+
+    def stats(self):
+        """
+        Returns a dict with pool usage counters and per-level details.
+        """
+        counters = dict(self.counters)
+        spawns = counters.pop('spawns', 0)
+        spawn_time = counters.pop('spawn_time', 0)
+        result = {
+            'counters': counters,
+            'spawns': spawns,
+            'spawn_latency_avg': spawn_time / spawns if spawns else None,
+            'spawn_latency_max': self._spawn_latency_max,
+            'levels': {
+                level: {
+                    'trigger_rate': self.trigger_rate(level),
+                    'desired_size': self.desired_size(level),
+                    'budgeted_size': self._budgeted_sizes.get(level),
+                    'spawn_latency': self._spawn_latency.get(level),
+                }
+                for level in self.levels
+            },
+        }
+        return result
+
+
+
+
+class SpawnSlots(object):
+
+    """
+    Limits how many players are spawned at the same time, serving urgent
+    requests, like the first player for a level, ahead of background ones,
+    each in request order.
+    """
+
+    def __init__(self, limit):
+
+        self._available = limit
+
+        # keys/values: urgent flags/deques of deferreds waiting for a slot
+        self._waiting = {True: collections.deque(), False: collections.deque()}
+
+
+    def acquire(self, urgent=False):
+        """
+        Returns a deferred that fires when a spawn slot is available.
+        """
+        if self._available > 0:
+            self._available -= 1
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._waiting[urgent].append(d)
+        return d
+
+
+    def release(self):
+        """
+        Releases a spawn slot, handing it to the next waiting request.
+        """
+        for urgent in (True, False):
+            if self._waiting[urgent]:
+                self._waiting[urgent].popleft().callback(None)
+                return
+        self._available += 1
+
+
+# ----------------------------------------------------------------------------
+# player/pool.py
+# ----------------------------------------------------------------------------
@@ -0,0 +1,290 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/prefetch.py
+# ----------------------------------------------------------------------------
+
+"""
+Page cache prefetching of video files.
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import mmap
+import os
+
+from twisted.internet import defer, threads
+from twisted import logger
+
+
+
+_log = logger.Logger(namespace='player.prefetch')
+
+
+
+_PAGE_SIZE = mmap.PAGESIZE
+
+# Pages sampled, evenly spaced, when checking if a file is resident.
+_RESIDENCY_SAMPLES = 8
+
+# What libc's mmap returns on failure.
+_MAP_FAILED = ctypes.c_void_p(-1).value
+
+
+
+def _libc_mlock():
+
+    # Returns libc, with its mmap, munmap, mlock and munlock functions set
+    # up, or None if unavailable.
+
+    libc_name = ctypes.util.find_library('c')
+    if not libc_name:
+        return None
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    libc.mmap.argtypes = (
+        ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int,
+        ctypes.c_int, ctypes.c_long,
+    )
+    libc.mmap.restype = ctypes.c_void_p
+    for function in (libc.munmap, libc.mlock, libc.munlock):
+        function.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+        function.restype = ctypes.c_int
+    return libc
+
+
+
+class _LockedMapping(object):
+
+    """
+    A memory mapped, memory locked, file region.
+
+    The mapping is read-only and shared, such that locking it pins the page
+    cache pages players read, instead of private copies of them; it is made
+    via libc, given that mmap objects only expose writable buffers' address.
+    """
+
+    def __init__(self, filename, length, libc):
+
+        self._libc = libc
+        self._address = None
+        self._length = length
+        with open(filename, 'rb') as f:
+            address = libc.mmap(
+                None, length, mmap.PROT_READ, mmap.MAP_SHARED, f.fileno(), 0,
+            )
+        if address in (None, _MAP_FAILED):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.mlock(address, length) != 0:
+            errno = ctypes.get_errno()
+            libc.munmap(address, length)
+            raise OSError(errno, os.strerror(errno))
+        self._address = address
+
+
+    def close(self):
+        """
+        Unlocks and unmaps the file region.
+        """
+        if self._address is not None:
+            self._libc.munlock(self._address, self._length)
+            self._libc.munmap(self._address, self._length)
+            self._address = None
+
+
+
+class ClipPrefetcher(object):
+
+    """
+    Warms video files in the page cache ahead of playback, within a memory
+    budget, forgetting about the least recently used files when needed.
+
+    Supports two modes:
+    - 'fadvise': asks the kernel to read files ahead, which it may still
+      evict under memory pressure; the budget limits what is asked for.
+    - 'mlock': memory maps and locks files, guaranteeing they stay resident;
+      the budget limits locked memory.
+
+    Tracks hit/miss counters on whether files are resident at playback time.
+    """
+
+    MODES = ('off', 'fadvise', 'mlock')
+
+    def __init__(self, settings):
+
+        """
+        Initializes the prefetcher from `settings`, a dict with the optional
+        ['player'] keys:
+        - 'prefetch': one of MODES, defaults to 'fadvise'.
+        - 'prefetch_budget_mb': memory budget, in MiB, defaults to 64.
+        """
+
+        player_settings = settings.get('player', {})
+        self._mode = player_settings.get('prefetch', 'fadvise')
+        self._budget = player_settings.get('prefetch_budget_mb', 64) * 1024 * 1024
+
+        if self._mode not in self.MODES:
+            raise ValueError('Invalid prefetch mode %r.' % (self._mode,))
+        if self._mode == 'fadvise' and not hasattr(os, 'posix_fadvise'):
+            _log.warn('posix_fadvise not available: not prefetching')
+            self._mode = 'off'
+
+        self._libc = None
+        if self._mode == 'mlock':
+            self._libc = _libc_mlock()
+            if not self._libc:
+                _log.warn('mlock not available: using fadvise')
+                self._mode = 'fadvise'
+
+        # keys/values: filenames/(warmed length, _LockedMapping or None),
+        # least recently used first
+        self._warm_files = collections.OrderedDict()
+        self._warm_bytes = 0
+
+        self.counters = collections.Counter()
+
+
+    def _evict(self, needed):
+
+        # Forgets least recently used files until `needed` bytes fit.
+
+        while self._warm_files and self._warm_bytes + needed > self._budget:
+            filename, (length, mapping) = self._warm_files.popitem(last=False)
+            self._warm_bytes -= length
+            if mapping:
+                mapping.close()
+            self.counters['evicted'] += 1
+            _log.debug('evicted {f!r}', f=filename)
+
+
+    @defer.inlineCallbacks
+    def warm(self, filename):
+        """
+        Warms the page cache with `filename`, or as much of its start as fits
+        in the budget. Returns a deferred that fires when done.
+        """
+        if self._mode == 'off':
+            return
+
+        if filename in self._warm_files:
+            self._warm_files.move_to_end(filename)
+            return
+
+        try:
+            length = min(os.path.getsize(filename), self._budget)
+        except OSError as e:
+            _log.warn('cannot warm {f!r}: {e!r}', f=filename, e=e)
+            return
+        if not length:
+            return
+
+        self._evict(length)
+
+        # Account for it now: other warm requests may come in meanwhile.
+        self._warm_files[filename] = (length, None)
+        self._warm_bytes += length
+
+        # File I/O happens in a thread, not to delay the reactor.
+        mapping = None
+        try:
+            if self._mode == 'mlock':
+                mapping = yield threads.deferToThread(
+                    _LockedMapping, filename, length, self._libc,
+                )
+            else:
+                yield threads.deferToThread(self._fadvise, filename, length)
+        except OSError as e:
+            _log.warn('failed warming {f!r}: {e!r}', f=filename, e=e)
+            if filename in self._warm_files:
+                del self._warm_files[filename]
+                self._warm_bytes -= length
+            return
+
+        if filename in self._warm_files:
+            self._warm_files[filename] = (length, mapping)
+        elif mapping:
+            # Evicted while being locked.
+            mapping.close()
+        self.counters['warmed'] += 1
+        _log.debug('warmed {l} bytes of {f!r}', l=length, f=filename)
+
+
+    @staticmethod
+    def _fadvise(filename, length):
+
+        # Asks the kernel to read the first `length` bytes of `filename` ahead.
+
+        with open(filename, 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, length, os.POSIX_FADV_WILLNEED)
+
+
+    @staticmethod
+    def _is_resident(filename, length):
+
+        # Returns True if evenly spaced pages in the first `length` bytes of
+        # `filename` are in the page cache, by trying to read them without
+        # blocking; returns None if that can't be determined.
+
+        if not hasattr(os, 'RWF_NOWAIT'):
+            return None
+        buf = bytearray(1)
+        step = max(length // _RESIDENCY_SAMPLES, _PAGE_SIZE)
+        with open(filename, 'rb') as f:
+            for offset in range(0, length, step):
+                try:
+                    os.preadv(f.fileno(), [buf], offset, os.RWF_NOWAIT)
+                except BlockingIOError:
+                    return False
+                except OSError:
+                    return None
+        return True
+
+
+    @defer.inlineCallbacks
+    def track_playback(self, filename):
+        """
+        Tracks that `filename` started playing, counting a hit if it was
+        resident in the page cache, a miss otherwise, checked in a thread.
+        Returns a deferred that fires when done.
+        """
+        if self._mode == 'off':
+            return
+
+        entry = self._warm_files.get(filename)
+        if entry:
+            self._warm_files.move_to_end(filename)
+        length = entry[0] if entry else min(_PAGE_SIZE * _RESIDENCY_SAMPLES, self._budget)
+        try:
+            resident = yield threads.deferToThread(self._is_resident, filename, length)
+        except OSError as e:
+            _log.warn('cannot check {f!r}: {e!r}', f=filename, e=e)
+            return
+        if resident is None:
+            # Can't tell: assume warmed files are resident.
+            resident = entry is not None
+        self.counters['hits' if resident else 'misses'] += 1
+        _log.debug('{f!r} resident: {r!r}', f=filename, r=resident)
+
+
+    def stats(self):
+        """
+        Returns a dict with counters and memory usage.
+        """
+        result = dict(self.counters)
+        result['mode'] = self._mode
+        result['warm_files'] = len(self._warm_files)
+        result['warm_bytes'] = self._warm_bytes
+        return result
+
+
+    def cleanup(self):
+        """
+        Releases any locked memory.
+        """
+        self._evict(self._budget + 1)
+
+
+# ----------------------------------------------------------------------------
+# player/prefetch.py
+# ----------------------------------------------------------------------------
@@ -0,0 +1,164 @@
+# ----------------------------------------------------------------------------
+# vim: ts=4:sw=4:et
+# ----------------------------------------------------------------------------
+# player/shutdown.py
+# ----------------------------------------------------------------------------
+
+"""
+Asyncronous, Twisted based, deadline bounded shutdown.
+"""
+
+from time import monotonic
+
+from twisted.internet import defer
+from twisted import logger
+
+
+
+_log = logger.Logger(namespace='player.shutdown')
+
+
+
+class ShutdownCoordinator(object):
+
+    """
+    Stops things concurrently, in sequential phases, under one global deadline.
+
+    Things not stopped `kill_after` seconds before the deadline are killed;
+    things not gone `kill_after` seconds after that are logged as leaked.
+    """
+
+    def __init__(self, reactor, settings):
+
+        """
+        Initializes the coordinator:
+        - `reactor` is the Twisted reactor.
+        - `settings` is a dict with the optional ['player']['shutdown'] keys:
+          - 'deadline': seconds to stop everything in, defaults to 3.
+          - 'kill_after': seconds given to a SIGTERM before sending a SIGKILL
+            and to a SIGKILL before giving up, defaults to 1.
+        """
+
+        self._reactor = reactor
+
+        shutdown_settings = settings.get('player', {}).get('shutdown', {})
+        self._deadline_duration = shutdown_settings.get('deadline', 3)
+        self.kill_after = shutdown_settings.get('kill_after', 1)
+
+        self._start_time = None
+        self._deadline = None
+
+        # (phase name, duration) tuples, in phase order.
+        self._phase_durations = []
+
+        # Names of things that were killed and that could not be stopped.
+        self.killed = []
+        self.leaked = []
+
+
+    def start(self):
+        """
+        Starts the global deadline clock.
+        """
+        self._start_time = monotonic()
+        self._deadline = self._start_time + self._deadline_duration
+
+
+    def remaining(self):
+        """
+        Returns the seconds left before the global deadline, possibly negative.
+        """
+        return self._deadline - monotonic()
+
+
+    def _within(self, d, timeout):
+
+        # Returns a deferred that fires with the result of `d` or fails with a
+        # TimeoutError after `timeout` seconds; unlike `d.addTimeout` it does
+        # not cancel `d`, that may still complete after the deadline.
+
+        waiter = defer.Deferred()
+
+        def _timed_out():
+            if not waiter.called:
+                waiter.errback(defer.TimeoutError('deadline exceeded'))
+
+        timeout_dc = self._reactor.callLater(max(timeout, 0), _timed_out)
+
+        def _done(result):
+            if timeout_dc.active():
+                timeout_dc.cancel()
+            if not waiter.called:
+                waiter.callback(result)
+            # Late failures are of no interest.
+            return None
+
+        d.addBoth(_done)
+        return waiter
+
+
+    @defer.inlineCallbacks
+    def _stop_one(self, name, stop_callable, kill_callable):
+
+        # Calls `stop_callable`, calling `kill_callable` if it doesn't complete
+        # before the deadline, and tracking killed and leaked things.
+
+        stop_timeout = self.remaining() - self.kill_after
+        try:
+            yield self._within(defer.maybeDeferred(stop_callable), stop_timeout)
+            return
+        except defer.TimeoutError:
+            _log.warn('{n} not stopped in time', n=name)
+        except Exception as e:
+            _log.warn('{n} failed stopping: {e!r}', n=name, e=e)
+
+        if kill_callable is None:
+            self.leaked.append(name)
+            return
+
+        self.killed.append(name)
+        try:
+            yield self._within(defer.maybeDeferred(kill_callable), self.kill_after)
+        except Exception as e:
+            _log.error('{n} not killed: {e!r}', n=name, e=e)
+            self.leaked.append(name)
+
+
+    @defer.inlineCallbacks
+    def run_phase(self, phase, stoppables):
+        """
+        Stops `stoppables`, an iterable of (name, stop_callable, kill_callable)
+        tuples, concurrently, and tracks the phase duration:
+        - `stop_callable` is called and should return a deferred.
+        - `kill_callable`, if not None, is called if `stop_callable` fails or
+          doesn't complete in time.
+        Returns a deferred that fires when done, never failing.
+        """
+        phase_start = monotonic()
+        stoppables = list(stoppables)
+        _log.info('{p} phase: stopping {c} things', p=phase, c=len(stoppables))
+        yield defer.DeferredList([
+            self._stop_one(name, stop_callable, kill_callable)
+            for name, stop_callable, kill_callable in stoppables
+        ])
+        duration = monotonic() - phase_start
+        self._phase_durations.append((phase, duration))
+        _log.info('{p} phase: done in {d:.3f}s', p=phase, d=duration)
+
+
+    def report(self):
+        """
+        Logs how long each phase took, and what was killed or leaked.
+        """
+        total = monotonic() - self._start_time
+        phases = ', '.join('%s=%.3fs' % item for item in self._phase_durations)
+        _log.info('shutdown took {t:.3f}s: {p}', t=total, p=phases)
+        if self.killed:
+            _log.warn('killed: {k!r}', k=self.killed)
+        if self.leaked:
+            _log.error('leaked: {l!r}', l=self.leaked)
+
+
+# ----------------------------------------------------------------------------
+# player/shutdown.py
+# ----------------------------------------------------------------------------